@@ -1,28 +1,129 @@
 """
 Run actions based on the predictions
 
-This module contains functions to perform various actions based on the predictions made by the HAI (Human Augmentation Intelligence) system. The actions include posting private comments, updating custom fields, and writing to a CSV file.
+This module contains functions to perform various actions based on the predictions made by the HAI (Human Augmentation Intelligence) system. The actions include posting private comments, updating custom fields, and writing the results to output files.
+
+The actions of a report run concurrently: the private comment, every custom field and the result output are separate
+actions. The number of actions in flight across all reports is limited by ACTION_CONCURRENCY, so a run with many
+concurrent reports does not flood the API with writes.
+
+Custom fields are only written when their value changes. The current values are read from the report as returned by
+the API, or, when the report does not include them, from the values this tool wrote before (kept in the result
+cache). Custom fields whose ID is not configured are skipped.
+
+The Hai result and the enabled actions of a report are written to the action journal before the actions run, and
+every action that succeeds is recorded. `replay_journal` runs the unfinished actions of a previous run again, so a
+report whose process died halfway through its actions is not sent to Hai a second time.
 
 Functions:
-- hai_actions: Runs the actions based on the predictions.
+- hai_actions: Runs the actions based on the predictions and returns the timing and error of every action.
+- replay_journal: Replays the unfinished actions of the reports in the action journal.
+- check_action_results: Raises an ActionError when one of the actions of a report failed.
 - post_private_comment: Posts a private comment on a report with the predicted validity, complexity, ownership, and reasoning.
-- update_custom_field: Updates the custom fields of a report with the predicted validity, complexity, product area, and squad owner.
-- write_to_csv: Writes the report ID, predicted validity, complexity, product area, and squad owner to a CSV file.
+- update_custom_field_value: Updates a single custom field of a report.
+- current_custom_field_values: Returns the current custom field values of a report.
+- write_result: Writes the result of a report to the result sink, for the CSV, JSONL and columnar output files.
 """
 
-import csv
+import asyncio
+import time
+from collections import namedtuple
 
-import requests
+import aiohttp
+import metrics
+from api import post_json
+from cache import get_cache
 from config import load_settings
+from journal import get_journal
+from sink import get_sink, result_row
 from termcolor import colored
 
 settings = load_settings()
 
-def hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, report_id, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose):
+ActionResult = namedtuple("ActionResult", ["name", "seconds", "error"])
+
+REPORTS_REPLAYED = "Reports replayed from the journal"
+RESULT_OUTPUT = "Result output"
+CUSTOM_FIELDS_WRITTEN = "Custom fields written"
+CUSTOM_FIELDS_UNCHANGED = "Custom fields skipped because they are unchanged"
+CUSTOM_FIELDS_NOT_CONFIGURED = "Custom fields skipped because their ID is not configured"
+
+class ActionError(Exception):
+    """
+    Raised when one or more actions of a report failed.
+    """
+    def __init__(self, report_id, results):
+        self.report_id = report_id
+        self.results = results
+        failures = ", ".join(f"{result.name} ({result.error})" for result in results)
+        super().__init__(f"{len(results)} action(s) failed for report {report_id}: {failures}")
+
+_action_semaphore = None
+_action_semaphore_loop = None
+
+def get_action_semaphore():
+    """
+    Returns the semaphore that limits the number of actions in flight on the running event loop.
+
+    Returns:
+        asyncio.Semaphore: The semaphore.
+    """
+    global _action_semaphore, _action_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _action_semaphore is None or _action_semaphore_loop is not loop:
+        _action_semaphore = asyncio.Semaphore(max(1, settings.action_concurrency))
+        _action_semaphore_loop = loop
+    return _action_semaphore
+
+async def run_action(name, action):
+    """
+    Runs a single action and measures how long it took.
+
+    Args:
+        name (str): The name of the action, e.g. "Private comment".
+        action (coroutine): The action.
+
+    Returns:
+        ActionResult: The name, the duration in seconds and the error of the action, None when it succeeded.
+    """
+    async with get_action_semaphore():
+        start_time = time.monotonic()
+        try:
+            await action
+            error = None
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            error = e
+        seconds = time.monotonic() - start_time
+    metrics.incr("Actions run")
+    if error is None:
+        print(colored(f"{name}: done in {seconds:.2f}s", 'light_green'))
+    else:
+        metrics.incr("Actions failed")
+        print(colored(f"{name}: failed after {seconds:.2f}s: {error}", 'light_red'))
+    return ActionResult(name, seconds, error)
+
+def check_action_results(report_id, results):
+    """
+    Raises an ActionError when one of the actions of a report failed.
+
+    Args:
+        report_id (str): The ID of the report.
+        results (list): The results returned by `hai_actions`.
+
+    Raises:
+        ActionError: If one or more actions failed.
+    """
+    failed = [result for result in results or [] if result.error is not None]
+    if failed:
+        raise ActionError(report_id, failed)
+
+async def hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, report_id, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, report_data=None, resume=False):
     """
     Run actions based on the predictions.
 
-    This function runs the actions based on the predictions made by the HAI system. The actions include posting a private comment, updating custom fields, and writing to a CSV file.
+    This function runs the actions based on the predictions made by the HAI system. The actions include posting a private comment, updating custom fields, and writing the result to the output files.
+    All actions run at the same time, and a failing action does not stop the others. Custom fields that already
+    hold the predicted value are not written again.
 
     Args:
     - predictedValidity: The predicted validity of the report.
@@ -38,24 +139,104 @@ def hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedVal
     - report_id: The ID of the report.
     - comment_hai_flag: A flag indicating whether to post a private comment.
     - custom_field_hai_flag: A flag indicating whether to update custom fields.
-    - csv_output_flag: A flag indicating whether to write to a CSV file.
+    - csv_output_flag: A flag indicating whether to write the result to the output files.
     - verbose: A flag indicating whether to print verbose output.
+    - report_data: The report as returned by the HackerOne API, if it has been retrieved, for its current custom field values.
+    - resume: A flag indicating whether the actions are replayed from the journal, skipping the actions that already succeeded.
 
     Returns:
-    - None
+    - list: An ActionResult with the name, duration and error of every action that ran.
     """
+    journal = None
+    names = []
+
+    def result_flushed():
+        # The result output is only done once its row has left the buffer of the sink.
+        if journal is not None:
+            journal.action_done(report_id, RESULT_OUTPUT)
+            journal.finish_when_done(report_id, names)
+
+    actions = []
     if comment_hai_flag:
-        print(colored("Posting Private Comment...", 'light_blue'))
-        post_private_comment(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, verbose)
-        print(colored("Private Comment is successfully posted", 'light_green'))
+        actions.append(("Private comment", post_private_comment(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, verbose)))
     if custom_field_hai_flag:
-        print(colored("Updating Custom Fields...", 'light_blue'))
-        update_custom_field(report_id, predictedValidity, predictedComplexity, productArea, squadOwner, verbose)
-        print(colored("Custom Fields have been successfully updated", 'light_green'))
+        field_updates = custom_field_updates(predictedValidity, predictedComplexity, productArea, squadOwner)
+        metrics.incr(CUSTOM_FIELDS_NOT_CONFIGURED, len(custom_field_ids()) - len(field_updates))
+        current_values = current_custom_field_values(report_id, report_data)
+        for field_id, field_value in field_updates.items():
+            if field_id in current_values and str(current_values[field_id]) == str(field_value):
+                metrics.incr(CUSTOM_FIELDS_UNCHANGED)
+                if verbose:
+                    print(colored(f"Custom field {field_id} already is {field_value}, skipping it", 'light_grey'))
+                continue
+            actions.append((f"Custom field {field_id}", update_custom_field_value(report_id, field_id, field_value, verbose)))
     if csv_output_flag:
-        write_to_csv(report_id, predictedValidity, predictedComplexity, productArea, squadOwner)
+        actions.append((RESULT_OUTPUT, write_result(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, on_flushed=result_flushed)))
+    if not actions:
+        return []
+
+    journal = get_journal()
+    names.extend(name for name, _ in actions)
+    if journal is not None and resume:
+        done = journal.done_actions(report_id)
+        for name, action in actions:
+            if name in done:
+                action.close()
+        actions = [(name, action) for name, action in actions if name not in done]
+    elif journal is not None:
+        flags = {"comment_hai_flag": comment_hai_flag, "custom_field_hai_flag": custom_field_hai_flag, "csv_output_flag": csv_output_flag}
+        journal.begin(report_id, (predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner), flags)
+
+    print(colored(f"Running {len(actions)} action(s) for report {report_id}...", 'light_blue'))
+    results = list(await asyncio.gather(*(run_action(name, journaled(journal, report_id, name, action)) for name, action in actions)))
+    if journal is not None:
+        journal.finish_when_done(report_id, names)
+    return results
+
+async def journaled(journal, report_id, name, action):
+    """
+    Runs an action and records it as done in the action journal when it succeeds.
+
+    The result output is recorded when its row is flushed by the sink instead, see `hai_actions`.
+
+    Args:
+        journal (ActionJournal): The action journal, None when it is disabled.
+        report_id (str): The ID of the report.
+        name (str): The name of the action.
+        action (coroutine): The action.
+    """
+    await action
+    if journal is not None and name != RESULT_OUTPUT:
+        journal.action_done(report_id, name)
+
+async def replay_journal(verbose):
+    """
+    Replays the unfinished actions of the reports in the action journal.
+
+    The actions run with the Hai result and the flags that were journaled, so the reports are not sent to Hai again.
+    Actions that already succeeded before the process stopped are skipped. Only the entries whose lease has expired
+    are replayed, so the actions another live process is running are left alone.
+
+    Args:
+        verbose (bool): Flag indicating whether to display verbose output.
+
+    Returns:
+        int: The number of reports whose actions were replayed.
+    """
+    journal = get_journal(create=False)
+    entries = journal.claim() if journal is not None else []
+    if not entries:
+        return 0
+
+    print(colored(f"Replaying the unfinished actions of {len(entries)} report(s) from the journal...", 'cyan'))
+    metrics.incr(REPORTS_REPLAYED, len(entries))
+    await asyncio.gather(*(
+        hai_actions(*result, report_id, flags["comment_hai_flag"], flags["custom_field_hai_flag"], flags["csv_output_flag"], verbose, resume=True)
+        for report_id, result, flags in entries
+    ))
+    return len(entries)
 
-def post_private_comment(report, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, verbose):
+async def post_private_comment(report, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, verbose):
     """
     Post a private comment on a report with the predicted validity, complexity, ownership, and reasoning.
 
@@ -104,92 +285,119 @@ def post_private_comment(report, predictedValidity, predictedValidityCertaintySc
         print(data)
 
     try:
-        r = requests.post(
-            'https://api.hackerone.com/v1/reports/' + str(report) + '/activities',
-            auth=(settings.api_name, settings.api_key),
-            json=data,
-            headers=settings.headers,
-            timeout=(5, 10)
-        )
-        r.raise_for_status()
+        response = await post_json(f"/reports/{report}/activities", data)
         if verbose:
             print(colored("Response from Hai", 'light_blue'))
-            print(r.json())
-    except requests.exceptions.RequestException as e:
-        print(colored(f"An error occurred: {e}"),'light_red')
+            print(response)
+    except aiohttp.ClientError as e:
+        print(colored(f"An error occurred: {e}", 'light_red'))
         raise
 
-def update_custom_field(report, predictedValidity, predictedComplexity, productArea, squadOwner, verbose):
+def custom_field_ids():
+    """
+    Returns the IDs of the validity, complexity, product area and squad owner custom fields, None when not configured.
     """
-    Update custom fields for a given report.
+    return [settings.cf_1, settings.cf_2, settings.cf_3, settings.cf_4]
+
+def custom_field_updates(predictedValidity, predictedComplexity, productArea, squadOwner):
+    """
+    Returns the value for every configured custom field.
 
     Args:
-        report (int): The ID of the report to update.
         predictedValidity (str): The predicted validity value.
         predictedComplexity (str): The predicted complexity value.
         productArea (str): The product area value.
         squadOwner (str): The squad owner value.
+
+    Returns:
+        dict: The values keyed by custom field ID. Custom fields whose ID is not configured are left out.
+    """
+    values = [predictedValidity, predictedComplexity, productArea, squadOwner]
+    return {field_id: value for field_id, value in zip(custom_field_ids(), values) if field_id}
+
+def current_custom_field_values(report_id, report_data=None):
+    """
+    Returns the current custom field values of a report.
+
+    Args:
+        report_id (str): The ID of the report.
+        report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope.
+
+    Returns:
+        dict: The values keyed by custom field ID. They are taken from the report when it includes its custom field
+        values, and otherwise from the values written by a previous run, if any.
+    """
+    report_data = (report_data or {}).get("data", report_data or {})
+    custom_field_values = report_data.get("relationships", {}).get("custom_field_values")
+    if custom_field_values is not None:
+        values = {}
+        for item in custom_field_values.get("data", []):
+            attribute = item.get("relationships", {}).get("custom_field_attribute", {}).get("data", {})
+            field_id = attribute.get("id") or item.get("attributes", {}).get("custom_field_attribute_id")
+            if field_id is not None:
+                values[str(field_id)] = item.get("attributes", {}).get("value")
+        return values
+    cache = get_cache()
+    return cache.get_custom_field_values(report_id) if cache is not None else {}
+
+async def update_custom_field_value(report, field_id, field_value, verbose):
+    """
+    Update a single custom field of a report.
+
+    Args:
+        report (int): The ID of the report to update.
+        field_id (str): The ID of the custom field.
+        field_value (str): The new value.
         verbose (bool): Whether to print additional information.
 
     Returns:
         None
     """
-    field_updates = {
-        settings.cf_1: predictedValidity,
-        settings.cf_2: predictedComplexity,
-        settings.cf_3: productArea,
-        settings.cf_4: squadOwner
-    }
-
-    for field_id, field_value in field_updates.items():
-        data = {
-            "data": {
-                "attributes": {
-                    "custom_field_attribute_id": field_id,
-                    "value": field_value
-                }
+    data = {
+        "data": {
+            "attributes": {
+                "custom_field_attribute_id": field_id,
+                "value": field_value
             }
         }
+    }
 
+    if verbose:
+        print(colored("Data that is sent to Hai", 'light_blue'))
+        print(data)
+
+    try:
+        response = await post_json(f"/reports/{report}/custom_field_values", data)
         if verbose:
-            print(colored("Data that is sent to Hai", 'light_blue'))
-            print(data)
+            print(colored("Response from Hai", 'light_blue'))
+            print(response)
+    except aiohttp.ClientError as e:
+        print(colored(f"An error occurred: {e}", 'light_red'))
+        raise
+    metrics.incr(CUSTOM_FIELDS_WRITTEN)
+    cache = get_cache()
+    if cache is not None:
+        cache.put_custom_field_value(report, field_id, field_value)
 
-        try:
-            r = requests.post(
-                'https://api.hackerone.com/v1/reports/' + str(report) + '/custom_field_values',
-                auth=(settings.api_name, settings.api_key),
-                json=data,
-                headers=settings.headers,
-                timeout=(5, 10)
-            )
-            r.raise_for_status()
-            if verbose:
-                print(colored("Response from Hai", 'light_blue'))
-                print(r.json())
-        except requests.exceptions.RequestException as e:
-            print(colored(f"An error occurred: {e}"),'light_red')
-            raise
-
-def write_to_csv(report_id, predictedValidity, predictedComplexity, productArea, squadOwner):
-    """
-    Writes the provided data to a CSV file.
+async def write_result(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, on_flushed=None):
+    """
+    Writes the result of a report to the result sink.
+
+    The row is buffered and written to every output file in OUTPUT_FORMATS with the next flush of the sink, after
+    which `on_flushed` is called.
 
     Args:
         report_id (str): The report ID.
         predictedValidity (str): The predicted validity.
+        predictedValidityCertaintyScore (str): The certainty score of the predicted validity.
+        predictedValidityReasoning (str): The reasoning behind the predicted validity.
         predictedComplexity (str): The predicted complexity.
+        predictedComplexityCertaintyScore (str): The certainty score of the predicted complexity.
+        predictedComplexityReasoning (str): The reasoning behind the predicted complexity.
+        predictedOwnershipCertaintyScore (str): The certainty score of the predicted ownership.
+        predictedOwnershipReasoning (str): The reasoning behind the predicted ownership.
         productArea (str): The product area.
         squadOwner (str): The squad owner.
-
-    Returns:
-        str: A message indicating that the CSV output file has been successfully updated.
-    """
-    print(colored("Beginning the process of writing to the CSV file...", 'light_blue'))
-    with open(settings.csv_output_file_path, "a+", encoding='UTF-8') as file:
-        csv_writer = csv.writer(file)
-        if file.tell() == 0:
-            csv_writer.writerow(["Report ID", "Predicted Validity", "Predicted Difficulty", "Product Area", "Squad Owner"])
-        csv_writer.writerow([report_id, predictedValidity, predictedComplexity, productArea, squadOwner])
-    print(colored("The CSV output file has been successfully updated", 'light_green'))
-    return "Done"
+        on_flushed (function): Called without arguments once the row has been written to the output files.
+    """
+    get_sink().write(result_row(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner), on_flushed)
@@ -0,0 +1,193 @@
+"""
+API module
+
+This module contains the asynchronous client for the HackerOne API. All requests share one keep-alive aiohttp session,
+so a run reuses its connections to api.hackerone.com instead of opening a new TCP/TLS connection for every request.
+The reports, Hai completions, completion polling and actions all go through this session.
+
+Functions:
+- get_session: Returns the shared aiohttp session, creating it when needed.
+- close_session: Closes the shared aiohttp session.
+- print_connection_stats: Prints how many connections were opened and reused, and the connection setup time saved.
+- post_json: Sends a POST request with a JSON body to the HackerOne API and returns the JSON response.
+- get_json: Sends a GET request to the HackerOne API and returns the JSON response.
+- get_report: Retrieves a single report from the HackerOne API.
+- iter_report_pages: Yields the pages of the reports endpoint while the next page is fetched in the background.
+"""
+import asyncio
+
+import aiohttp
+from config import load_settings
+from termcolor import colored
+
+API_BASE_URL = "https://api.hackerone.com/v1"
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(sock_connect=5, sock_read=10)
+
+settings = load_settings()
+
+_session = None
+_session_loop = None
+
+connection_stats = {"opened": 0, "reused": 0, "connect_seconds": 0.0}
+
+async def _on_connection_create_start(_session, trace_config_ctx, _params):
+    trace_config_ctx.connect_started = asyncio.get_running_loop().time()
+
+async def _on_connection_create_end(_session, trace_config_ctx, _params):
+    connection_stats["opened"] += 1
+    connection_stats["connect_seconds"] += asyncio.get_running_loop().time() - trace_config_ctx.connect_started
+
+async def _on_connection_reuseconn(_session, _trace_config_ctx, _params):
+    connection_stats["reused"] += 1
+
+def _create_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    return trace_config
+
+def get_session():
+    """
+    Returns the shared aiohttp session, creating it when needed.
+
+    The session is bound to the running event loop, so a new session is created when it is used from another loop.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=settings.http_pool_size,
+            limit_per_host=settings.http_pool_size_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=30
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[_create_trace_config()],
+            auth=aiohttp.BasicAuth(settings.api_name, settings.api_key),
+            headers=settings.headers,
+            timeout=REQUEST_TIMEOUT
+        )
+        _session_loop = loop
+    return _session
+
+async def close_session():
+    """
+    Closes the shared aiohttp session.
+    """
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+def print_connection_stats():
+    """
+    Prints how many connections were opened and reused, and the connection setup time saved by reusing them.
+
+    The saving is estimated as the number of reused connections times the average time it took to open a connection,
+    which covers the DNS lookup, the TCP connect and the TLS handshake.
+    """
+    opened = connection_stats["opened"]
+    if not opened:
+        return
+    average = connection_stats["connect_seconds"] / opened
+    saved = connection_stats["reused"] * average
+    print(colored(f"HTTP connections: {opened} opened (average setup {average * 1000:.0f} ms), {connection_stats['reused']} reused - about {saved:.1f}s of connection setup saved", 'cyan'))
+
+def encode_params(params):
+    """
+    Encodes query parameters the way `requests` does, so list values are repeated and None values are dropped.
+
+    Args:
+        params (dict): The query parameters.
+
+    Returns:
+        list: A list of (key, value) tuples.
+    """
+    encoded = []
+    for key, values in (params or {}).items():
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        encoded.extend((key, str(value)) for value in values if value is not None)
+    return encoded
+
+async def post_json(path, data):
+    """
+    Sends a POST request with a JSON body to the HackerOne API and returns the JSON response.
+
+    Args:
+        path (str): The path of the endpoint, e.g. "/reports/1/activities".
+        data (dict): The JSON body.
+
+    Returns:
+        dict: The JSON response.
+
+    Raises:
+        aiohttp.ClientError: If the request fails or returns an error status.
+    """
+    async with get_session().post(API_BASE_URL + path, json=data) as r:
+        r.raise_for_status()
+        return await r.json()
+
+async def get_json(path, params=None):
+    """
+    Sends a GET request to the HackerOne API and returns the JSON response.
+
+    Args:
+        path (str): The path of the endpoint, e.g. "/reports".
+        params (dict): The query parameters.
+
+    Returns:
+        dict: The JSON response.
+
+    Raises:
+        aiohttp.ClientError: If the request fails or returns an error status.
+    """
+    async with get_session().get(API_BASE_URL + path, params=encode_params(params)) as r:
+        r.raise_for_status()
+        return await r.json()
+
+async def get_report(report_id, params=None):
+    """
+    Retrieves a single report from the HackerOne API.
+
+    Args:
+        report_id (str): The ID of the report.
+        params (dict): The query parameters.
+
+    Returns:
+        dict: The report.
+    """
+    return await get_json(f"/reports/{report_id}", params)
+
+async def iter_report_pages(params):
+    """
+    Yields the pages of the reports endpoint.
+
+    As soon as a page has been received the request for the next page is started, so the next page is
+    downloaded while the caller processes the current one.
+
+    Args:
+        params (dict): The filters for the reports endpoint, without the page number.
+
+    Yields:
+        tuple: The page number and the JSON response of that page.
+    """
+    page_number = 1
+    next_page = asyncio.create_task(get_json("/reports", {**params, 'page[number]': page_number}))
+    try:
+        while next_page is not None:
+            response = await next_page
+            next_page = None
+            if "next" in response.get("links", {}):
+                next_page = asyncio.create_task(get_json("/reports", {**params, 'page[number]': page_number + 1}))
+            yield page_number, response
+            page_number += 1
+    finally:
+        if next_page is not None:
+            next_page.cancel()
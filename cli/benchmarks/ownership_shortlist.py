@@ -0,0 +1,120 @@
+"""
+Ownership shortlist benchmark
+
+Compares the size of the ownership prompt with the whole ownership table against the shortlisted table, and
+measures how long it takes to build the BM25 index and to shortlist the table for a report.
+
+With --live the ownership prompt of real reports is sent to Hai both ways, to compare the completion latency.
+
+Usage:
+    python benchmarks/ownership_shortlist.py --rows 3000
+    python benchmarks/ownership_shortlist.py --ownership config-data/ownership.csv --live 12345 --live 67890
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=C0413
+from api import close_session, get_report
+from hai import PROMPT_TEMPLATES, send_individual_prompt
+from ownership import OwnershipTable, load_ownership, parse_ownership, report_search_text
+from termcolor import colored
+
+WORDS = [
+    "account", "api", "billing", "bounty", "calculator", "dashboard", "directory", "export", "graphql", "identity",
+    "inbox", "integration", "invite", "mobile", "notification", "oauth", "payout", "program", "report", "saml",
+    "scope", "search", "session", "settings", "signup", "sso", "team", "triage", "upload", "webhook"
+]
+
+SAMPLE_SEARCH_TEXTS = [
+    "SAML SSO login bypass Improper Authentication sso.example.com",
+    "Stored XSS in report inbox Cross-site Scripting (XSS) - Stored app.example.com",
+    "IDOR on payout export endpoint Insecure Direct Object Reference api.example.com",
+    "GraphQL introspection leaks team settings Information Disclosure api.example.com/graphql",
+    "Webhook integration SSRF Server-Side Request Forgery hooks.example.com"
+]
+
+def synthetic_table(row_count, seed=1):
+    """
+    Returns an ownership table with generated product areas, squads and keywords.
+    """
+    rng = random.Random(seed)
+    lines = ["Product Area,Squad Owner,Keywords"]
+    for number in range(row_count):
+        area = " ".join(rng.sample(WORDS, 2)).title() + f" {number}"
+        squad = f"Squad {rng.randrange(max(1, row_count // 20))}"
+        keywords = " ".join(rng.sample(WORDS, 3))
+        lines.append(f"{area},{squad},{keywords}")
+    return OwnershipTable(parse_ownership("\n".join(lines)), 0, "synthetic")
+
+def benchmark_prompt_size(table, shortlist_size):
+    """
+    Prints the prompt size with the whole table and with the shortlist, and the time spent on the index.
+    """
+    start = time.perf_counter()
+    _ = table.index
+    build_ms = (time.perf_counter() - start) * 1000
+
+    full_size = len(PROMPT_TEMPLATES["ownership"].render("12345", table.prompt_text)["content"])
+    shortlist_sizes = []
+    query_times = []
+    for search_text in SAMPLE_SEARCH_TEXTS:
+        start = time.perf_counter()
+        ownership_text = table.prompt_text_for(search_text, shortlist_size)
+        query_times.append((time.perf_counter() - start) * 1000)
+        shortlist_sizes.append(len(PROMPT_TEMPLATES["ownership"].render("12345", ownership_text)["content"]))
+
+    shortlisted = statistics.mean(shortlist_sizes)
+    print(colored(f"Ownership table: {len(table.rows)} rows, shortlist of {shortlist_size}", 'cyan'))
+    print(f"Index build time:           {build_ms:.1f} ms")
+    print(f"Shortlist time per report:  {statistics.mean(query_times):.2f} ms")
+    print(f"Prompt size, whole table:   {full_size} characters (~{full_size // 4} tokens)")
+    print(f"Prompt size, shortlisted:   {shortlisted:.0f} characters (~{shortlisted // 4:.0f} tokens)")
+    print(f"Reduction:                  {100 * (1 - shortlisted / full_size):.1f}%")
+
+async def benchmark_latency(table, shortlist_size, report_ids):
+    """
+    Sends the ownership prompt of every report to Hai with the whole table and with the shortlist.
+    """
+    latencies = {"whole table": [], "shortlisted": []}
+    try:
+        for report_id in report_ids:
+            search_text = report_search_text(await get_report(report_id))
+            variants = {
+                "whole table": table.prompt_text,
+                "shortlisted": table.prompt_text_for(search_text, shortlist_size)
+            }
+            for name, ownership_text in variants.items():
+                start = time.perf_counter()
+                await send_individual_prompt(PROMPT_TEMPLATES["ownership"].render(report_id, ownership_text), report_id, False)
+                latencies[name].append(time.perf_counter() - start)
+    finally:
+        await close_session()
+
+    for name, values in latencies.items():
+        print(f"Completion latency, {name}: {statistics.mean(values):.1f}s average over {len(values)} reports")
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3000, help="Number of rows of the synthetic ownership table")
+    parser.add_argument("--ownership", help="Use this ownership file instead of a synthetic table")
+    parser.add_argument("--shortlist", type=int, default=20, help="Number of product areas in the shortlist")
+    parser.add_argument("--live", action="append", help="Report ID to send to Hai with both prompts")
+    args = parser.parse_args()
+
+    table = load_ownership(args.ownership) if args.ownership else synthetic_table(args.rows)
+    benchmark_prompt_size(table, args.shortlist)
+    if args.live:
+        asyncio.run(benchmark_latency(table, args.shortlist, args.live))
+
+if __name__ == "__main__":
+    main()
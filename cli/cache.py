@@ -0,0 +1,209 @@
+"""
+Cache module
+
+This module contains the persistent cache of Hai results. A result is stored under a key made of the report ID, a hash
+of the report content that Hai evaluates, and a fingerprint of the prompts and ownership data that were used. As long
+as neither the report nor the configuration changes, running the same report again returns the stored result without
+sending anything to Hai.
+
+The cache is a single SQLite file in WAL mode, so the CLI and the watcher can use it at the same time. Entries expire
+after a time to live, and the least recently used entries are evicted once the cache holds too many.
+
+The same file also remembers the custom field values written to every report, so the actions can skip custom fields
+that already hold the predicted value when the report itself does not include its custom field values.
+
+Functions:
+- report_version: Returns a hash of the content of a report that Hai evaluates.
+- get_cache: Returns the result cache of this process, or None when the cache is disabled.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from config import load_settings
+
+settings = load_settings()
+
+# Evicting expired and surplus entries needs a full scan, so it only runs once every this many writes.
+EVICT_EVERY = 100
+
+class ResultCache:
+    """
+    A SQLite cache of Hai results and of the custom field values written to reports.
+    """
+    def __init__(self, path, ttl, max_entries):
+        """
+        Initialize the result cache
+
+        path (str): The path to the SQLite file, ":memory:" for a cache that is not persisted.
+        ttl (float): The number of seconds a result stays valid, 0 to keep results until they are evicted by size.
+        max_entries (int): The maximum number of results in the cache, 0 for no limit.
+        """
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, report_id TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_report_id ON results (report_id, created_at)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS custom_field_values ("
+            "report_id TEXT NOT NULL, field_id TEXT NOT NULL, value TEXT, updated_at REAL NOT NULL, PRIMARY KEY (report_id, field_id))"
+        )
+        self._writes = 0
+        self.evict()
+
+    def get(self, key):
+        """
+        Returns the result stored under a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: The stored result, or None when there is no valid result for the key.
+        """
+        now = time.time()
+        row = self.connection.execute("SELECT result, created_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl and row[1] < now - self.ttl:
+            self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        self.connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return tuple(json.loads(row[0]))
+
+    def get_latest(self, report_id, fingerprint):
+        """
+        Returns the most recent valid result of a report evaluated with the given prompts, whatever its content was.
+
+        Args:
+            report_id (str): The ID of the report.
+            fingerprint (str): The prompt fingerprint, the last part of the cache key.
+
+        Returns:
+            tuple: The stored result, or None when the report has no valid result with this fingerprint.
+        """
+        row = self.connection.execute(
+            "SELECT result FROM results WHERE report_id = ? AND key LIKE ? AND created_at >= ? ORDER BY created_at DESC LIMIT 1",
+            (str(report_id), f"%:{fingerprint}", time.time() - self.ttl if self.ttl else 0)
+        ).fetchone()
+        return tuple(json.loads(row[0])) if row is not None else None
+
+    def put(self, key, report_id, result):
+        """
+        Stores a result under a key.
+
+        Args:
+            key (str): The cache key.
+            report_id (str): The ID of the report, to make the cache easier to inspect.
+            result (tuple): The result of `send_to_hai`.
+        """
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, report_id, result, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, str(report_id), json.dumps(list(result)), now, now)
+        )
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def get_custom_field_values(self, report_id):
+        """
+        Returns the custom field values that were written to a report.
+
+        Args:
+            report_id (str): The ID of the report.
+
+        Returns:
+            dict: The values keyed by custom field ID.
+        """
+        rows = self.connection.execute("SELECT field_id, value FROM custom_field_values WHERE report_id = ?", (str(report_id),))
+        return dict(rows.fetchall())
+
+    def put_custom_field_value(self, report_id, field_id, value):
+        """
+        Remembers a custom field value that was written to a report.
+
+        Args:
+            report_id (str): The ID of the report.
+            field_id (str): The ID of the custom field.
+            value (str): The value that was written.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO custom_field_values (report_id, field_id, value, updated_at) VALUES (?, ?, ?, ?)",
+            (str(report_id), str(field_id), None if value is None else str(value), time.time())
+        )
+
+    def evict(self):
+        """
+        Deletes the expired results and the least recently used results above the maximum number of entries.
+        """
+        if self.ttl:
+            self.connection.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+            self.connection.execute("DELETE FROM custom_field_values WHERE updated_at < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def close(self):
+        """
+        Closes the SQLite connection.
+        """
+        self.connection.close()
+
+def report_version(report_data):
+    """
+    Returns a hash of the content of a report that Hai evaluates.
+
+    The hash covers the title, the vulnerability information, the severity, the weakness and the asset of the report.
+    Changes to its state, comments or custom fields, including the ones made by the actions of this tool, do not
+    change the hash, whereas `last_activity_at` would change with every one of them.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope.
+
+    Returns:
+        str: The hash, or None when the report has no content to hash.
+    """
+    if not report_data:
+        return None
+    report_data = report_data.get("data", report_data)
+    attributes = report_data.get("attributes", {})
+    relationships = report_data.get("relationships", {})
+    content = [
+        attributes.get("title"),
+        attributes.get("vulnerability_information"),
+        relationships.get("severity", {}).get("data", {}).get("attributes", {}).get("rating"),
+        relationships.get("weakness", {}).get("data", {}).get("id"),
+        relationships.get("structured_scope", {}).get("data", {}).get("attributes", {}).get("asset_identifier")
+    ]
+    if attributes.get("title") is None and attributes.get("vulnerability_information") is None:
+        return None
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+_cache = None
+
+def get_cache():
+    """
+    Returns the result cache of this process, opening it when needed.
+
+    Returns:
+        ResultCache: The result cache, or None when RESULT_CACHE_FILE is empty.
+    """
+    global _cache
+    if _cache is None and settings.result_cache_file_path:
+        _cache = ResultCache(settings.result_cache_file_path, settings.result_cache_ttl, settings.result_cache_max_entries)
+    return _cache
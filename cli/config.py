@@ -24,7 +24,45 @@ class Settings:
         cf_3 (str): The custom field ID for product area.
         cf_4 (str): The custom field ID for squad owner.
         ownership_file_path (str): The path to the ownership file.
-        csv_output_file (str): The path to the CSV output file.
+        ownership_rules_file_path (str): The path to the optional ownership rules file.
+        csv_output_file (str): The path to the CSV output file. The other output files are written next to it.
+        output_formats (str): The comma-separated formats of the result output: csv, jsonl and/or columnar.
+        result_flush_rows (int): The number of buffered result rows that triggers a write to the output files.
+        result_flush_seconds (float): The maximum number of seconds a result row stays buffered.
+        sync_cursor_file_path (str): The path to the file with the cursors of incremental runs.
+        result_cache_file_path (str): The path to the SQLite file of the result cache, empty to disable the cache.
+        result_cache_ttl (float): The number of seconds a cached result stays valid, 0 for no limit.
+        result_cache_max_entries (int): The maximum number of results in the cache, 0 for no limit.
+        journal_file_path (str): The path to the SQLite file of the action journal, empty to disable the journal.
+        journal_retention (float): The number of seconds after which unfinished actions are no longer replayed, 0 for no limit.
+        journal_lease (float): The number of seconds without progress after which another process may replay unfinished actions.
+        ownership_shortlist_size (int): The number of product areas in the ownership prompt of a report, 0 for the whole table.
+        cascade_certainty_threshold (float): The validity certainty from which the cascade skips the other prompts of an Invalid report.
+        action_concurrency (int): The maximum number of actions (comments, custom fields, result rows) in flight at the same time.
+        watcher_concurrency (int): The number of reports the webhook watcher triages at the same time.
+        priority_aging_seconds (float): The longest a queued report can be overtaken by more urgent reports queued after it, 0 for first-in first-out.
+        report_source (str): Where the webhook puts report IDs and the watcher takes them from: "file" for report_ids.txt or "queue" for the report queue.
+        report_queue_file_path (str): The path to the SQLite file of the report queue.
+        report_queue_visibility_timeout (float): The number of seconds a claimed report stays hidden before it is redelivered.
+        report_queue_max_attempts (int): The number of attempts after which a failing report is parked as dead, 0 for no limit.
+        report_queue_retry_delay (float): The number of seconds before a failed report is retried.
+        report_queue_batch_size (int): The number of report IDs the webhook writes to the queue in one transaction.
+        report_queue_flush_seconds (float): The maximum number of seconds the webhook holds a report ID before writing it.
+        report_queue_poll_interval (float): The number of seconds the watcher waits before polling an empty queue again.
+        webhook_event_routes (str): The comma-separated event=route pairs that override the default webhook routes.
+        webhook_default_route (str): The route of webhook events that are not in the routing table.
+        webhook_coalesce_seconds (float): The number of seconds during which further events for a queued report are not queued again.
+        webhook_delivery_window (float): The number of seconds a webhook delivery ID is remembered to drop redeliveries.
+        webhook_dedup_max_entries (int): The maximum number of report and delivery IDs the webhook endpoint remembers.
+        watcher_checkpoint_file_path (str): The path to the file with the offset up to which the watcher has triaged the report IDs.
+        watcher_checkpoint_every (int): The number of triaged reports after which the watcher checkpoint is written.
+        watcher_checkpoint_seconds (float): The number of seconds after which a triaged report is written to the watcher checkpoint.
+        http_pool_size (int): The maximum number of open connections to the HackerOne API.
+        http_pool_size_per_host (int): The maximum number of open connections to a single host.
+        hai_poll_initial_interval (float): The number of seconds before a Hai completion is polled for the first time.
+        hai_poll_max_interval (float): The maximum number of seconds between two polls of a Hai completion.
+        hai_poll_backoff (float): The factor by which the interval between two polls grows.
+        hai_completion_timeout (float): The number of seconds after which a Hai completion is given up on.
         """
         self.api_name = os.environ["API_NAME"]
         self.api_key = os.environ["API_KEY"]
@@ -38,7 +76,48 @@ class Settings:
 
         script_dir = os.path.dirname(__file__)
         self.ownership_file_path = os.getenv('OWNERSHIP_FILE', f"{script_dir}/config-data/ownership.csv")
+        self.ownership_rules_file_path = os.getenv('OWNERSHIP_RULES_FILE', f"{script_dir}/config-data/ownership_rules.csv")
         self.csv_output_file_path = os.getenv("CSV_OUTPUT_FILE", f"{script_dir}/data/hai-on-hackerone-output.csv")
+        self.output_formats = os.getenv("OUTPUT_FORMATS", "csv")
+        self.result_flush_rows = int(os.getenv("RESULT_FLUSH_ROWS", "100"))
+        self.result_flush_seconds = float(os.getenv("RESULT_FLUSH_SECONDS", "5"))
+        self.sync_cursor_file_path = os.getenv("SYNC_CURSOR_FILE", f"{script_dir}/data/sync-cursors.json")
+        self.result_cache_file_path = os.getenv("RESULT_CACHE_FILE", f"{script_dir}/data/hai-result-cache.sqlite3")
+        self.result_cache_ttl = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+        self.result_cache_max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+        self.journal_file_path = os.getenv("JOURNAL_FILE", f"{script_dir}/data/action-journal.sqlite3")
+        self.journal_retention = float(os.getenv("JOURNAL_RETENTION", str(7 * 24 * 3600)))
+        self.journal_lease = float(os.getenv("JOURNAL_LEASE", "300"))
+        self.ownership_shortlist_size = int(os.getenv("OWNERSHIP_SHORTLIST_SIZE", "20"))
+        self.cascade_certainty_threshold = float(os.getenv("CASCADE_CERTAINTY_THRESHOLD", "90"))
+
+        self.action_concurrency = int(os.getenv("ACTION_CONCURRENCY", "10"))
+        self.watcher_concurrency = int(os.getenv("WATCHER_CONCURRENCY", "4"))
+        self.priority_aging_seconds = float(os.getenv("PRIORITY_AGING_SECONDS", "900"))
+        self.report_source = os.getenv("REPORT_SOURCE", "file")
+        self.report_queue_file_path = os.getenv("REPORT_QUEUE_FILE", f"{os.path.dirname(script_dir)}/webserver/data/report-queue.sqlite3")
+        self.report_queue_visibility_timeout = float(os.getenv("REPORT_QUEUE_VISIBILITY_TIMEOUT", "600"))
+        self.report_queue_max_attempts = int(os.getenv("REPORT_QUEUE_MAX_ATTEMPTS", "5"))
+        self.report_queue_retry_delay = float(os.getenv("REPORT_QUEUE_RETRY_DELAY", "60"))
+        self.report_queue_batch_size = int(os.getenv("REPORT_QUEUE_BATCH_SIZE", "100"))
+        self.report_queue_flush_seconds = float(os.getenv("REPORT_QUEUE_FLUSH_SECONDS", "0.05"))
+        self.report_queue_poll_interval = float(os.getenv("REPORT_QUEUE_POLL_INTERVAL", "0.5"))
+        self.webhook_event_routes = os.getenv("WEBHOOK_EVENT_ROUTES", "")
+        self.webhook_default_route = os.getenv("WEBHOOK_DEFAULT_ROUTE", "full")
+        self.webhook_coalesce_seconds = float(os.getenv("WEBHOOK_COALESCE_SECONDS", "60"))
+        self.webhook_delivery_window = float(os.getenv("WEBHOOK_DELIVERY_WINDOW", "86400"))
+        self.webhook_dedup_max_entries = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", "10000"))
+        self.watcher_checkpoint_file_path = os.getenv("WATCHER_CHECKPOINT_FILE", f"{script_dir}/data/watcher-checkpoint.json")
+        self.watcher_checkpoint_every = int(os.getenv("WATCHER_CHECKPOINT_EVERY", "50"))
+        self.watcher_checkpoint_seconds = float(os.getenv("WATCHER_CHECKPOINT_SECONDS", "1"))
+
+        self.http_pool_size = int(os.getenv("HTTP_POOL_SIZE", "100"))
+        self.http_pool_size_per_host = int(os.getenv("HTTP_POOL_SIZE_PER_HOST", "50"))
+
+        self.hai_poll_initial_interval = float(os.getenv("HAI_POLL_INITIAL_INTERVAL", "0.5"))
+        self.hai_poll_max_interval = float(os.getenv("HAI_POLL_MAX_INTERVAL", "10"))
+        self.hai_poll_backoff = float(os.getenv("HAI_POLL_BACKOFF", "1.5"))
+        self.hai_completion_timeout = float(os.getenv("HAI_COMPLETION_TIMEOUT", "300"))
 
 def load_settings():
     """
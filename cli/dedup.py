@@ -0,0 +1,68 @@
+"""
+Dedup module
+
+This module contains a bounded set of recently seen keys, used by the webhook endpoint to drop repeated deliveries
+and to coalesce the bursts of events that HackerOne sends for the same report into a single triage job.
+
+A key is remembered for a time window. Once the set holds its maximum number of keys, the least recently added keys
+are forgotten first, so memory stays bounded however many reports come in.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class RecentKeys:
+    """
+    A thread-safe set of keys that expire after a time window, bounded in size.
+    """
+    def __init__(self, window, max_entries):
+        """
+        Initialize the set
+
+        window (float): The number of seconds a key is remembered.
+        max_entries (int): The maximum number of keys remembered at the same time.
+        """
+        self.window = window
+        self.max_entries = max(1, max_entries)
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        """
+        Adds a key unless it has been added within the window.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            bool: True when the key is new, False when it is a repeat within the window.
+        """
+        now = time.monotonic()
+        with self.lock:
+            # Keys are in the order they were added, so the expired keys are at the front.
+            while self.keys and next(iter(self.keys.values())) <= now - self.window:
+                self.keys.popitem(last=False)
+            if key in self.keys:
+                return False
+            self.keys[key] = now
+            if len(self.keys) > self.max_entries:
+                self.keys.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        """
+        Returns whether a key has been added within the window.
+        """
+        with self.lock:
+            added_at = self.keys.get(key)
+            return added_at is not None and added_at > time.monotonic() - self.window
+
+    def discard(self, key):
+        """
+        Forgets a key, so the next add of it is new again.
+
+        Args:
+            key (str): The key.
+        """
+        with self.lock:
+            self.keys.pop(key, None)
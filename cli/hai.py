@@ -7,27 +7,503 @@ The module also includes helper functions for sending individual prompts and wai
 
 Functions:
 - send_to_hai: Sends prompts to the Hai API and returns the predicted validity, complexity, ownership, and other information of a security report.
+- build_prompts: Builds the separate validity, complexity and ownership prompts for a security report.
+- send_prompts: Sends the separate prompts of several evaluations to Hai at the same time.
+- build_combined_prompt: Builds a single prompt that asks for all fields of a security report at once.
+- cascade_placeholders: Returns the fields of the evaluations that the cascade skips for a report predicted Invalid.
+- result_cache_key: Returns the key under which the result for a report is cached.
+- ownership_rule_fields: Returns the ownership fields of a report from the ownership rules, when they determine its owner.
+- send_batch_to_hai: Sends several security reports to the Hai API in a single completion request.
 - send_individual_prompt: Sends an individual prompt to the Hai API and returns the response.
-- wait_for_hai: Waits for the response from the Hai API and returns the response data.
+- wait_for_hai: Waits for the response from the Hai API and returns the response data. Completions that are not done yet are handed to the shared poller in `poller.py`.
 
 """
 
 import asyncio
+import functools
+import hashlib
 import time
 import aiohttp
-from utils import parse_json_with_control_chars
+import metrics
+from api import get_session
+from cache import get_cache, report_version
+from poller import HAI_COMPLETIONS_URL, wait_for_completion
+from ownership import STRUCTURED_CERTAINTY, load_ownership, load_ownership_rules, report_search_text
+from utils import certainty_value, parse_json_with_control_chars
 from config import load_settings
 from termcolor import colored
 
 settings = load_settings()
 
-async def send_to_hai(report, verbose):
+OWNERSHIP_RULES_CHECKED = "Reports checked against the ownership rules"
+OWNERSHIP_RULE_HITS = "Ownership prompts skipped by an ownership rule"
+metrics.add_rate("Ownership rule hit rate", OWNERSHIP_RULE_HITS, OWNERSHIP_RULES_CHECKED)
+CASCADE_PROMPTS_SKIPPED = "Hai prompts skipped by the cascade"
+RESULT_CACHE_LOOKUPS = "Result cache lookups"
+RESULT_CACHE_HITS = "Reports answered from the result cache"
+EVALUATIONS_REUSED = "Evaluations reused from a previous result"
+metrics.add_rate("Result cache hit rate", RESULT_CACHE_HITS, RESULT_CACHE_LOOKUPS)
+
+NOT_EVALUATED = "Not evaluated"
+
+RESPONSE_FORMAT = "Your response should be in, without any exception, JSON format without newlines with the following structure:"
+CLOSING_INSTRUCTIONS = "Please approach the problem methodically and ensure that your reasoning for the decision is clearly outlined. Even if certain information is lacking, use your judgment to make an educated guess to facilitate a streamlined assessment process. Now, take a deep breath and work on this problem step by step. Good luck!"
+
+VALIDITY_CRITERIA = "When assessing validity evaluate if the report is complete, correct, relevant per policy, and describes a valid security vulnerability for bug bounty programs. Provide in your reasoning a percentage value of how certain you are that the report is valid."
+VALIDITY_FIELDS = '"predictedValidity": [Valid/Invalid], "validityCertaintyScore": [0-100%], "validityReasoning": [Reasoning for the decision]'
+
+COMPLEXITY_CRITERIA = "When assessing difficulty, use a percentage scale to evaluate if the level of effort required to reproduce the vulnerability based on the report's content. Consider a report high on difficulty when it demands extensive setup, involves numerous steps, or requires specialized expertise beyond common web application security. This includes reports necessitating multiple accounts with different permissions, configuring and installing applications, or following complex steps for reproducing the vulnerability. Conversely, reports that are straightforward to reproduce, lack detailed information, or feature minimal content are categorized on low difficulty. Provide a percentage value of how certain you are that the report is difficult, where 0 is not difficult at all and 100 is extremely difficult."
+COMPLEXITY_FIELDS = '"predictedComplexity": [Low/Medium/High], "complexityCertaintyScore": [0-100%], "complexityReasoning": [Reasoning for the decision]'
+
+OWNERSHIP_CRITERIA = "Use the ownership table to match the report to its product area and squad owner. Every line of the ownership table starts with a squad owner, followed by a colon and the product areas that squad owner is responsible for, separated by ' | '. Use this information to determine the correct product area and squad owner for the report."
+OWNERSHIP_FIELDS = '"productArea": [Product Area], "squadOwner": [Squad Owner], "ownershipCertaintyScore": [0-100%], "ownershipReasoning": [Reasoning for the decision]'
+OWNERSHIP_CERTAINTY = "Provide in your reasoning a percentage value of how certain you are that the report is correctly mapped to the right product area and squad owner."
+
+# The keys every prompt must return, in the order in which they are combined into the result of send_to_hai.
+PROMPT_KEYS = {
+    "validity": ("predictedValidity", "validityCertaintyScore", "validityReasoning"),
+    "complexity": ("predictedComplexity", "complexityCertaintyScore", "complexityReasoning"),
+    "ownership": ("productArea", "squadOwner", "ownershipCertaintyScore", "ownershipReasoning"),
+}
+
+class PromptTemplate:
+    """
+    A prompt in which the report ID is filled in for every report.
+
+    The text is split around the `{report}` placeholder once, so rendering the prompt for a report is a single join.
+    """
+    def __init__(self, text):
+        self.parts = text.split("{report}")
+
+    def render(self, report, ownership_text=None):
+        """
+        Renders the prompt for a report.
+
+        Args:
+            report (str): The ID of the security report, or the IDs of a batch joined by commas.
+            ownership_text (str): The encoded ownership table, for prompts that evaluate ownership.
+
+        Returns:
+            dict: The prompt.
+        """
+        content = str(report).join(self.parts)
+        if ownership_text is not None:
+            content = f"{content} The ownership table is:\n{ownership_text}"
+        return {"role": "user", "content": content}
+
+PROMPT_TEMPLATES = {
+    "validity": PromptTemplate(f"Based on the provided information your task is to evaluate the validity of the security report with ID {{report}}. {VALIDITY_CRITERIA} {RESPONSE_FORMAT} {VALIDITY_FIELDS}. {CLOSING_INSTRUCTIONS}"),
+    "complexity": PromptTemplate(f"Based on the provided information your task is to evaluate the complexity of the security report with ID {{report}}. {COMPLEXITY_CRITERIA} {RESPONSE_FORMAT} {COMPLEXITY_FIELDS}. {CLOSING_INSTRUCTIONS}"),
+    "ownership": PromptTemplate(f"Based on the provided information your task is to evaluate the ownership of the security report with ID {{report}}. {OWNERSHIP_CRITERIA} {RESPONSE_FORMAT} {OWNERSHIP_FIELDS}. {OWNERSHIP_CERTAINTY} {CLOSING_INSTRUCTIONS}"),
+}
+# The criteria and fields of every evaluation, for prompts that ask for several evaluations at once.
+EVALUATION_CRITERIA = {
+    "validity": VALIDITY_CRITERIA,
+    "complexity": COMPLEXITY_CRITERIA,
+    "ownership": f"{OWNERSHIP_CRITERIA} {OWNERSHIP_CERTAINTY}",
+}
+EVALUATION_FIELDS = {
+    "validity": VALIDITY_FIELDS,
+    "complexity": COMPLEXITY_FIELDS,
+    "ownership": OWNERSHIP_FIELDS,
+}
+NUMBER_WORDS = ("zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven")
+
+def _evaluation_list(names):
+    subjects = [f"the {name}" for name in names]
+    return subjects[0] if len(subjects) == 1 else f"{', '.join(subjects[:-1])} and {subjects[-1]}"
+
+@functools.lru_cache(maxsize=None)
+def combined_template(names):
+    """
+    Returns the template of a single prompt that asks for several evaluations of a security report at once.
+
+    Args:
+        names (tuple): The names of the evaluations, in the order of `PROMPT_KEYS`.
+
+    Returns:
+        PromptTemplate: The combined template.
+    """
+    criteria = " ".join(EVALUATION_CRITERIA[name] for name in names)
+    fields = ", ".join(EVALUATION_FIELDS[name] for name in names)
+    count = NUMBER_WORDS[sum(len(PROMPT_KEYS[name]) for name in names)]
+    return PromptTemplate(f"Based on the provided information your task is to evaluate {_evaluation_list(names)} of the security report with ID {{report}}. {criteria} {RESPONSE_FORMAT} {{{fields}}}. All {count} fields must be present in a single JSON object. {CLOSING_INSTRUCTIONS}")
+
+@functools.lru_cache(maxsize=None)
+def batch_template(names):
+    """
+    Returns the template of a single prompt that asks for several evaluations of several security reports at once.
+
+    Args:
+        names (tuple): The names of the evaluations, in the order of `PROMPT_KEYS`.
+
+    Returns:
+        PromptTemplate: The batch template.
+    """
+    criteria = " ".join(EVALUATION_CRITERIA[name] for name in names)
+    fields = ", ".join(EVALUATION_FIELDS[name] for name in names)
+    count = NUMBER_WORDS[1 + sum(len(PROMPT_KEYS[name]) for name in names)]
+    return PromptTemplate(f"Based on the provided information your task is to evaluate {_evaluation_list(names)} of each of the security reports with IDs {{report}}. Evaluate every report on its own. {criteria} {RESPONSE_FORMAT} a JSON array with one object per report: [{{\"reportId\": [Report ID], {fields}}}]. Every object must contain all {count} fields. {CLOSING_INSTRUCTIONS}")
+
+def build_prompts(report, ownership_text, names=tuple(PROMPT_KEYS)):
+    """
+    Builds the separate validity, complexity and ownership prompts for a security report.
+
+    Args:
+        report (str): The ID of the security report.
+        ownership_text (str): The encoded ownership table.
+        names (tuple): The names of the evaluations to build prompts for.
+
+    Returns:
+        dict: The prompt for every evaluation, keyed by the name of the evaluation.
+    """
+    return {
+        name: PROMPT_TEMPLATES[name].render(report, ownership_text if name == "ownership" else None)
+        for name in names
+    }
+
+def build_combined_prompt(report, ownership_text, names=tuple(PROMPT_KEYS)):
+    """
+    Builds a single prompt that asks for the validity, complexity and ownership of a security report at once.
+
+    Args:
+        report (str): The ID of the security report.
+        ownership_text (str): The encoded ownership table.
+        names (tuple): The names of the evaluations to ask for.
+
+    Returns:
+        dict: The combined prompt.
+    """
+    return combined_template(tuple(names)).render(report, ownership_text if "ownership" in names else None)
+
+def build_batch_prompt(reports, ownership_text, names=tuple(PROMPT_KEYS)):
+    """
+    Builds a single prompt that asks for the validity, complexity and ownership of several security reports at once.
+
+    Args:
+        reports (list): The IDs of the security reports.
+        ownership_text (str): The encoded ownership table.
+        names (tuple): The names of the evaluations to ask for.
+
+    Returns:
+        dict: The batch prompt.
+    """
+    return batch_template(tuple(names)).render(", ".join(str(report) for report in reports), ownership_text if "ownership" in names else None)
+
+def split_batch_response(response, reports, known_fields=None):
+    """
+    Splits the answer to a batch prompt into the keys returned for every report.
+
+    Both a JSON array of objects with a "reportId" key and a JSON object keyed by report ID are accepted.
+
+    Args:
+        response (str): The answer from Hai.
+        reports (list): The IDs of the security reports in the batch.
+        known_fields (dict): Keys that are already known for a report, keyed by report ID. They take precedence over the answer.
+
+    Returns:
+        dict: The keys returned for every report, or None for reports that are missing or incomplete.
+    """
+    try:
+        parsed = parse_json_with_control_chars(response)
+    except Exception as e:
+        print(colored(f"Error parsing batch JSON response: {e}", 'light_red'))
+        parsed = None
+
+    if isinstance(parsed, dict):
+        parsed = [{**value, "reportId": key} for key, value in parsed.items() if isinstance(value, dict)]
+    by_report = {}
+    for item in parsed if isinstance(parsed, list) else []:
+        if isinstance(item, dict) and "reportId" in item:
+            by_report[str(item["reportId"])] = {**item, **(known_fields or {}).get(str(item["reportId"]), {})}
+
+    return {
+        report: by_report[str(report)] if str(report) in by_report and not missing_prompts(by_report[str(report)]) else None
+        for report in reports
+    }
+
+def missing_prompts(fields):
+    """
+    Returns the evaluations for which at least one key is missing.
+
+    Args:
+        fields (dict): The keys returned by Hai so far.
+
+    Returns:
+        list: The names of the evaluations that are incomplete.
+    """
+    return [name for name, keys in PROMPT_KEYS.items() if not all(key in fields for key in keys)]
+
+# The keys of the fields in the order of the result tuple of send_to_hai.
+RESULT_KEYS = (
+    "predictedValidity", "validityCertaintyScore", "validityReasoning",
+    "predictedComplexity", "complexityCertaintyScore", "complexityReasoning",
+    "ownershipCertaintyScore", "ownershipReasoning", "productArea", "squadOwner"
+)
+
+def result_to_fields(result):
+    """
+    Converts a result tuple of `send_to_hai` back into the keys returned by Hai.
+
+    Args:
+        result (tuple): The result tuple.
+
+    Returns:
+        dict: The keys and their values.
+    """
+    return dict(zip(RESULT_KEYS, result))
+
+def previous_fields(report, evaluations, cascade=False):
+    """
+    Returns the fields of the latest cached result of a report, apart from the evaluations that are run again.
+
+    Args:
+        report (str): The ID of the security report.
+        evaluations (list): The names of the evaluations that are run again.
+        cascade (bool): Whether the result is evaluated in cascade mode.
+
+    Returns:
+        dict: The fields of the other evaluations, or an empty dict when the report has no cached result.
+    """
+    if get_cache() is None:
+        return {}
+    result = get_cache().get_latest(report, prompt_fingerprint(cascade))
+    if result is None:
+        print(colored(f"Report {report} has no previous result to re-evaluate {', '.join(evaluations)} against, evaluating it in full.", 'yellow'))
+        return {}
+    reused = [name for name in PROMPT_KEYS if name not in evaluations]
+    metrics.incr(EVALUATIONS_REUSED, len(reused))
+    fields = result_to_fields(result)
+    return {key: fields[key] for name in reused for key in PROMPT_KEYS[name]}
+
+def fields_to_result(fields):
+    """
+    Converts the keys returned by Hai into the tuple returned by `send_to_hai`.
+
+    Args:
+        fields (dict): The keys returned by Hai.
+
+    Returns:
+        tuple: The result tuple, with defaults for missing keys.
+    """
+    predictedValidity = fields.get('predictedValidity', 'Unknown')
+    predictedValidityCertaintyScore = fields.get('validityCertaintyScore', 0)
+    predictedValidityReasoning = fields.get('validityReasoning', 'No reasoning provided')
+    predictedComplexity = fields.get('predictedComplexity', 'Unknown')
+    predictedComplexityCertaintyScore = fields.get('complexityCertaintyScore', 0)
+    predictedComplexityReasoning = fields.get('complexityReasoning', 'No reasoning provided')
+    predictedOwnershipCertaintyScore = fields.get('ownershipCertaintyScore', 0)
+    predictedOwnershipReasoning = fields.get('ownershipReasoning', 'No reasoning provided')
+    productArea = fields.get('productArea', 'Unknown')
+    squadOwner = fields.get('squadOwner', 'Unknown')
+
+    return (predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning,
+            predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning,
+            predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner)
+
+def ownership_prompt_text(search_text, shortlist_factor=1):
+    """
+    Returns the encoded ownership table for a prompt, shortlisted to the product areas that best match the report(s).
+
+    Args:
+        search_text (str): The title, weakness and asset of the report(s).
+        shortlist_factor (int): The number of reports in the prompt; the shortlist grows with it.
+
+    Returns:
+        str: The encoded ownership table.
+    """
+    table = load_ownership(settings.ownership_file_path)
+    ownership_text = table.prompt_text_for(search_text, settings.ownership_shortlist_size * shortlist_factor)
+    if ownership_text is not table.prompt_text:
+        metrics.incr("Ownership prompts with a shortlist")
+    return ownership_text
+
+def is_confidently_invalid(fields):
+    """
+    Returns whether Hai predicted a report Invalid with at least the cascade certainty threshold.
+
+    Args:
+        fields (dict): The keys returned by the validity prompt.
+
+    Returns:
+        bool: True when the remaining evaluations can be skipped.
+    """
+    return (str(fields.get("predictedValidity", "")).strip().lower() == "invalid"
+            and certainty_value(fields.get("validityCertaintyScore")) >= settings.cascade_certainty_threshold)
+
+def cascade_placeholders(names, fields):
+    """
+    Returns the fields of the evaluations that the cascade skips for a report predicted Invalid.
+
+    Args:
+        names (list): The names of the skipped evaluations.
+        fields (dict): The keys returned by the validity prompt.
+
+    Returns:
+        dict: "Not evaluated" for every prediction, a certainty of 0 and a reasoning that explains why.
+    """
+    reasoning = f"Not evaluated because Hai predicted the report Invalid with {fields.get('validityCertaintyScore')}% certainty"
+    placeholders = {}
+    for name in names:
+        for key in PROMPT_KEYS[name]:
+            if key.endswith("CertaintyScore"):
+                placeholders[key] = 0
+            elif key.endswith("Reasoning"):
+                placeholders[key] = reasoning
+            else:
+                placeholders[key] = NOT_EVALUATED
+    return placeholders
+
+def prompt_fingerprint(cascade=False):
+    """
+    Returns a hash of everything apart from the report itself that determines the result of `send_to_hai`.
+
+    It covers the prompt templates, the ownership table and rules, the shortlist size and, in cascade mode, the
+    cascade threshold, so cached results are no longer used once any of them changes.
+
+    Args:
+        cascade (bool): Whether the result is evaluated in cascade mode.
+
+    Returns:
+        str: The fingerprint.
+    """
+    all_names = tuple(PROMPT_KEYS)
+    templates = [PROMPT_TEMPLATES[name] for name in all_names] + [combined_template(all_names), batch_template(all_names)]
+    rules = load_ownership_rules(settings.ownership_rules_file_path)
+    parts = [
+        *("{report}".join(template.parts) for template in templates),
+        load_ownership(settings.ownership_file_path).fingerprint,
+        rules.fingerprint if rules is not None else "",
+        str(settings.ownership_shortlist_size),
+        f"cascade {settings.cascade_certainty_threshold}" if cascade else ""
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+def result_cache_key(report, report_data, cascade=False):
+    """
+    Returns the key under which the result for a report is cached.
+
+    Args:
+        report (str): The ID of the security report.
+        report_data (dict): The report as returned by the HackerOne API, if it has been retrieved.
+        cascade (bool): Whether the result is evaluated in cascade mode.
+
+    Returns:
+        str: The key, or None when the cache is disabled or the report has not been retrieved.
+    """
+    version = report_version(report_data)
+    if version is None or get_cache() is None:
+        return None
+    return f"{report}:{version}:{prompt_fingerprint(cascade)}"
+
+def cached_result(report, key):
+    """
+    Returns the cached result for a report and counts the lookup.
+    """
+    metrics.incr(RESULT_CACHE_LOOKUPS)
+    result = get_cache().get(key)
+    if result is not None:
+        metrics.incr(RESULT_CACHE_HITS)
+        print(colored(f"Using the cached Hai result for report {report}.", 'cyan'))
+    return result
+
+def ownership_rule_fields(report_data):
+    """
+    Returns the ownership fields of a report from the ownership rules, when they determine its owner with certainty.
+
+    A rule that only matches a URL the reporter mentioned does not skip the ownership prompt: the reporter chose that
+    URL, so Hai still decides the owner.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, if it has been retrieved.
+
+    Returns:
+        dict: The ownership fields, or an empty dict when there are no rules or no single owner matches with certainty.
+    """
+    rules = load_ownership_rules(settings.ownership_rules_file_path) if report_data else None
+    if rules is None:
+        return {}
+    metrics.incr(OWNERSHIP_RULES_CHECKED)
+    match = rules.match(report_data)
+    if match is None or match.certainty < STRUCTURED_CERTAINTY:
+        return {}
+    metrics.incr(OWNERSHIP_RULE_HITS)
+    rule = match.rule
+    return {
+        "productArea": rule.product_area,
+        "squadOwner": rule.squad_owner,
+        "ownershipCertaintyScore": match.certainty,
+        "ownershipReasoning": f"The {rule.rule_type} rule '{rule.pattern}' of the ownership rules maps the report to {rule.product_area} ({rule.squad_owner})."
+    }
+
+async def send_prompts(report, names, ownership_text, verbose):
+    """
+    Sends the separate prompts of several evaluations to Hai at the same time.
+
+    Args:
+        report (str): The ID of the security report.
+        names (list): The names of the evaluations.
+        ownership_text (str): The encoded ownership table, for the ownership prompt.
+        verbose (bool): Whether to print verbose output.
+
+    Returns:
+        dict: The keys returned by all prompts, or None when one of the answers is unusable.
+    """
+    prompts = build_prompts(report, ownership_text, names)
+    tasks = [send_individual_prompt(prompts[name], report, verbose) for name in names]
+    responses = await asyncio.gather(*tasks)
+    metrics.incr("Hai completion requests", len(tasks))
+
+    if verbose:
+        print(colored("Responses from Hai:", 'blue'))
+        print(responses)
+
+    fields = {}
+    for name, response in zip(names, responses):
+        if response is None or 'response' not in response:
+            print(colored(f"Error: {name.capitalize()} response is None or invalid.", 'light_red'))
+            return None
+
+        try:
+            parsed = parse_json_with_control_chars(response['response'])
+        except Exception as e:
+            print(colored(f"Error parsing JSON response: {e}", 'light_red'))
+            return None
+        if parsed is None:
+            print(colored(f"Error: {name.capitalize()} response is not valid JSON.", 'light_red'))
+            return None
+        fields.update(parsed)
+    return fields
+
+async def send_to_hai(report, verbose, combined=False, report_data=None, cascade=False, refresh=False, evaluations=None):
     """
     Sends prompts to the Hai API and returns the predicted validity, complexity, ownership, and other information of a security report.
-    
+
+    By default three separate prompts are sent. In combined mode a single prompt asks for all ten fields at once,
+    and the separate prompts are only sent for the evaluations whose fields are missing from the combined answer.
+    When the report itself is passed, the ownership table in the prompt is shortlisted to the product areas that
+    best match its title, weakness and asset, and when the ownership rules determine its owner the ownership
+    evaluation is not sent to Hai at all.
+
+    In cascade mode the validity prompt is sent first. When Hai predicts the report Invalid with at least
+    CASCADE_CERTAINTY_THRESHOLD certainty, the complexity and ownership prompts are skipped and their fields are
+    filled with placeholders; otherwise the remaining prompts are sent as usual.
+
+    Results are cached by the content of the report and the prompts and ownership data they were evaluated with,
+    so a report that has not changed is only sent to Hai again with `refresh`.
+
+    With `evaluations`, only those evaluations are sent to Hai and the others are taken from the latest cached result
+    of the report, e.g. to re-evaluate the validity after a comment was added, which does not change the cache key.
+    Without a cached result the report is evaluated in full.
+
     Args:
         report (str): The ID of the security report.
         verbose (bool): Whether to print verbose output.
+        combined (bool): Whether to ask for all fields in a single prompt.
+        report_data (dict): The report as returned by the HackerOne API, if it has been retrieved.
+        cascade (bool): Whether to skip the other evaluations of reports that are confidently Invalid.
+        refresh (bool): Whether to send the report to Hai even when a cached result exists.
+        evaluations (list): The names of the evaluations to send to Hai, None for all of them.
 
     Returns:
         tuple: A tuple containing the following information:
@@ -42,77 +518,122 @@ async def send_to_hai(report, verbose):
             - productArea (str): The product area mapped to the security report.
             - squadOwner (str): The squad owner responsible for the product area.
     """
-    with open(settings.ownership_file_path, encoding='UTF-8') as file:
-        csv_data = [line.strip() for line in file.readlines() if line.strip()]
+    cache_key = result_cache_key(report, report_data, cascade)
+    if cache_key is not None and not refresh and evaluations is None:
+        result = cached_result(report, cache_key)
+        if result is not None:
+            return result
 
-    prompts = [
-        {
-            "role": "user",
-            "content": f"""
-            Based on the provided information your task is to evaluate the validity of the security report with ID {report}. When assessing validity evaluate if the report is complete, correct, relevant per policy, and describes a valid security vulnerability for bug bounty programs. Provide in your reasoning a percentage value of how certain you are that the report is valid. Your response should be in, without any exception, JSON format without newlines with the following structure: "predictedValidity": [Valid/Invalid], "validityCertaintyScore": [0-100%], "validityReasoning": [Reasoning for the decision]. Please approach the problem methodically and ensure that your reasoning for the decision is clearly outlined. Even if certain information is lacking, use your judgment to make an educated guess to facilitate a streamlined assessment process. Now, take a deep breath and work on this problem step by step. Good luck!
-            """
-        },
-        {
-            "role": "user",
-            "content": f"""
-            Based on the provided information your task is to evaluate the complexity of the security report with ID {report}. When assessing difficulty, use a percentage scale to evaluate if the level of effort required to reproduce the vulnerability based on the report's content. Consider a report high on difficulty when it demands extensive setup, involves numerous steps, or requires specialized expertise beyond common web application security. This includes reports necessitating multiple accounts with different permissions, configuring and installing applications, or following complex steps for reproducing the vulnerability. Conversely, reports that are straightforward to reproduce, lack detailed information, or feature minimal content are categorized on low difficulty. Provide a percentage value of how certain you are that the report is difficult, where 0 is not difficult at all and 100 is extremely difficult. Your response should be in, without any exception, JSON format without newlines with the following structure: "predictedComplexity": [Low/Medium/High], "complexityCertaintyScore": [0-100%], "complexityReasoning": [Reasoning for the decision]. Please approach the problem methodically and ensure that your reasoning for the decision is clearly outlined. Even if certain information is lacking, use your judgment to make an educated guess to facilitate a streamlined assessment process. Now, take a deep breath and work on this problem step by step. Good luck!
-            """
-        },
-        {
-            "role": "user",
-            "content": f"""
-            Based on the provided information your task is to evaluate the ownership of the security report with ID {report}. Use the CSV data to match the report to its product area and squad owner. The CSV data contains two columns: 'Product Area' and 'Squad Owner'. The 'Product Area' column contains the product area to which the report belongs, and the 'Squad Owner' column contains the squad owner responsible for the product area. Use this information to determine the correct product area and squad owner for the report. Your response should be in, without any exception, JSON format without newlines with the following structure: "productArea": [Product Area], "squadOwner": [Squad Owner], "ownershipCertaintyScore": [0-100%], "ownershipReasoning": [Reasoning for the decision]. Provide in your reasoning a percentage value of how certain you are that the report is correctly mapped to the right product area and squad owner. Please approach the problem methodically and ensure that your reasoning for the decision is clearly outlined. Even if certain information is lacking, use your judgment to make an educated guess to facilitate a streamlined assessment process. Now, take a deep breath and work on this problem step by step. Good luck! The CSV data is: {csv_data}
-            """
-        }
-    ]
+    fields = ownership_rule_fields(report_data)
+    if evaluations is not None:
+        fields = {**previous_fields(report, evaluations, cascade), **fields}
+    pending = missing_prompts(fields)
 
     if verbose:
         start_time = time.time()
 
-    tasks = [send_individual_prompt(prompt, report, verbose) for prompt in prompts]
-    responses = await asyncio.gather(*tasks)
+    if cascade and "validity" in pending and len(pending) > 1:
+        validity = await send_prompts(report, ["validity"], None, verbose)
+        if validity is None:
+            return None
+        fields.update(validity)
+        pending = missing_prompts(fields)
+        if is_confidently_invalid(fields):
+            print(colored(f"Report {report} is predicted Invalid with {fields.get('validityCertaintyScore')}% certainty, skipping the {', '.join(pending)} prompts.", 'cyan'))
+            metrics.incr(CASCADE_PROMPTS_SKIPPED, len(pending))
+            fields.update(cascade_placeholders(pending, fields))
+            pending = []
+
+    ownership_text = ownership_prompt_text(report_search_text(report_data)) if "ownership" in pending else None
+    if combined and pending:
+        response = await send_individual_prompt(build_combined_prompt(report, ownership_text, pending), report, verbose)
+        metrics.incr("Hai completion requests")
+        if response is not None and 'response' in response:
+            try:
+                parsed = parse_json_with_control_chars(response['response'])
+            except Exception as e:
+                print(colored(f"Error parsing combined JSON response: {e}", 'light_red'))
+                parsed = None
+            if isinstance(parsed, dict):
+                fields = {**parsed, **fields}
+        pending = missing_prompts(fields)
+        if pending:
+            print(colored(f"Combined response is missing the {', '.join(pending)} fields, falling back to separate prompts.", 'yellow'))
+            metrics.incr("Combined responses with missing fields")
+
+    if pending:
+        parsed = await send_prompts(report, pending, ownership_text, verbose)
+        if parsed is None:
+            return None
+        fields.update(parsed)
 
     if verbose:
         end_time = time.time()
         execution_time = end_time - start_time
         print(colored(f"Execution Time: {execution_time} seconds", 'cyan'))
-        print(colored("Responses from Hai:", 'blue'))
-        print(responses)
 
-    if responses[0] is None or 'response' not in responses[0]:
-        print(colored("Error: Validity response is None or invalid.", 'light_red'))
-        return None
+    result = fields_to_result(fields)
+    if cache_key is not None:
+        get_cache().put(cache_key, report, result)
+    return result
 
-    if responses[1] is None or 'response' not in responses[1]:
-        print(colored("Error: Complexity response is None or invalid.", 'light_red'))
-        return None
+async def send_batch_to_hai(reports, verbose, report_data=None, **hai_options):
+    """
+    Sends several security reports to the Hai API in a single completion request.
 
-    if responses[2] is None or 'response' not in responses[2]:
-        print(colored("Error: Ownership response is None or invalid.", 'light_red'))
-        return None
+    Reports with a cached result are left out of the batch. Reports for which the answer is missing or incomplete
+    are sent again on their own with `send_to_hai`.
 
-    try:
-        pV = parse_json_with_control_chars(responses[0]['response'])
-        pC = parse_json_with_control_chars(responses[1]['response'])
-        pO = parse_json_with_control_chars(responses[2]['response'])
-    except Exception as e:
-        print(colored(f"Error parsing JSON response: {e}", 'light_red'))
-        return None
+    Args:
+        reports (list): The IDs of the security reports.
+        verbose (bool): Whether to print verbose output.
+        report_data (dict): The reports as returned by the HackerOne API keyed by report ID, if they have been retrieved.
+        **hai_options: Keyword arguments passed on to `send_to_hai` for reports that are sent again.
 
-    predictedValidity = pV.get('predictedValidity', 'Unknown')
-    predictedValidityCertaintyScore = pV.get('validityCertaintyScore', 0)
-    predictedValidityReasoning = pV.get('validityReasoning', 'No reasoning provided')
-    predictedComplexity = pC.get('predictedComplexity', 'Unknown')
-    predictedComplexityCertaintyScore = pC.get('complexityCertaintyScore', 0)
-    predictedComplexityReasoning = pC.get('complexityReasoning', 'No reasoning provided')
-    predictedOwnershipCertaintyScore = pO.get('ownershipCertaintyScore', 0)
-    predictedOwnershipReasoning = pO.get('ownershipReasoning', 'No reasoning provided')
-    productArea = pO.get('productArea', 'Unknown')
-    squadOwner = pO.get('squadOwner', 'Unknown')
+    Returns:
+        dict: The result tuple of `send_to_hai` for every report, or None for reports that could not be evaluated.
+    """
+    report_data = report_data or {}
+    results = {}
+    cache_keys = {report: result_cache_key(report, report_data.get(report)) for report in reports}
+    if not hai_options.get("refresh"):
+        for report in reports:
+            if cache_keys[report] is not None:
+                result = cached_result(report, cache_keys[report])
+                if result is not None:
+                    results[report] = result
+        reports = [report for report in reports if report not in results]
+        if not reports:
+            return results
 
-    return (predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning,
-            predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning,
-            predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner)
+    known_fields = {str(report): ownership_rule_fields(report_data.get(report)) for report in reports}
+    names = tuple(PROMPT_KEYS)
+    ownership_text = None
+    if all(known_fields.values()):
+        names = tuple(name for name in names if name != "ownership")
+    else:
+        search_text = " ".join(report_search_text(report_data.get(report)) for report in reports if not known_fields[str(report)]).strip()
+        ownership_text = ownership_prompt_text(search_text, len(reports))
+
+    response = await send_individual_prompt(build_batch_prompt(reports, ownership_text, names), list(reports), verbose)
+    metrics.incr("Hai completion requests")
+    if response is not None and 'response' in response:
+        fields = split_batch_response(response['response'], reports, known_fields)
+    else:
+        fields = dict.fromkeys(reports)
+
+    for report in reports:
+        if fields[report] is not None:
+            results[report] = fields_to_result(fields[report])
+            if cache_keys[report] is not None:
+                get_cache().put(cache_keys[report], report, results[report])
+    malformed = [report for report in reports if fields[report] is None]
+    if malformed:
+        print(colored(f"Batch response is missing or incomplete for reports {', '.join(str(report) for report in malformed)}, sending them again on their own.", 'yellow'))
+        metrics.incr("Reports sent again after a malformed batch response", len(malformed))
+        retries = await asyncio.gather(*(send_to_hai(report, verbose, report_data=report_data.get(report), **hai_options) for report in malformed))
+        results.update(zip(malformed, retries))
+    return results
 
 async def send_individual_prompt(prompt, report, verbose):
     """
@@ -120,45 +641,45 @@ async def send_individual_prompt(prompt, report, verbose):
 
     Args:
         prompt (dict): The prompt to send to the Hai API.
-        report (str): The ID of the security report.
+        report (str or list): The ID of the security report, or a list of IDs for a batch prompt.
         verbose (bool): Whether to print verbose output.
 
     Returns:
         dict: The response from the Hai API.
 
     """
-    async with aiohttp.ClientSession() as session:
-        data = {
-            "data": {
-                "type": "completion-request",
-                "attributes": {
-                    "messages": [prompt],
-                    "report_ids": [report]     
-                }
-            },
-        }
+    session = get_session()
+    data = {
+        "data": {
+            "type": "completion-request",
+            "attributes": {
+                "messages": [prompt],
+                "report_ids": report if isinstance(report, list) else [report]
+            }
+        },
+    }
 
-        if verbose:
-            print(colored("Request sent to Hai:", 'blue'))
-            print(data)
+    if verbose:
+        print(colored("Request sent to Hai:", 'blue'))
+        print(data)
 
-        try:
-            async with session.post('https://api.hackerone.com/v1/hai/chat/completions', auth=aiohttp.BasicAuth(settings.api_name, settings.api_key), json=data, headers=settings.headers) as r:
-                try:
-                    response_data = await r.json()
-                except aiohttp.ContentTypeError:
-                    # Print the raw response text if not JSON
-                    raw_response = await r.text()
-                    print(colored(f"Error: Received non-JSON response from API: {raw_response}", 'light_red'))
-                    return None
-
-                if verbose:
-                    print(colored("Response from Hai:", 'blue'))
-                    print(response_data)
-                return await wait_for_hai(response_data, verbose)
-        except Exception as err:
-            print(colored(f"Unexpected error: {err}, {type(err)}", 'light_red'))
-            raise err
+    try:
+        async with session.post(HAI_COMPLETIONS_URL, json=data) as r:
+            try:
+                response_data = await r.json()
+            except aiohttp.ContentTypeError:
+                # Print the raw response text if not JSON
+                raw_response = await r.text()
+                print(colored(f"Error: Received non-JSON response from API: {raw_response}", 'light_red'))
+                return None
+
+            if verbose:
+                print(colored("Response from Hai:", 'blue'))
+                print(response_data)
+        return await wait_for_hai(response_data, verbose)
+    except Exception as err:
+        print(colored(f"Unexpected error: {err}, {type(err)}", 'light_red'))
+        raise err
 
 async def wait_for_hai(response_data, verbose=False):
     """
@@ -183,11 +704,4 @@ async def wait_for_hai(response_data, verbose=False):
     if response_data['data']['attributes']['state'] == 'completed':
         print(colored("Response received and the request has been successfully completed!", 'light_green'))
         return response_data['data']['attributes']
-    else:
-        print(colored("Waiting for response completion...", 'light_grey'))
-        await asyncio.sleep(2)
-        url = f"https://api.hackerone.com/v1/hai/chat/completions/{response_data['data']['id']}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, auth=aiohttp.BasicAuth(settings.api_name, settings.api_key)) as r:
-                new_response_data = await r.json()
-                return await wait_for_hai(new_response_data, verbose)
+    return await wait_for_completion(response_data['data']['id'], verbose)
@@ -0,0 +1,242 @@
+"""
+Journal module
+
+This module contains the action journal. Before the actions of a report run, its Hai result and the enabled actions
+are written to the journal, and every action that succeeds is recorded as done. When the process dies after Hai
+answered but before all actions finished, the next run of the CLI or the watcher replays the unfinished actions from
+the journal instead of sending the report to Hai again.
+
+The journal is a SQLite file in WAL mode, like the result cache. Finished entries are only marked as finished when
+their actions are done; compaction deletes them, together with entries too old to replay, and truncates the WAL. It
+runs when the journal is opened and after every COMPACT_EVERY finished entries.
+
+The CLI and the watcher can share the journal file. Every entry is leased to the process that runs its actions (its
+host name and PID), and the lease is renewed whenever one of its actions succeeds. A starting process only replays
+the entries whose lease has expired, which it claims with a single UPDATE, so it does not repeat the actions of a
+report another live process is running.
+
+Functions:
+- get_journal: Returns the action journal of this process, or None when the journal is disabled.
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+
+from config import load_settings
+
+settings = load_settings()
+
+# Compaction rewrites the WAL, so it only runs once every this many finished entries.
+COMPACT_EVERY = 100
+
+PENDING = "pending"
+FINISHED = "finished"
+
+def owner_alive(owner):
+    """
+    Returns whether the process that owns an entry may still be running.
+
+    Args:
+        owner (str): The owner of the entry, "<host name>:<PID>".
+
+    Returns:
+        bool: False when the owner is a process on this host that no longer exists, True otherwise.
+    """
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class ActionJournal:
+    """
+    A SQLite journal of the Hai results whose actions have not all finished yet.
+    """
+    def __init__(self, path, retention, lease=300):
+        """
+        Initialize the action journal
+
+        path (str): The path to the SQLite file, ":memory:" for a journal that is not persisted.
+        retention (float): The number of seconds after which an unfinished entry is no longer replayed, 0 for no limit.
+        lease (float): The number of seconds after the last sign of life of its process that an entry can be replayed.
+        """
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.retention = retention
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # The watcher opens the journal on one thread and uses it on another; the statements are never concurrent.
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "report_id TEXT PRIMARY KEY, result TEXT NOT NULL, flags TEXT NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "owner TEXT, lease_until REAL)"
+        )
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if "owner" not in [row[1] for row in self.connection.execute("PRAGMA table_info(entries)")]:
+                # The entries of a journal created before entries were leased have no owner and can be replayed.
+                self.connection.execute("ALTER TABLE entries ADD COLUMN owner TEXT")
+                self.connection.execute("ALTER TABLE entries ADD COLUMN lease_until REAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS actions ("
+            "report_id TEXT NOT NULL, name TEXT NOT NULL, done_at REAL NOT NULL, PRIMARY KEY (report_id, name))"
+        )
+        self._finished = 0
+        self.compact()
+
+    def begin(self, report_id, result, flags):
+        """
+        Records the Hai result of a report before its actions run, replacing an earlier entry for the report.
+
+        Args:
+            report_id (str): The ID of the report.
+            result (tuple): The result of `send_to_hai`.
+            flags (dict): The enabled actions: comment_hai_flag, custom_field_hai_flag and csv_output_flag.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM actions WHERE report_id = ?", (str(report_id),))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (report_id, result, flags, status, updated_at, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(report_id), json.dumps(list(result)), json.dumps(flags), PENDING, now, self.owner, now + self.lease)
+            )
+
+    def action_done(self, report_id, name):
+        """
+        Records that an action of a report succeeded, renewing the lease of the entry.
+
+        Args:
+            report_id (str): The ID of the report.
+            name (str): The name of the action, e.g. "Private comment".
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO actions (report_id, name, done_at) VALUES (?, ?, ?)", (str(report_id), name, now)
+            )
+            self.connection.execute(
+                "UPDATE entries SET lease_until = ? WHERE report_id = ? AND owner = ?", (now + self.lease, str(report_id), self.owner)
+            )
+
+    def done_actions(self, report_id):
+        """
+        Returns the actions of a report that already succeeded.
+
+        Args:
+            report_id (str): The ID of the report.
+
+        Returns:
+            set: The names of the actions.
+        """
+        rows = self.connection.execute("SELECT name FROM actions WHERE report_id = ?", (str(report_id),))
+        return {row[0] for row in rows.fetchall()}
+
+    def finish(self, report_id):
+        """
+        Marks the entry of a report as finished once all its actions succeeded.
+
+        Args:
+            report_id (str): The ID of the report.
+        """
+        self.connection.execute(
+            "UPDATE entries SET status = ?, updated_at = ? WHERE report_id = ?", (FINISHED, time.time(), str(report_id))
+        )
+        self._finished += 1
+        if self._finished % COMPACT_EVERY == 0:
+            self.compact()
+
+    def finish_when_done(self, report_id, names):
+        """
+        Marks the entry of a report as finished when all of its actions are recorded as done.
+
+        Args:
+            report_id (str): The ID of the report.
+            names (list): The names of all actions of the report.
+
+        Returns:
+            bool: Whether the entry has been marked as finished.
+        """
+        if not set(names) <= self.done_actions(report_id):
+            return False
+        self.finish(report_id)
+        return True
+
+    def pending(self):
+        """
+        Returns the entries whose actions have not all finished.
+
+        Returns:
+            list: A (report ID, result, flags) tuple for every entry, oldest first.
+        """
+        rows = self.connection.execute("SELECT report_id, result, flags FROM entries WHERE status = ? ORDER BY updated_at", (PENDING,))
+        return [(report_id, tuple(json.loads(result)), json.loads(flags)) for report_id, result, flags in rows.fetchall()]
+
+    def claim(self):
+        """
+        Claims the entries whose actions have not all finished and whose lease has expired, to replay them.
+
+        The entries of a process on this host that is no longer running are claimed right away, so a restarted
+        process does not have to wait for the leases of the process it replaces.
+
+        Returns:
+            list: A (report ID, result, flags) tuple for every claimed entry, oldest first.
+        """
+        now = time.time()
+        owners = self.connection.execute("SELECT DISTINCT owner FROM entries WHERE status = ? AND lease_until >= ?", (PENDING, now))
+        dead = [owner for owner, in owners.fetchall() if owner != self.owner and not owner_alive(owner)]
+        rows = self.connection.execute(
+            "UPDATE entries SET owner = ?, lease_until = ? WHERE status = ? AND (owner IS NULL OR lease_until < ? "
+            f"OR owner IN ({', '.join('?' * len(dead))})) RETURNING report_id, result, flags, updated_at",
+            (self.owner, now + self.lease, PENDING, now, *dead)
+        ).fetchall()
+        rows.sort(key=lambda row: row[3])
+        return [(report_id, tuple(json.loads(result)), json.loads(flags)) for report_id, result, flags, _ in rows]
+
+    def compact(self):
+        """
+        Deletes the finished entries and the entries older than the retention, and truncates the WAL.
+        """
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM entries WHERE status = ?", (FINISHED,))
+            if self.retention:
+                self.connection.execute("DELETE FROM entries WHERE updated_at < ?", (time.time() - self.retention,))
+            self.connection.execute("DELETE FROM actions WHERE report_id NOT IN (SELECT report_id FROM entries)")
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """
+        Closes the SQLite connection.
+        """
+        self.connection.close()
+
+_journal = None
+
+def get_journal(create=True):
+    """
+    Returns the action journal of this process, opening it when needed.
+
+    Args:
+        create (bool): Whether to create the journal file when it does not exist yet.
+
+    Returns:
+        ActionJournal: The action journal, or None when JOURNAL_FILE is empty, or when it does not exist and create is False.
+    """
+    global _journal
+    if _journal is None and settings.journal_file_path:
+        if not create and not os.path.exists(settings.journal_file_path):
+            return None
+        _journal = ActionJournal(settings.journal_file_path, settings.journal_retention, settings.journal_lease)
+    return _journal
@@ -4,7 +4,11 @@ Main module
 import argparse
 import asyncio
 import sys
+import metrics
+from actions import replay_journal
+from api import close_session, print_connection_stats
 from reports import get_all_reports, get_reports
+from sink import close_sink
 from utils import print_banner
 from termcolor import colored
 
@@ -27,11 +31,21 @@ def parse_args():
     parser.add_argument("-f", "--custom_field_hai", help="Have Hai update a specific custom field", action="store_true")
     parser.add_argument("-o", "--csv_output", action="store_true", help="Output Hai responses to CSV file")
     parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    parser.add_argument("--incremental", help="Only retrieve reports created since the previous incremental run with the same filters", action="store_true")
+    parser.add_argument("--combined", help="Ask Hai for validity, complexity and ownership in a single prompt", action="store_true")
+    parser.add_argument("--cascade", help="Only ask Hai for complexity and ownership when the report is not confidently Invalid", action="store_true")
+    parser.add_argument("--refresh", help="Send reports to Hai again even when a cached result exists", action="store_true")
+    parser.add_argument("-b", "--batch_size", help="Number of reports to send to Hai in a single completion request", type=int, default=1)
+    parser.add_argument("-n", "--concurrency", help="Number of reports to process at the same time", type=int, default=1)
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.cascade and args.batch_size > 1:
+        # A batch is evaluated in a single combined prompt, which has no validity step to cascade from.
+        parser.error("--cascade cannot be combined with a --batch_size larger than 1")
+    return args
 
 def run(cli_args):
     """
@@ -48,16 +62,27 @@ def run(cli_args):
     custom_field_hai_flag = cli_args.custom_field_hai
     csv_output_flag = cli_args.csv_output
     verbose = cli_args.verbose
+    concurrency = cli_args.concurrency
+    hai_options = {"combined": cli_args.combined, "cascade": cli_args.cascade, "refresh": cli_args.refresh}
+    batch_size = cli_args.batch_size
 
     async def main():
-        if report_list:
-            print(colored("Retrieving specified reports", 'cyan'))
-            await get_reports(report_list, severity, state, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose)
-        else:
-            print(colored("Retrieving all reports matching criteria", 'cyan'))
-            await get_all_reports(severity, state, reference, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose)
+        try:
+            await replay_journal(verbose)
+            if report_list:
+                print(colored("Retrieving specified reports", 'cyan'))
+                await get_reports(report_list, severity, state, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, concurrency, hai_options, batch_size)
+            else:
+                print(colored("Retrieving all reports matching criteria", 'cyan'))
+                await get_all_reports(severity, state, reference, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, concurrency, hai_options, batch_size, incremental=cli_args.incremental)
+        finally:
+            close_sink()
+            await close_session()
 
+    metrics.start()
     asyncio.run(main())
+    metrics.print_summary()
+    print_connection_stats()
 
 if __name__ == "__main__":
     args = parse_args()
@@ -0,0 +1,107 @@
+"""
+Metrics module
+
+This module keeps simple counters for a single run of the CLI or the watcher, so that a summary
+including the throughput of the run can be printed once it ends.
+
+Functions:
+- start: Resets the counters and starts the run clock.
+- incr: Increments a named counter.
+- get: Returns the current value of a named counter.
+- add_rate: Registers a rate of two counters that is printed in the summary.
+- observe: Records a duration under a name, e.g. the time a report waited to be triaged.
+- print_summary: Prints the throughput of the run and every counter that has been recorded.
+"""
+import time
+from collections import Counter
+
+from termcolor import colored
+
+REPORTS_PROCESSED = "Reports processed"
+REPORTS_FAILED = "Reports failed"
+
+counters = Counter()
+rates = {}
+# The number, total and maximum of the durations observed under every name.
+timings = {}
+_run_started = time.monotonic()
+
+def start():
+    """
+    Resets the counters and starts the run clock.
+    """
+    global _run_started
+    counters.clear()
+    timings.clear()
+    _run_started = time.monotonic()
+
+def incr(name, amount=1):
+    """
+    Increments a named counter.
+
+    Args:
+        name (str): The human readable name of the counter.
+        amount (int): The amount to add to the counter.
+    """
+    counters[name] += amount
+
+def get(name):
+    """
+    Returns the current value of a named counter.
+
+    Args:
+        name (str): The human readable name of the counter.
+
+    Returns:
+        int: The value of the counter.
+    """
+    return counters[name]
+
+def add_rate(name, numerator, denominator):
+    """
+    Registers a rate of two counters that is printed in the summary, e.g. a hit rate.
+
+    Args:
+        name (str): The human readable name of the rate.
+        numerator (str): The name of the counter of hits.
+        denominator (str): The name of the counter of attempts.
+    """
+    rates[name] = (numerator, denominator)
+
+def observe(name, seconds):
+    """
+    Records a duration under a name, printed in the summary as its average and maximum.
+
+    Args:
+        name (str): The human readable name of the duration.
+        seconds (float): The duration in seconds.
+    """
+    count, total, longest = timings.get(name, (0, 0.0, 0.0))
+    timings[name] = (count + 1, total + seconds, max(longest, seconds))
+
+def elapsed():
+    """
+    Returns the number of seconds since the run started.
+
+    Returns:
+        float: The elapsed time in seconds.
+    """
+    return time.monotonic() - _run_started
+
+def print_summary():
+    """
+    Prints the throughput of the run and every counter that has been recorded.
+    """
+    duration = elapsed()
+    processed = counters[REPORTS_PROCESSED]
+    rate = processed / duration * 60 if duration > 0 else 0.0
+    print(colored("Run summary:", 'cyan'))
+    print(colored(f"  {processed} reports processed ({counters[REPORTS_FAILED]} failed) in {duration:.1f}s - {rate:.1f} reports/min", 'cyan'))
+    for name, value in counters.items():
+        if name not in (REPORTS_PROCESSED, REPORTS_FAILED):
+            print(colored(f"  {name}: {value}", 'cyan'))
+    for name, (numerator, denominator) in rates.items():
+        if counters[denominator]:
+            print(colored(f"  {name}: {100 * counters[numerator] / counters[denominator]:.1f}% ({counters[numerator]} of {counters[denominator]})", 'cyan'))
+    for name, (count, total, longest) in sorted(timings.items()):
+        print(colored(f"  {name}: {total / count:.1f}s average, {longest:.1f}s max over {count} reports", 'cyan'))
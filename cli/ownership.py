@@ -0,0 +1,382 @@
+"""
+Ownership module
+
+This module loads the ownership file that maps product areas to squad owners. The file is parsed once and cached;
+it is only read again when its modification time changes, so a run over many reports does not re-read it per report.
+
+For the ownership prompt the table is encoded compactly: one line per squad owner, followed by the product areas
+that squad owns. This avoids repeating squad names and the quotes and commas of a Python list of CSV lines.
+
+For large ownership files a lexical BM25 index over the product areas (and the optional "Keywords" column) is built
+once per table. It matches the title, weakness and asset of a report against the table, so only the most likely
+product areas have to be put into the ownership prompt.
+
+An optional ownership rules file maps asset identifiers, URL patterns and weakness IDs directly to a product area and
+squad owner. The rules are compiled once per file: exact assets and weakness IDs into dicts, asset patterns with a
+leading or trailing "*" into suffix and prefix tries, and all URL patterns into one combined regex that rules out
+reports without a matching URL in a single scan. When every matching rule agrees on the owner, the ownership prompt
+does not have to be sent at all.
+
+The asset and weakness of a report are set by HackerOne, so rules that match them are certain. A URL in the text of a
+report is only something the reporter mentioned, e.g. a third-party page, so URL rules that match the text alone are
+only used when no rule matches the asset or weakness, with a lower certainty that does not skip the ownership prompt.
+
+Functions:
+- load_ownership: Returns the cached ownership table for a file, reloading it when the file has changed.
+- load_ownership_rules: Returns the cached ownership rules for a file, or None when there is no rules file.
+- report_search_text: Returns the title, weakness and asset of a report as a single search text.
+"""
+import csv
+import hashlib
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+PRODUCT_AREA_COLUMN = "Product Area"
+SQUAD_OWNER_COLUMN = "Squad Owner"
+KEYWORDS_COLUMN = "Keywords"
+RULE_TYPE_COLUMN = "Type"
+RULE_PATTERN_COLUMN = "Pattern"
+
+RULE_TYPES = ("asset", "url", "weakness")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+URL_PATTERN = re.compile(r"https?://[^\s<>\"'`)\]]+", re.IGNORECASE)
+
+# The certainty of a rule that matches the asset or weakness of a report, and of URL rules that only match the text.
+STRUCTURED_CERTAINTY = 100
+URL_MENTION_CERTAINTY = 50
+
+OwnershipRule = namedtuple("OwnershipRule", ["rule_type", "pattern", "product_area", "squad_owner"])
+OwnershipMatch = namedtuple("OwnershipMatch", ["rule", "certainty"])
+
+class OwnershipTable:
+    """
+    The product areas and squad owners of an ownership file.
+    """
+    def __init__(self, rows, mtime, fingerprint):
+        """
+        Initialize the ownership table
+
+        rows (list): One dict per row of the ownership file, keyed by column name.
+        mtime (int): The modification time of the ownership file in nanoseconds.
+        fingerprint (str): A hash of the contents of the ownership file.
+        """
+        self.rows = rows
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.prompt_text = encode_for_prompt(rows)
+        self._index = None
+
+    @property
+    def index(self):
+        """
+        The BM25 index over the rows of the table, built on first use.
+        """
+        if self._index is None:
+            self._index = BM25Index([row_search_text(row) for row in self.rows])
+        return self._index
+
+    def prompt_text_for(self, search_text, shortlist_size):
+        """
+        Returns the encoded table for the ownership prompt of a report.
+
+        When the table has more than `shortlist_size` rows, only the `shortlist_size` rows that best match the
+        report are encoded. The whole table is used when the shortlist is disabled or nothing matches.
+
+        Args:
+            search_text (str): The title, weakness and asset of the report.
+            shortlist_size (int): The maximum number of rows in the prompt, 0 to always use the whole table.
+
+        Returns:
+            str: The encoded table.
+        """
+        if not shortlist_size or not search_text or len(self.rows) <= shortlist_size:
+            return self.prompt_text
+        ranked = self.index.search(search_text, shortlist_size)
+        if not ranked:
+            return self.prompt_text
+        return encode_for_prompt([self.rows[position] for position in sorted(ranked)])
+
+class BM25Index:
+    """
+    A lexical BM25 index over a list of short documents.
+    """
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        total = len(documents)
+        self.idf = {term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5)) for term, frequency in document_frequency.items()}
+        self.postings = {}
+        for position, counts in enumerate(self.term_counts):
+            for term in counts:
+                self.postings.setdefault(term, []).append(position)
+
+    def search(self, text, limit):
+        """
+        Returns the positions of the documents that best match a text.
+
+        Args:
+            text (str): The search text.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: The positions of the best matching documents with a score above zero, best match first.
+        """
+        scores = Counter()
+        for term in set(tokenize(text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position in self.postings[term]:
+                frequency = self.term_counts[position][term]
+                norm = 1 - self.b + self.b * self.lengths[position] / self.average_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * norm)
+        return [position for position, _ in scores.most_common(limit)]
+
+class _Trie:
+    """
+    A character trie that finds the longest key that is a prefix of a text.
+    """
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        """
+        Adds a value under a key; a key inserted more than once keeps all of its values.
+        """
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def longest_prefix(self, text):
+        """
+        Returns the values of the longest key that is a prefix of the text, or an empty list.
+        """
+        node = self.root
+        values = node.get(None, [])
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            values = node.get(None, values)
+        return values
+
+class OwnershipRules:
+    """
+    The compiled rules of an ownership rules file.
+    """
+    def __init__(self, rows, mtime, fingerprint):
+        """
+        Initialize the ownership rules
+
+        rows (list): One dict per row of the rules file, keyed by column name.
+        mtime (int): The modification time of the rules file in nanoseconds.
+        fingerprint (str): A hash of the contents of the rules file.
+
+        Raises:
+            ValueError: If a rule has an unknown type or an invalid URL pattern.
+        """
+        self.mtime = mtime
+        self.fingerprint = fingerprint
+        self.rules = []
+        self.assets = {}
+        self.asset_prefixes = _Trie()
+        self.asset_suffixes = _Trie()
+        self.weaknesses = {}
+        self.url_rules = []
+        for row in rows:
+            rule = OwnershipRule(row.get(RULE_TYPE_COLUMN, "").lower(), row.get(RULE_PATTERN_COLUMN, ""), row[PRODUCT_AREA_COLUMN], row[SQUAD_OWNER_COLUMN])
+            if rule.rule_type not in RULE_TYPES or not rule.pattern:
+                raise ValueError(f"Invalid ownership rule {rule.rule_type!r} {rule.pattern!r}: the type must be one of {', '.join(RULE_TYPES)} and the pattern must not be empty.")
+            self.rules.append(rule)
+            if rule.rule_type == "weakness":
+                self.weaknesses.setdefault(rule.pattern, []).append(rule)
+            elif rule.rule_type == "url":
+                try:
+                    self.url_rules.append((re.compile(rule.pattern, re.IGNORECASE), rule))
+                except re.error as e:
+                    raise ValueError(f"Invalid URL pattern in ownership rule {rule.pattern!r}: {e}") from e
+            elif rule.pattern.endswith("*"):
+                self.asset_prefixes.insert(rule.pattern[:-1].lower(), rule)
+            elif rule.pattern.startswith("*"):
+                self.asset_suffixes.insert(rule.pattern[:0:-1].lower(), rule)
+            else:
+                self.assets.setdefault(rule.pattern.lower(), []).append(rule)
+        self.url_pattern = re.compile("|".join(f"(?:{pattern.pattern})" for pattern, _ in self.url_rules), re.IGNORECASE) if self.url_rules else None
+
+    def match(self, report_data):
+        """
+        Returns the rule that determines the owner of a report, with its certainty.
+
+        The most specific asset rule is used: an exact asset before the longest prefix or suffix. Every URL rule that
+        matches the asset, and the rule for its weakness, are used as well. Only when none of these match are the URL
+        rules matched against the URLs in the vulnerability information, with URL_MENTION_CERTAINTY. The report only
+        has a rule when all the rules used agree on the product area and squad owner.
+
+        Args:
+            report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope.
+
+        Returns:
+            OwnershipMatch: The first matching rule and its certainty, or None when no rule or conflicting rules match.
+        """
+        if not report_data or not self.rules:
+            return None
+        report_data = report_data.get("data", report_data)
+        relationships = report_data.get("relationships", {})
+        weakness_id = relationships.get("weakness", {}).get("data", {}).get("id")
+        asset = relationships.get("structured_scope", {}).get("data", {}).get("attributes", {}).get("asset_identifier") or ""
+
+        matches = []
+        certainty = STRUCTURED_CERTAINTY
+        if asset:
+            key = asset.lower()
+            matches.extend(self.assets.get(key) or self.asset_prefixes.longest_prefix(key) or self.asset_suffixes.longest_prefix(key[::-1]))
+            matches.extend(self.url_rules_matching([asset]))
+        if weakness_id is not None:
+            matches.extend(self.weaknesses.get(str(weakness_id), []))
+        if not matches:
+            matches = self.url_rules_matching(URL_PATTERN.findall(report_data.get("attributes", {}).get("vulnerability_information") or ""))
+            certainty = URL_MENTION_CERTAINTY
+
+        if not matches or len({(rule.product_area, rule.squad_owner) for rule in matches}) > 1:
+            return None
+        return OwnershipMatch(matches[0], certainty)
+
+    def url_rules_matching(self, targets):
+        """
+        Returns the URL rules that match any of the targets.
+
+        Args:
+            targets (list): The asset identifiers or URLs.
+
+        Returns:
+            list: The matching URL rules, in the order of the rules file.
+        """
+        if self.url_pattern is None:
+            return []
+        targets = [target for target in targets if target and self.url_pattern.search(target)]
+        return [rule for pattern, rule in self.url_rules if any(pattern.search(target) for target in targets)]
+
+def tokenize(text):
+    """
+    Splits a text into lowercase alphanumeric terms.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def row_search_text(row):
+    """
+    Returns the text of an ownership row that is indexed: its product area and keywords.
+    """
+    return f"{row[PRODUCT_AREA_COLUMN]} {row.get(KEYWORDS_COLUMN, '')}"
+
+def report_search_text(report_data):
+    """
+    Returns the title, weakness and asset of a report as a single search text.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope.
+
+    Returns:
+        str: The search text, empty when the report is not available.
+    """
+    if not report_data:
+        return ""
+    report_data = report_data.get("data", report_data)
+    relationships = report_data.get("relationships", {})
+    weakness = relationships.get("weakness", {}).get("data", {}).get("attributes", {})
+    scope = relationships.get("structured_scope", {}).get("data", {}).get("attributes", {})
+    parts = [
+        report_data.get("attributes", {}).get("title"),
+        weakness.get("name"),
+        scope.get("asset_identifier")
+    ]
+    return " ".join(part for part in parts if part)
+
+def encode_for_prompt(rows):
+    """
+    Encodes ownership rows as one line per squad owner with the product areas of that squad.
+
+    Args:
+        rows (list): The rows of the ownership file.
+
+    Returns:
+        str: The encoded table, e.g. "Enterprise Scale: 2FA | Custom Fields".
+    """
+    areas_by_squad = {}
+    for row in rows:
+        areas_by_squad.setdefault(row[SQUAD_OWNER_COLUMN], []).append(row[PRODUCT_AREA_COLUMN])
+    return "\n".join(f"{squad}: {' | '.join(areas)}" for squad, areas in areas_by_squad.items())
+
+def parse_ownership(content):
+    """
+    Parses the contents of an ownership file.
+
+    Args:
+        content (str): The contents of the ownership file, starting with a header row.
+
+    Returns:
+        list: One dict per row, keyed by column name. Rows without a product area or squad owner are skipped.
+    """
+    rows = []
+    for row in csv.DictReader(content.splitlines()):
+        row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+        if row.get(PRODUCT_AREA_COLUMN) and row.get(SQUAD_OWNER_COLUMN):
+            rows.append(row)
+    return rows
+
+_cache = {}
+
+def _load_cached(path, build):
+    """
+    Returns the cached object built from a file, building it again when the file has changed.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = _cache.get((build, path))
+    if cached is None or cached.mtime != mtime:
+        with open(path, encoding='UTF-8') as file:
+            content = file.read()
+        cached = build(content, mtime)
+        _cache[(build, path)] = cached
+    return cached
+
+def _build_table(content, mtime):
+    return OwnershipTable(parse_ownership(content), mtime, hashlib.sha256(content.encode()).hexdigest())
+
+def _build_rules(content, mtime):
+    return OwnershipRules(parse_ownership(content), mtime, hashlib.sha256(content.encode()).hexdigest())
+
+def load_ownership(path):
+    """
+    Returns the cached ownership table for a file, reloading it when the file has changed.
+
+    Args:
+        path (str): The path to the ownership file.
+
+    Returns:
+        OwnershipTable: The ownership table.
+    """
+    return _load_cached(path, _build_table)
+
+def load_ownership_rules(path):
+    """
+    Returns the cached ownership rules for a file, reloading them when the file has changed.
+
+    Args:
+        path (str): The path to the ownership rules file.
+
+    Returns:
+        OwnershipRules: The compiled rules, or None when the file does not exist.
+
+    Raises:
+        ValueError: If a rule has an unknown type or an invalid URL pattern.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    return _load_cached(path, _build_rules)
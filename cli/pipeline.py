@@ -0,0 +1,127 @@
+"""
+Pipeline module
+
+This module contains the worker pool that runs reports through Hai and the follow-up actions concurrently.
+At most `concurrency` reports are in flight at any time. While more than one report is in flight, everything a
+report prints is buffered and released in report order, so the output of every report stays readable.
+
+The items can also come from an asynchronous iterator, such as reports that are still being retrieved. A worker
+then starts on an item as soon as the iterator produces it, instead of waiting for all items first.
+
+Functions:
+- run_pipeline: Runs a worker coroutine over a list or asynchronous iterator of items with bounded concurrency.
+"""
+import asyncio
+import contextlib
+import contextvars
+import sys
+import time
+
+import metrics
+from termcolor import colored
+
+_output_buffer = contextvars.ContextVar("output_buffer", default=None)
+
+class _TaskStdout:
+    """
+    Stdout proxy that sends the output of a pipeline task to the buffer of that task.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        """
+        Writes text to the buffer of the current task, or to the wrapped stream outside of a task.
+        """
+        buffer = _output_buffer.get()
+        if buffer is None:
+            return self._stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        """
+        Flushes the wrapped stream.
+        """
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+async def run_pipeline(items, worker, concurrency=1, label="reports"):
+    """
+    Runs `worker` over every item with at most `concurrency` items in flight.
+
+    A failing item does not stop the pipeline; the error is printed with the output of that item and counted.
+    Items are numbered in the order in which they are produced, which is the order of their output and results.
+
+    Args:
+        items (iterable or async iterable): The items to process, usually report IDs or batches of report IDs.
+        worker (coroutine function): Called with a single item.
+        concurrency (int): The maximum number of items processed at the same time.
+        label (str): What the items are called in the throughput message.
+
+    Returns:
+        list: The result of every item in item order, None for items that failed.
+    """
+    if hasattr(items, "__aiter__"):
+        source = aiter(items)
+        concurrency = max(1, int(concurrency or 1))
+    else:
+        items = list(items)
+        source = _iterate(items)
+        concurrency = max(1, min(int(concurrency or 1), len(items) or 1))
+    source_lock = asyncio.Lock()
+    results = []
+    outputs = {}
+    released = 0
+    failed = 0
+    start_time = time.monotonic()
+
+    def release_outputs(stream):
+        nonlocal released
+        while released in outputs:
+            stream.write("".join(outputs.pop(released)))
+            released += 1
+        stream.flush()
+
+    async def process(index, item, stream):
+        nonlocal failed
+        buffer = []
+        if concurrency > 1:
+            _output_buffer.set(buffer)
+        try:
+            results[index] = await worker(item)
+        except Exception as err:
+            failed += 1
+            metrics.incr(metrics.REPORTS_FAILED)
+            print(colored(f"Processing {item} failed: {err}, {type(err)}", 'light_red'))
+        finally:
+            _output_buffer.set(None)
+        outputs[index] = buffer
+        release_outputs(stream)
+
+    async def run_worker(stream):
+        while True:
+            async with source_lock:
+                try:
+                    item = await anext(source)
+                except StopAsyncIteration:
+                    return
+                index = len(results)
+                results.append(None)
+            await process(index, item, stream)
+
+    stream = sys.stdout
+    with contextlib.redirect_stdout(_TaskStdout(stream)):
+        await asyncio.gather(*(run_worker(stream) for _ in range(concurrency)))
+
+    execution_time = time.monotonic() - start_time
+    if results:
+        rate = len(results) / execution_time * 60 if execution_time > 0 else 0.0
+        print(colored(f"Processed {len(results)} {label} in {execution_time:.1f}s with concurrency {concurrency} ({rate:.1f} {label}/min, {failed} failed)", 'cyan'))
+    return results
@@ -0,0 +1,226 @@
+"""
+Poller module
+
+This module contains the poller that waits for Hai completions. Instead of running one polling loop per prompt,
+a single poller task keeps track of every outstanding completion and polls each one on its own schedule: quickly
+at first, then with an exponential backoff with jitter. A completion that has not finished before its deadline
+is given up on, and the coroutine waiting for it receives None, as it does right away for a completion that Hai
+reports as failed.
+
+A poll that fails with a network error, an unreadable response, a 5xx status or a 429 status is retried on the next
+poll of that completion, no sooner than HAI_POLL_MAX_INTERVAL seconds or the Retry-After of a 429, while any other
+4xx status or unexpected error fails that completion only, and the poller task is restarted when it stops unexpectedly, so a bad
+response never leaves the other coroutines waiting forever.
+
+Functions:
+- wait_for_completion: Waits until a Hai completion has finished and returns its attributes.
+"""
+import asyncio
+import contextvars
+import random
+
+import aiohttp
+import metrics
+from api import API_BASE_URL, get_session
+from config import load_settings
+from termcolor import colored
+
+HAI_COMPLETIONS_URL = f"{API_BASE_URL}/hai/chat/completions"
+# The states of a completion that will never complete.
+FAILED_STATES = ("failed", "errored", "cancelled")
+
+settings = load_settings()
+
+class _PendingCompletion:
+    """
+    A completion that is being polled.
+    """
+    def __init__(self, completion_id, future, now):
+        self.completion_id = completion_id
+        self.future = future
+        self.interval = settings.hai_poll_initial_interval
+        self.next_poll = now + self.interval
+        self.deadline = now + settings.hai_completion_timeout
+
+    def reschedule(self, now, delay=0.0):
+        """
+        Schedules the next poll with an exponential backoff and up to 20% jitter, at least `delay` seconds from now.
+        """
+        self.interval = min(self.interval * settings.hai_poll_backoff, settings.hai_poll_max_interval)
+        self.next_poll = now + max(self.interval * random.uniform(0.8, 1.2), delay)
+
+def retry_after(response):
+    """
+    Returns the number of seconds a response asks to wait before the next request.
+
+    Args:
+        response (aiohttp.ClientResponse): The response.
+
+    Returns:
+        float: The Retry-After header in seconds, or HAI_POLL_MAX_INTERVAL when it is missing or is not a number.
+    """
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return settings.hai_poll_max_interval
+
+class CompletionError(Exception):
+    """
+    Raised when a Hai completion failed or did not finish before its deadline.
+    """
+
+class CompletionPoller:
+    """
+    Polls every outstanding Hai completion from a single task.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._task = None
+        self._wakeup = asyncio.Event()
+
+    def wait(self, completion_id):
+        """
+        Starts tracking a completion.
+
+        Args:
+            completion_id (str): The ID of the completion.
+
+        Returns:
+            asyncio.Future: Resolves to the attributes of the completion, or raises CompletionError.
+        """
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(completion_id)
+        if pending is None:
+            pending = _PendingCompletion(completion_id, loop.create_future(), loop.time())
+            self._pending[completion_id] = pending
+        if self._task is None or self._task.done():
+            self._start(loop)
+        self._wakeup.set()
+        return pending.future
+
+    def _start(self, loop):
+        # The poller outlives the report that started it, so it must not share that report's context.
+        self._task = loop.create_task(self._run(), context=contextvars.Context())
+        self._task.add_done_callback(self._supervise)
+
+    def _supervise(self, task):
+        """
+        Restarts the poller task when it stopped with an error while completions are still outstanding.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        print(colored(f"Hai completion poller stopped unexpectedly, restarting it: {task.exception()!r}", 'light_red'))
+        metrics.incr("Hai completion poller restarts")
+        if task is self._task and self._pending and not task.get_loop().is_closed():
+            self._start(task.get_loop())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            now = loop.time()
+            for completion_id, pending in list(self._pending.items()):
+                if pending.future.done():
+                    # The coroutine waiting for this completion has been cancelled.
+                    del self._pending[completion_id]
+                elif now >= pending.deadline:
+                    metrics.incr("Hai completions timed out")
+                    self._resolve(pending, error=CompletionError(f"Hai completion {completion_id} did not finish within {settings.hai_completion_timeout}s."))
+
+            due = [pending for pending in self._pending.values() if pending.next_poll <= now]
+            if due:
+                results = await asyncio.gather(*(self._poll(pending) for pending in due), return_exceptions=True)
+                for pending, result in zip(due, results):
+                    if isinstance(result, Exception):
+                        self._resolve(pending, error=CompletionError(f"Polling Hai completion {pending.completion_id} failed: {result!r}"))
+                continue
+            if self._pending:
+                next_poll = min(min(p.next_poll, p.deadline) for p in self._pending.values())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.0, next_poll - now))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _poll(self, pending):
+        metrics.incr("Hai completion polls")
+        url = f"{HAI_COMPLETIONS_URL}/{pending.completion_id}"
+        try:
+            async with get_session().get(url) as r:
+                if r.status == 429 or r.status >= 500:
+                    # Hai is still working on the completion; the API is only asking to come back later.
+                    metrics.incr("Hai completion polls deferred")
+                    print(colored(f"Polling Hai completion {pending.completion_id} returned {r.status}, polling again later", 'yellow'))
+                    delay = retry_after(r) if r.status == 429 else settings.hai_poll_max_interval
+                    pending.reschedule(asyncio.get_running_loop().time(), delay)
+                    return
+                if r.status >= 400:
+                    self._resolve(pending, error=CompletionError(f"Polling Hai completion {pending.completion_id} returned {r.status}."))
+                    return
+                response_data = await r.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            # A malformed body raises a ValueError; like a network error it may be gone on the next poll.
+            print(colored(f"Error polling Hai completion {pending.completion_id}: {err!r}", 'light_red'))
+            pending.reschedule(asyncio.get_running_loop().time())
+            return
+
+        if not isinstance(response_data, dict) or not isinstance(response_data.get('data'), dict) or not isinstance(response_data['data'].get('attributes'), dict):
+            self._resolve(pending, error=CompletionError("Invalid response format from API."))
+            return
+        state = response_data['data']['attributes'].get('state')
+        if state == 'completed':
+            self._resolve(pending, response_data['data']['attributes'])
+        elif state in FAILED_STATES:
+            metrics.incr("Hai completions failed")
+            self._resolve(pending, error=CompletionError(f"Hai completion {pending.completion_id} {state}."))
+        else:
+            pending.reschedule(asyncio.get_running_loop().time())
+
+    def _resolve(self, pending, result=None, error=None):
+        self._pending.pop(pending.completion_id, None)
+        if pending.future.done():
+            return
+        if error is not None:
+            pending.future.set_exception(error)
+        else:
+            pending.future.set_result(result)
+
+_poller = None
+_poller_loop = None
+
+def get_poller():
+    """
+    Returns the poller of the running event loop, creating it when needed.
+
+    Returns:
+        CompletionPoller: The poller.
+    """
+    global _poller, _poller_loop
+    loop = asyncio.get_running_loop()
+    if _poller is None or _poller_loop is not loop:
+        _poller = CompletionPoller()
+        _poller_loop = loop
+    return _poller
+
+async def wait_for_completion(completion_id, verbose=False):
+    """
+    Waits until a Hai completion has finished and returns its attributes.
+
+    Args:
+        completion_id (str): The ID of the completion.
+        verbose (bool): Whether to print verbose output.
+
+    Returns:
+        dict: The attributes of the completion, or None when it failed or did not finish before its deadline.
+    """
+    print(colored("Waiting for response completion...", 'light_grey'))
+    try:
+        attributes = await get_poller().wait(completion_id)
+    except CompletionError as err:
+        print(colored(f"Error: {err}", 'light_red'))
+        return None
+
+    print(colored("Response received and the request has been successfully completed!", 'light_green'))
+    if verbose:
+        print(colored("Completed response from Hai:", 'blue'))
+        print(attributes)
+    return attributes
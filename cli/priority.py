@@ -0,0 +1,166 @@
+"""
+Priority module
+
+This module decides the order in which a backlog of reports is triaged, so a critical report does not wait behind
+hundreds of reports without a severity.
+
+The urgency of a report, between 0 and 1, is its severity rating, and among reports of the same severity the signal
+of its reporter (or their reputation when the signal is not known) and how long ago the report was created. Reports
+are triaged in the order of their priority key, the time they were queued plus PRIORITY_AGING_SECONDS for the least
+urgent report and nothing for the most urgent one. A report can therefore only be overtaken by reports queued less
+than PRIORITY_AGING_SECONDS after it, however many urgent reports keep coming, and with PRIORITY_AGING_SECONDS=0
+reports are triaged first-in first-out.
+
+Functions:
+- severity_rating: Returns the severity rating of a report.
+- report_urgency: Returns the urgency of a report.
+- priority_key: Returns the priority key of a report.
+- prioritized: Yields the items of an asynchronous iterator most urgent first.
+- observe_time_to_triage: Records the time a report took from being queued to being triaged.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timezone
+
+import metrics
+from config import load_settings
+from sync import report_created_at
+
+settings = load_settings()
+
+SEVERITY_URGENCY = {"critical": 1.0, "high": 0.75, "medium": 0.5, "low": 0.25, "none": 0.0}
+# Reports are often rated during triage, so an unrated report could be anything.
+UNRATED_URGENCY = 0.5
+
+# A step in severity (0.21) outweighs the reporter and the age together (0.16), so they only order the reports of
+# the same severity.
+SEVERITY_WEIGHT = 0.84
+REPORTER_WEIGHT = 0.1
+AGE_WEIGHT = 0.06
+
+# Signal ranges from -10 to 7 on HackerOne. Without a signal, a reputation of REPUTATION_MIDPOINT counts as average.
+SIGNAL_RANGE = (-10.0, 7.0)
+REPUTATION_MIDPOINT = 500.0
+# Reports older than this are all equally urgent as far as their age goes.
+AGE_HORIZON_SECONDS = 30 * 24 * 3600
+
+def severity_rating(report_data):
+    """
+    Returns the severity rating of a report.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope.
+
+    Returns:
+        str: The rating, e.g. "critical", or None when the report is not rated.
+    """
+    if not isinstance(report_data, dict):
+        return None
+    report_data = report_data.get("data", report_data)
+    rating = report_data.get("relationships", {}).get("severity", {}).get("data", {}).get("attributes", {}).get("rating")
+    return rating.lower() if isinstance(rating, str) else None
+
+def reporter_score(report_data):
+    """
+    Returns the track record of the reporter of a report between 0 and 1, 0.5 when it is not known.
+    """
+    reporter = report_data.get("relationships", {}).get("reporter", {}).get("data", {}).get("attributes", {})
+    signal, reputation = reporter.get("signal"), reporter.get("reputation")
+    if isinstance(signal, (int, float)):
+        low, high = SIGNAL_RANGE
+        return min(max((signal - low) / (high - low), 0.0), 1.0)
+    if isinstance(reputation, (int, float)):
+        reputation = max(reputation, 0)
+        return reputation / (reputation + REPUTATION_MIDPOINT)
+    return 0.5
+
+def report_urgency(report_data, now=None):
+    """
+    Returns the urgency of a report.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, with or without the "data" envelope, or None
+            when it has not been retrieved.
+        now (datetime): The current time, for the age of the report.
+
+    Returns:
+        float: The urgency, from 0 for the least urgent reports to 1 for the most urgent ones.
+    """
+    rating = severity_rating(report_data)
+    severity = SEVERITY_URGENCY.get(rating, UNRATED_URGENCY)
+    if not isinstance(report_data, dict):
+        return SEVERITY_WEIGHT * severity + REPORTER_WEIGHT * 0.5
+    report_data = report_data.get("data", report_data)
+    created_at = report_created_at(report_data)
+    age = 0.0
+    if created_at is not None:
+        age_seconds = ((now or datetime.now(timezone.utc)) - created_at).total_seconds()
+        age = min(max(age_seconds / AGE_HORIZON_SECONDS, 0.0), 1.0)
+    return SEVERITY_WEIGHT * severity + REPORTER_WEIGHT * reporter_score(report_data) + AGE_WEIGHT * age
+
+def priority_key(urgency, queued_at):
+    """
+    Returns the priority key of a report; reports with a lower key are triaged first.
+
+    Args:
+        urgency (float): The urgency of the report, as returned by `report_urgency`.
+        queued_at (float): The time the report was queued.
+
+    Returns:
+        float: The priority key.
+    """
+    return queued_at + settings.priority_aging_seconds * (1.0 - urgency)
+
+async def prioritized(items, urgency):
+    """
+    Yields the items of an asynchronous iterator most urgent first, among the items that have arrived.
+
+    The items are read from the iterator as fast as it produces them, so while the consumer is busy the items that
+    arrive in the meantime are reordered by their priority key.
+
+    Args:
+        items (async iterable): The items.
+        urgency (function): Returns the urgency of an item.
+
+    Yields:
+        The items, in the order of their priority key.
+    """
+    heap = []
+    order = itertools.count()
+    arrived = asyncio.Event()
+    finished = False
+
+    async def feed():
+        nonlocal finished
+        try:
+            async for item in items:
+                heapq.heappush(heap, (priority_key(urgency(item), time.monotonic()), next(order), item))
+                arrived.set()
+        finally:
+            finished = True
+            arrived.set()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            while not heap and not finished:
+                arrived.clear()
+                await arrived.wait()
+            if not heap:
+                break
+            yield heapq.heappop(heap)[2]
+        await feeder
+    finally:
+        feeder.cancel()
+
+def observe_time_to_triage(report_data, queued_at):
+    """
+    Records the time a report took from being queued to being triaged, by severity rating.
+
+    Args:
+        report_data (dict): The report as returned by the HackerOne API, or None when it has not been retrieved.
+        queued_at (float): The `time.monotonic()` at which the report was queued.
+    """
+    metrics.observe(f"Time to triage ({severity_rating(report_data) or 'unrated'})", time.monotonic() - queued_at)
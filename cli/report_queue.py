@@ -0,0 +1,297 @@
+"""
+Report queue module
+
+This module contains the durable queue of report IDs between the webhook endpoint and the triage workers of the
+watcher. The queue is a SQLite file in WAL mode that both processes open.
+
+A worker claims a job, which hides it from the other workers for the visibility timeout, and acknowledges it once
+the report has been triaged. A job that is not acknowledged in time, because the worker died, becomes visible again
+and is redelivered. Visible jobs are claimed in the order of their priority key (see priority.py), so an urgent
+report overtakes the backlog for at most PRIORITY_AGING_SECONDS. A worker that fails a report gives the job back with a delay; after REPORT_QUEUE_MAX_ATTEMPTS
+attempts the job is parked as dead so it does not come back forever.
+
+The webhook does not write to SQLite itself: it hands report IDs to a `BatchingEnqueuer`, whose thread writes them
+in batches with one transaction per batch, so a webhook request does not wait for a commit. A batch that cannot be
+written is retried until it is, and the report IDs that are still unwritten when the enqueuer is closed are saved to
+a recovery file, one JSON list of report ID and urgency per line. The next enqueuer with the same recovery file
+writes them first.
+
+Functions:
+- get_report_queue: Returns the report queue of this process.
+- get_enqueuer: Returns the batching enqueuer of this process.
+
+Usage:
+    python report_queue.py    Prints the number of ready, claimed and dead jobs.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from config import load_settings
+from priority import priority_key, report_urgency
+from termcolor import colored
+
+settings = load_settings()
+
+Job = namedtuple("Job", ["job_id", "report_id", "attempts"])
+
+class ReportQueue:
+    """
+    A SQLite queue of report IDs with visibility timeouts.
+    """
+    def __init__(self, path, visibility_timeout, max_attempts):
+        """
+        Initialize the report queue
+
+        path (str): The path to the SQLite file.
+        visibility_timeout (float): The number of seconds a claimed job stays hidden before it is redelivered.
+        max_attempts (int): The number of claims after which a failed job is parked as dead, 0 for no limit.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        # A dead job has no visible_at, so it is never claimed again.
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, report_id TEXT NOT NULL, enqueued_at REAL NOT NULL, visible_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "priority REAL)"
+        )
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if "priority" not in [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]:
+                # The jobs of a queue created before jobs had a priority keep the order they were queued in.
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN priority REAL")
+                self.connection.execute("UPDATE jobs SET priority = enqueued_at")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_visible_at ON jobs (visible_at)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_priority ON jobs (priority, id)")
+
+    def enqueue(self, report_ids, urgencies=None):
+        """
+        Adds report IDs to the queue in a single transaction.
+
+        Args:
+            report_ids (list): The report IDs.
+            urgencies (list): The urgency of every report, as returned by `report_urgency`, None when it is not known.
+        """
+        now = time.time()
+        urgencies = urgencies or [None] * len(report_ids)
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT INTO jobs (report_id, enqueued_at, visible_at, priority) VALUES (?, ?, ?, ?)",
+                [
+                    (str(report_id), now, now, priority_key(report_urgency(None) if urgency is None else urgency, now))
+                    for report_id, urgency in zip(report_ids, urgencies)
+                ]
+            )
+
+    def claim(self, limit=1):
+        """
+        Claims the most urgent visible jobs, hiding them from other workers for the visibility timeout.
+
+        Args:
+            limit (int): The maximum number of jobs to claim.
+
+        Returns:
+            list: A Job for every claimed job, most urgent first.
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            rows = self.connection.execute(
+                "SELECT id, report_id, attempts FROM jobs WHERE visible_at <= ? ORDER BY priority, id LIMIT ?", (now, limit)
+            ).fetchall()
+            self.connection.executemany(
+                "UPDATE jobs SET visible_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + self.visibility_timeout, row[0]) for row in rows]
+            )
+        return [Job(job_id, report_id, attempts + 1) for job_id, report_id, attempts in rows]
+
+    def ack(self, job):
+        """
+        Removes a job that has been processed.
+
+        Args:
+            job (Job): The claimed job.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE id = ?", (job.job_id,))
+
+    def nack(self, job, delay=0):
+        """
+        Gives a claimed job back, or parks it as dead once it has used up its attempts.
+
+        Args:
+            job (Job): The claimed job.
+            delay (float): The number of seconds before the job is visible again.
+        """
+        visible_at = None if self.max_attempts and job.attempts >= self.max_attempts else time.time() + delay
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET visible_at = ? WHERE id = ?", (visible_at, job.job_id))
+
+    def stats(self):
+        """
+        Returns the number of jobs by status.
+
+        Returns:
+            dict: The number of ready, claimed and dead jobs.
+        """
+        now = time.time()
+        with self.lock:
+            ready, claimed, dead = self.connection.execute(
+                "SELECT COALESCE(SUM(visible_at <= ?), 0), COALESCE(SUM(visible_at > ?), 0), COALESCE(SUM(visible_at IS NULL), 0) FROM jobs",
+                (now, now)
+            ).fetchone()
+        return {"ready": ready, "claimed": claimed, "dead": dead}
+
+    def close(self):
+        """
+        Closes the SQLite connection.
+        """
+        self.connection.close()
+
+class BatchingEnqueuer:
+    """
+    Hands report IDs to a thread that adds them to the queue in batches.
+
+    Any object with an `enqueue(report_ids, urgencies)` method can stand in for the queue, e.g. the report_ids.txt writer of the
+    webhook endpoint.
+    """
+    def __init__(self, report_queue, batch_size, flush_seconds, recovery_path=None):
+        """
+        Initialize the enqueuer
+
+        report_queue (ReportQueue): The queue to write to.
+        batch_size (int): The number of report IDs that triggers a write right away.
+        flush_seconds (float): The maximum number of seconds a report ID waits for its batch.
+        recovery_path (str): The file the unwritten report IDs are saved to on close, None to only print them.
+        """
+        self.report_queue = report_queue
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.recovery_path = recovery_path
+        self.pending = self._recover()
+        self.recovering = bool(self.pending)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="report-queue-writer", daemon=True)
+        self.thread.start()
+
+    def _recover(self):
+        """
+        Returns the report IDs and urgencies saved to the recovery file by a previous enqueuer.
+        """
+        if not self.recovery_path or not os.path.exists(self.recovery_path):
+            return []
+        with open(self.recovery_path, encoding='UTF-8') as file:
+            pending = [tuple(json.loads(line)) for line in file if line.strip()]
+        print(colored(f"Writing {len(pending)} report(s) recovered from {self.recovery_path}", 'yellow'))
+        return pending
+
+    def _save_unwritten(self, batch):
+        """
+        Saves the report IDs that could not be written to the recovery file, replacing what it held.
+        """
+        try:
+            if not self.recovery_path:
+                raise OSError("no recovery file")
+            with open(f"{self.recovery_path}.tmp", "w", encoding='UTF-8') as file:
+                file.write("".join(json.dumps([report_id, urgency]) + "\n" for report_id, urgency in batch))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(f"{self.recovery_path}.tmp", self.recovery_path)
+        except OSError as e:
+            print(colored(f"Could not save the unwritten report(s) ({e}), add them again by hand: {' | '.join(report_id for report_id, _ in batch)}", 'light_red'))
+            return
+        print(colored(f"Saved {len(batch)} report(s) that could not be added to the queue to {self.recovery_path}, they are written on the next start", 'light_red'))
+
+    def put(self, report_id, urgency=None):
+        """
+        Queues a report ID without waiting for it to be written.
+
+        Args:
+            report_id (str): The report ID.
+            urgency (float): The urgency of the report, None when it is not known.
+        """
+        with self.condition:
+            self.pending.append((report_id, urgency))
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.pending)
+                self.condition.wait_for(lambda: self.closed or len(self.pending) >= self.batch_size, self.flush_seconds)
+                batch, self.pending = self.pending, []
+                closed = self.closed
+            try:
+                if batch:
+                    self.report_queue.enqueue([report_id for report_id, _ in batch], [urgency for _, urgency in batch])
+            except (sqlite3.Error, OSError) as e:
+                if closed:
+                    print(colored(f"Could not add {len(batch)} report(s) to the queue: {e}", 'light_red'))
+                    # The recovery file holds all of them, including the recovered report IDs not yet written.
+                    self._save_unwritten(batch)
+                    return
+                print(colored(f"Could not add {len(batch)} report(s) to the queue, retrying: {e}", 'light_red'))
+                with self.condition:
+                    self.pending[:0] = batch
+                time.sleep(self.flush_seconds)
+                continue
+            if self.recovering:
+                # The recovered report IDs were at the front of the first batch written.
+                os.remove(self.recovery_path)
+                self.recovering = False
+            if closed:
+                return
+
+    def close(self):
+        """
+        Writes the remaining report IDs and stops the thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+_report_queue = None
+_enqueuer = None
+
+def get_report_queue():
+    """
+    Returns the report queue of this process, opening it when needed.
+
+    Returns:
+        ReportQueue: The report queue.
+    """
+    global _report_queue
+    if _report_queue is None:
+        _report_queue = ReportQueue(settings.report_queue_file_path, settings.report_queue_visibility_timeout, settings.report_queue_max_attempts)
+    return _report_queue
+
+def get_enqueuer():
+    """
+    Returns the batching enqueuer of this process, starting it when needed.
+
+    Returns:
+        BatchingEnqueuer: The enqueuer, which is closed when the process exits.
+    """
+    global _enqueuer
+    if _enqueuer is None:
+        _enqueuer = BatchingEnqueuer(get_report_queue(), settings.report_queue_batch_size, settings.report_queue_flush_seconds,
+                                     f"{settings.report_queue_file_path}.unwritten")
+        atexit.register(_enqueuer.close)
+    return _enqueuer
+
+if __name__ == "__main__":
+    print(get_report_queue().stats())
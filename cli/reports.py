@@ -4,14 +4,26 @@ Reports Module
 
 This module contains functions for retrieving and processing reports from the HackerOne API.
 """
-import requests
-from actions import hai_actions
-from hai import send_to_hai
+import asyncio
+import time
+from contextlib import aclosing
+
+import aiohttp
+import metrics
+from actions import ActionError, check_action_results, hai_actions
+from api import get_json, get_report, iter_report_pages
+from hai import send_batch_to_hai, send_to_hai
 from config import load_settings
+from pipeline import run_pipeline
+from priority import observe_time_to_triage, prioritized, priority_key, report_urgency
+from sync import load_cursor, parse_timestamp, report_created_at, save_cursor
 from termcolor import colored
 
 settings = load_settings()
 
+# The largest page of the reports endpoint, and so the most reports that can be looked up by ID in one request.
+REPORT_LOOKUP_CHUNK_SIZE = 100
+
 async def get_all_reports(
         severity,
         state,
@@ -19,10 +31,18 @@ async def get_all_reports(
         comment_hai_flag,
         custom_field_hai_flag,
         csv_output_flag,
-        verbose):
+        verbose,
+        concurrency=1,
+        hai_options=None,
+        batch_size=1,
+        incremental=False):
     """
     Retrieves all reports from the HackerOne API based on the specified filters.
 
+    In incremental mode only reports created after the newest report of the previous incremental run with the same
+    filters are retrieved, newest first, and paging stops at the first report that run has already seen. The cursor
+    is only moved forward when every report of the run has been processed.
+
     Args:
         severity (str): The severity level of the reports to retrieve.
         state (str): The state of the reports to retrieve.
@@ -31,50 +51,74 @@ async def get_all_reports(
         custom_field_hai_flag (bool): Flag indicating whether to update custom fields on the reports using HAI.
         csv_output_flag (bool): Flag indicating whether to output the reports in CSV format.
         verbose (bool): Flag indicating whether to display verbose output.
+        concurrency (int): The maximum number of reports processed at the same time.
+        hai_options (dict): Keyword arguments passed on to `send_to_hai`.
+        batch_size (int): The number of reports sent to Hai in a single completion request.
+        incremental (bool): Flag indicating whether to only retrieve reports created since the previous incremental run.
     
     Returns:
         None
     """
-    url = "https://api.hackerone.com/v1/reports"
-    pageNum = 1
+    params = {
+        'filter[program][]': [settings.program_handle],
+        'filter[severity][]': [severity],
+        'filter[state][]': [state]
+    }
+    if reference:
+        params['filter[issue_tracker_reference_id__null]'] = [reference]
 
-    while url:
-        params = {
-            'filter[program][]': [settings.program_handle],
-            'filter[severity][]': [severity],
-            'filter[state][]': [state],
-            'page[number]': pageNum
-        }
-        if reference:
-            params['filter[issue_tracker_reference_id__null]'] = [reference]
+    query = dict(params)
+    cursor = newest = None
+    if incremental:
+        cursor = load_cursor(params)
+        if cursor:
+            print(colored(f"Only retrieving reports created after {cursor}", 'cyan'))
+            query['filter[created_at__gt]'] = [cursor]
+        query['sort'] = ['-reports.created_at']
+    failed_before = metrics.get(metrics.REPORTS_FAILED)
 
-        try:
-            r = requests.get(
-                url,
-                auth=(settings.api_name, settings.api_key),
-                params=params,
-                headers=settings.headers,
-                timeout=(5, 10)
-            )
-            r.raise_for_status()
-            response = r.json()
-            print("Results Page: "+ str(pageNum))
-        except requests.exceptions.RequestException as e:
-            print(colored(f"An error occurred: {e}"),'light_red')
-            raise
-        await show_reports(response, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag)
-
-        if "next" in response["links"]:
-            print(response["links"])
-            pageNum += 1
+    try:
+        async with aclosing(iter_report_pages(query)) as pages:
+            async for pageNum, response in pages:
+                reached_cursor = False
+                if incremental:
+                    seen = [report for report in response["data"] if cursor and report_created_at(report) and report_created_at(report) <= parse_timestamp(cursor)]
+                    if seen:
+                        reached_cursor = True
+                        response = {**response, "data": [report for report in response["data"] if report not in seen]}
+                    for report in response["data"]:
+                        if report_created_at(report) and (newest is None or report_created_at(report) > report_created_at(newest)):
+                            newest = report
+
+                print("Results Page: "+ str(pageNum))
+                await show_reports(response, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, concurrency, hai_options, batch_size)
+
+                if reached_cursor:
+                    print(colored("Reached the reports of the previous incremental run", 'cyan'))
+                    break
+                if "next" in response["links"]:
+                    print(response["links"])
+                else:
+                    print(colored("No further pages", 'cyan'))
+    except aiohttp.ClientError as e:
+        print(colored(f"An error occurred: {e}", 'light_red'))
+        raise
+
+    if newest is not None:
+        failed = metrics.get(metrics.REPORTS_FAILED) - failed_before
+        if failed:
+            print(colored(f"{failed} reports failed, the incremental cursor is not moved forward", 'yellow'))
         else:
-            print(colored("No further pages", 'cyan'))
-            url = None
+            save_cursor(params, newest["attributes"]["created_at"])
 
-async def get_reports(report_ids, severity, state, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose):
+async def get_reports(report_ids, severity, state, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, concurrency=1, hai_options=None, batch_size=1):
     """
     Retrieves specific reports from the HackerOne API based on the provided report IDs.
 
+    The reports are retrieved with `iter_reports_by_id`, and every report (or batch of reports) is triaged as soon as
+    it has been retrieved, while the other reports are still being retrieved. The reports that have been retrieved
+    while the workers are busy are triaged most urgent first (see priority.py).
+
     Args:
         report_ids (list): A list of report IDs to retrieve.
         severity (str): The severity level of the reports to retrieve.
@@ -83,44 +127,138 @@ async def get_reports(report_ids, severity, state, comment_hai_flag, custom_fiel
         custom_field_hai_flag (bool): Flag indicating whether to update custom fields on the reports using HAI.
         csv_output_flag (bool): Flag indicating whether to output the reports in CSV format.
         verbose (bool): Flag indicating whether to display verbose output.
+        concurrency (int): The maximum number of reports processed at the same time.
+        hai_options (dict): Keyword arguments passed on to `send_to_hai`.
+        batch_size (int): The number of reports sent to Hai in a single completion request.
 
     Returns:
         None
     """
-    url = "https://api.hackerone.com/v1/reports/"
-    # WIP Multiple report numbers are not saved in reportList
-    reportList = []
-    for report in report_ids:
-        urlreport = url + str(report)
+    async def process_batch(batch):
+        for report, response in batch:
+            if isinstance(response, Exception):
+                print(colored(f"An error occurred: {response}", 'light_red'))
+                raise response
+            show_single_report(response)
+        reports = [report for report, _ in batch]
+        await triage_batch(reports, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options, dict(batch))
+        for _, response in batch:
+            observe_time_to_triage(response, queued_at)
+        print("_____________")
+
+    report_ids = list(report_ids)
+    batch_size = max(1, int(batch_size or 1))
+    counts_before = report_counts()
+    queued_at = time.monotonic()
+    retrieved = iter_reports_by_id(report_ids, {
+        'filter[severity][]': [severity],
+        'filter[state][]': [state]
+    })
+    async with aclosing(retrieved):
+        ordered = prioritized(retrieved, lambda item: report_urgency(item[1]))
+        await run_pipeline(stream_batches(ordered, batch_size), process_batch, concurrency, label="batches" if batch_size > 1 else "reports")
+    print_report_counts(counts_before)
+
+def report_counts():
+    """
+    Returns the number of reports that have been processed and that have failed so far in this run.
+
+    Returns:
+        tuple: The REPORTS_PROCESSED and REPORTS_FAILED counters.
+    """
+    return metrics.get(metrics.REPORTS_PROCESSED), metrics.get(metrics.REPORTS_FAILED)
 
+def print_report_counts(counts_before):
+    """
+    Prints how many reports have been processed and how many have failed since the counts were taken.
+
+    Args:
+        counts_before (tuple): The counts returned by `report_counts` before the reports were processed.
+    """
+    processed, failed = (count - before for count, before in zip(report_counts(), counts_before))
+    print(colored(f"{processed} report{'s' if processed != 1 else ''} {'have' if processed != 1 else 'has'} been successfully processed", 'cyan'))
+    if failed:
+        print(colored(f"{failed} report{'s' if failed != 1 else ''} failed", 'light_red'))
+
+async def iter_reports_by_id(report_ids, params=None):
+    """
+    Yields reports by ID as soon as they have been retrieved.
+
+    The IDs are looked up in chunks of up to REPORT_LOOKUP_CHUNK_SIZE with the `filter[id][]` list filter of the
+    reports endpoint, and all chunks are requested at the same time. Reports that a chunk does not return, for
+    instance because they belong to another program, and the reports of a chunk that fails are retrieved with
+    concurrent GET requests per report instead. A single report is retrieved with a GET request right away.
+
+    Args:
+        report_ids (list): The IDs of the reports.
+        params (dict): The query parameters for the GET requests per report.
+
+    Yields:
+        tuple: The ID of a report and the report, or the exception raised while retrieving it.
+    """
+    report_ids = [str(report) for report in report_ids]
+
+    async def lookup_chunk(chunk):
+        if len(chunk) == 1:
+            return {}, chunk
         try:
-            r = requests.get(
-                urlreport,
-                auth=(settings.api_name, settings.api_key),
-                params={
-                    'filter[severity][]': [severity],
-                    'filter[state][]': [state]
-                },
-                headers=settings.headers,
-                timeout=(5, 10)
-            )
-            r.raise_for_status()
-            response = r.json()
-            show_single_report(response)
-            predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner = await send_to_hai(report, verbose)
-            hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, report, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose)
-            print("_____________")
-        except requests.exceptions.RequestException as e:
-            print(colored(f"An error occurred: {e}"),'light_red')
-            raise
-    if len(report_ids) == 1:
-        print(colored("1 report has been successfully processed", 'cyan'))
-    else:
-        print(colored(f"{len(report_ids)} reports have been successfully processed", 'cyan'))
+            response = await get_json("/reports", {
+                'filter[program][]': [settings.program_handle],
+                'filter[id][]': chunk,
+                'page[size]': len(chunk)
+            })
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(colored(f"Looking up reports {chunk[0]} to {chunk[-1]} failed, retrieving them one by one: {e}", 'yellow'))
+            return {}, chunk
+        returned = {str(report["id"]): report for report in response.get("data", [])}
+        found = {report: returned[report] for report in chunk if report in returned}
+        metrics.incr("Reports retrieved with a list lookup", len(found))
+        return found, [report for report in chunk if report not in returned]
 
-async def show_reports(response, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag):
+    async def fetch_report(report):
+        metrics.incr("Reports retrieved one by one")
+        try:
+            return {report: await get_report(report, params)}, []
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {report: e}, []
+
+    chunks = [report_ids[index:index + REPORT_LOOKUP_CHUNK_SIZE] for index in range(0, len(report_ids), REPORT_LOOKUP_CHUNK_SIZE)]
+    pending = {asyncio.create_task(lookup_chunk(chunk)) for chunk in chunks}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                found, missing = task.result()
+                pending.update(asyncio.create_task(fetch_report(report)) for report in missing)
+                for report, response in found.items():
+                    yield report, response
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def stream_batches(items, batch_size):
     """
-    Iterates through the reports in the API response and processes each report.
+    Groups the items of an asynchronous iterator into batches as they arrive.
+
+    Args:
+        items (async iterable): The items.
+        batch_size (int): The maximum number of items in a batch.
+
+    Yields:
+        list: A batch of items; the last batch may be smaller.
+    """
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def show_reports(response, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, concurrency=1, hai_options=None, batch_size=1):
+    """
+    Iterates through the reports in the API response and processes each report, most urgent first (see priority.py).
 
     Args:
         response (dict): The API response containing the reports.
@@ -128,25 +266,132 @@ async def show_reports(response, verbose, comment_hai_flag, custom_field_hai_fla
         comment_hai_flag (bool): Flag indicating whether to comment on the reports using HAI.
         custom_field_hai_flag (bool): Flag indicating whether to update custom fields on the reports using HAI.
         csv_output_flag (bool): Flag indicating whether to output the reports in CSV format.
+        concurrency (int): The maximum number of reports processed at the same time.
+        hai_options (dict): Keyword arguments passed on to `send_to_hai`.
+        batch_size (int): The number of reports sent to Hai in a single completion request.
 
     Returns:
         None
     """
     print(response)
     report_ids = []
+    reports_by_id = {}
     for report in response["data"]:
         show_single_report(report)
         report_ids.append(report["id"])
+        reports_by_id[report["id"]] = report
     print("All done!")
-    counter = 0
-    for report in report_ids:
-        counter += 1
-        # print(colored(f"{banner}", 'light_magenta'))
-        print(colored(f"Processing report {counter} of {len(report_ids)}", 'cyan'))
-        print(colored(f"Sending report {report} to Hai...", 'cyan'))
-        predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner = await send_to_hai(report, verbose)
-        hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, report, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose)
-    print(colored(f"{len(report_ids)} reports have been successfully processed", 'cyan'))
+    counts_before = report_counts()
+    queued_at = time.monotonic()
+    report_ids.sort(key=lambda report: priority_key(report_urgency(reports_by_id[report]), queued_at))
+
+    async def process_batch(item):
+        counter, batch = item
+        if len(batch) == 1:
+            print(colored(f"Processing report {counter} of {len(report_ids)}", 'cyan'))
+        else:
+            print(colored(f"Processing reports {counter} to {counter + len(batch) - 1} of {len(report_ids)}", 'cyan'))
+        print(colored(f"Sending report{'s' if len(batch) > 1 else ''} {', '.join(batch)} to Hai...", 'cyan'))
+        await triage_batch(batch, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options, reports_by_id)
+        for report in batch:
+            observe_time_to_triage(reports_by_id[report], queued_at)
+
+    batches = make_batches(report_ids, batch_size)
+    counters = [1 + sum(len(batch) for batch in batches[:index]) for index in range(len(batches))]
+    await run_pipeline(zip(counters, batches), process_batch, concurrency, label=batch_label(batches))
+    print_report_counts(counts_before)
+
+async def triage_report(report, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options=None, report_data=None):
+    """
+    Sends a single report to Hai and runs the actions based on the response.
+
+    Args:
+        report (str): The ID of the report.
+        verbose (bool): Flag indicating whether to display verbose output.
+        comment_hai_flag (bool): Flag indicating whether to comment on the report using HAI.
+        custom_field_hai_flag (bool): Flag indicating whether to update custom fields on the report using HAI.
+        csv_output_flag (bool): Flag indicating whether to output the report in CSV format.
+        hai_options (dict): Keyword arguments passed on to `send_to_hai`.
+        report_data (dict): The report as returned by the HackerOne API, if it has been retrieved.
+
+    Returns:
+        tuple: The response from `send_to_hai`.
+
+    Raises:
+        ValueError: If Hai did not return a usable response for the report.
+        ActionError: If one or more actions failed. The other actions of the report have still run.
+    """
+    result = await send_to_hai(report, verbose, report_data=report_data, **(hai_options or {}))
+    if result is None:
+        raise ValueError(f"Hai did not return a usable response for report {report}")
+    predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner = result
+    action_results = await hai_actions(predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner, report, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, report_data=report_data)
+    check_action_results(report, action_results)
+    # A report whose actions failed is counted as failed by the caller, so it is only counted as processed here.
+    metrics.incr(metrics.REPORTS_PROCESSED)
+    return result
+
+async def triage_batch(reports, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options=None, report_data=None):
+    """
+    Sends a batch of reports to Hai in a single completion request and runs the actions for every report.
+
+    A batch of a single report is triaged with `triage_report`. A report that Hai could not evaluate, or whose
+    actions failed, does not stop the actions for the other reports in the batch.
+
+    Args:
+        reports (list): The IDs of the reports.
+        verbose (bool): Flag indicating whether to display verbose output.
+        comment_hai_flag (bool): Flag indicating whether to comment on the reports using HAI.
+        custom_field_hai_flag (bool): Flag indicating whether to update custom fields on the reports using HAI.
+        csv_output_flag (bool): Flag indicating whether to output the reports in CSV format.
+        hai_options (dict): Keyword arguments passed on to `send_to_hai`.
+        report_data (dict): The reports as returned by the HackerOne API keyed by report ID, if they have been retrieved.
+
+    Returns:
+        list: The response from Hai for every report, None for reports that could not be evaluated.
+    """
+    report_data = report_data or {}
+    if len(reports) == 1:
+        return [await triage_report(reports[0], verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options, report_data.get(reports[0]))]
+
+    results = await send_batch_to_hai(reports, verbose, report_data={report: report_data.get(report) for report in reports}, **(hai_options or {}))
+    for report in reports:
+        result = results.get(report)
+        if result is None:
+            print(colored(f"Hai did not return a usable response for report {report}", 'light_red'))
+            metrics.incr(metrics.REPORTS_FAILED)
+            continue
+        print(colored(f"Running actions for report {report}...", 'cyan'))
+        action_results = await hai_actions(*result, report, comment_hai_flag, custom_field_hai_flag, csv_output_flag, verbose, report_data=report_data.get(report))
+        try:
+            check_action_results(report, action_results)
+        except ActionError as e:
+            print(colored(str(e), 'light_red'))
+            metrics.incr(metrics.REPORTS_FAILED)
+        else:
+            metrics.incr(metrics.REPORTS_PROCESSED)
+    return [results.get(report) for report in reports]
+
+def make_batches(report_ids, batch_size):
+    """
+    Splits report IDs into batches.
+
+    Args:
+        report_ids (list): The IDs of the reports.
+        batch_size (int): The maximum number of reports in a batch.
+
+    Returns:
+        list: The batches of report IDs.
+    """
+    batch_size = max(1, int(batch_size or 1))
+    report_ids = list(report_ids)
+    return [report_ids[index:index + batch_size] for index in range(0, len(report_ids), batch_size)]
+
+def batch_label(batches):
+    """
+    Returns what the items of the pipeline are called in its throughput message.
+    """
+    return "batches" if any(len(batch) > 1 for batch in batches) else "reports"
 
 def show_single_report(report):
     """
@@ -0,0 +1,125 @@
+"""
+Routing module
+
+This module contains the routing table of webhook events. The event type of a webhook (the X-H1-Event header)
+decides what the event triggers:
+- full: The report is triaged with all evaluations.
+- partial: Only the listed evaluations are sent to Hai again, e.g. "partial:complexity"; the other evaluations are
+  taken from the previous result of the report. Evaluations are separated by "+".
+- ignore: Nothing, the event cannot change the outcome of the triage.
+
+WEBHOOK_EVENT_ROUTES overrides the routes of DEFAULT_ROUTES as a comma-separated list of event=route pairs, and
+WEBHOOK_DEFAULT_ROUTE is the route of events that are not in the table, or of requests without an event type.
+
+A partial job travels from the webhook to the watcher as its report ID followed by the evaluations, e.g.
+"12345 validity,complexity", in report_ids.txt as well as in the report queue.
+
+Functions:
+- parse_route: Parses a route.
+- load_routes: Returns the routing table.
+- job_line: Returns the job for a report and the evaluations to run.
+- parse_job: Returns the report ID and the evaluations of a job.
+"""
+from collections import namedtuple
+
+from config import load_settings
+
+settings = load_settings()
+
+EVALUATIONS = ("validity", "complexity", "ownership")
+
+FULL = "full"
+PARTIAL = "partial"
+IGNORE = "ignore"
+
+Route = namedtuple("Route", ["action", "evaluations"])
+
+DEFAULT_ROUTES = {
+    "report_created": "full",
+    "report_comment_created": "partial:validity",
+    "report_severity_updated": "partial:validity+complexity",
+    "report_triaged": "ignore",
+    "report_needs_more_info": "ignore",
+    "report_retesting": "ignore",
+    "report_closed_as_resolved": "ignore",
+    "report_closed_as_not_applicable": "ignore",
+    "report_closed_as_informative": "ignore",
+    "report_closed_as_duplicate": "ignore",
+    "report_closed_as_spam": "ignore",
+    "report_bounty_awarded": "ignore",
+    "report_swag_awarded": "ignore",
+    "report_assignee_changed": "ignore",
+    "report_user_assigned": "ignore",
+    "report_group_assigned": "ignore",
+    "report_agreed_on_going_public": "ignore",
+    "report_became_public": "ignore",
+    "report_manually_disclosed": "ignore",
+    "report_pending_disclosure": "ignore",
+    "report_undisclosed": "ignore",
+}
+
+def parse_route(text):
+    """
+    Parses a route.
+
+    Args:
+        text (str): The route, e.g. "full", "ignore" or "partial:validity+complexity".
+
+    Returns:
+        Route: The action and, for a partial route, the evaluations in the order of EVALUATIONS.
+
+    Raises:
+        ValueError: If the route or one of its evaluations is unknown.
+    """
+    action, _, names = text.strip().partition(":")
+    if action in (FULL, IGNORE) and not names:
+        return Route(action, None)
+    if action != PARTIAL or not names:
+        raise ValueError(f"Unknown webhook route {text!r}, expected full, ignore or partial:<evaluations>.")
+    evaluations = {name.strip() for name in names.split("+")}
+    unknown = evaluations - set(EVALUATIONS)
+    if unknown:
+        raise ValueError(f"Unknown evaluation(s) {', '.join(sorted(unknown))} in webhook route {text!r}.")
+    if evaluations == set(EVALUATIONS):
+        return Route(FULL, None)
+    return Route(PARTIAL, tuple(name for name in EVALUATIONS if name in evaluations))
+
+def load_routes():
+    """
+    Returns the routing table.
+
+    Returns:
+        tuple: The routes keyed by event type, and the route of the other events.
+    """
+    routes = dict(DEFAULT_ROUTES)
+    for pair in settings.webhook_event_routes.split(","):
+        if pair.strip():
+            event, _, route = pair.partition("=")
+            routes[event.strip()] = route
+    return {event: parse_route(route) for event, route in routes.items()}, parse_route(settings.webhook_default_route)
+
+def job_line(report_id, evaluations=None):
+    """
+    Returns the job for a report and the evaluations to run.
+
+    Args:
+        report_id (str): The ID of the report.
+        evaluations (tuple): The evaluations to run, None for all of them.
+
+    Returns:
+        str: The job.
+    """
+    return f"{report_id} {','.join(evaluations)}" if evaluations else str(report_id)
+
+def parse_job(line):
+    """
+    Returns the report ID and the evaluations of a job.
+
+    Args:
+        line (str): The job, as returned by `job_line`.
+
+    Returns:
+        tuple: The report ID, and the evaluations to run or None for all of them.
+    """
+    report_id, _, evaluations = line.strip().partition(" ")
+    return report_id, tuple(evaluations.split(",")) if evaluations else None
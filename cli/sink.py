@@ -0,0 +1,305 @@
+"""
+Sink module
+
+This module contains the result sink that writes the result of every report to the output files. The output files are
+opened once per run and rows are buffered; they are written when RESULT_FLUSH_ROWS rows are buffered, when the oldest
+buffered row is RESULT_FLUSH_SECONDS old, and when the sink is closed at the end of the run.
+
+Every format in OUTPUT_FORMATS gets its own file next to CSV_OUTPUT_FILE:
+- csv: The CSV file with the report ID, validity, complexity, product area and squad owner, as before.
+- jsonl: One JSON object per line with all fields, including the certainty scores and the reasoning.
+- columnar: All fields in columns. With pyarrow installed every run writes a Parquet file with one row group per
+  flush. Without it the rows are appended to a single file of chunks: every flush writes a 4-byte big-endian length
+  followed by a zlib-compressed JSON object with one list of values per column, which `read_columnar` reads back.
+
+Functions:
+- get_sink: Returns the result sink of this process, opening it when needed.
+- close_sink: Flushes and closes the result sink.
+- read_columnar: Reads the rows of a chunked columnar file.
+"""
+import asyncio
+import atexit
+import csv
+import json
+import os
+import struct
+import zlib
+from datetime import datetime, timezone
+
+from config import load_settings
+from utils import certainty_value
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+settings = load_settings()
+
+# The fields of a result row, in the order of the columns.
+RESULT_FIELDS = (
+    "report_id", "predicted_validity", "validity_certainty", "validity_reasoning",
+    "predicted_complexity", "complexity_certainty", "complexity_reasoning",
+    "ownership_certainty", "ownership_reasoning", "product_area", "squad_owner", "evaluated_at"
+)
+CERTAINTY_FIELDS = ("validity_certainty", "complexity_certainty", "ownership_certainty")
+
+CSV_HEADER = ["Report ID", "Predicted Validity", "Predicted Difficulty", "Product Area", "Squad Owner"]
+CSV_FIELDS = ("report_id", "predicted_validity", "predicted_complexity", "product_area", "squad_owner")
+
+CHUNK_HEADER = struct.Struct(">I")
+
+def result_row(report_id, predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning, predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning, predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner):
+    """
+    Returns the row for the result of a report.
+
+    Returns:
+        dict: The value of every field in RESULT_FIELDS. The certainty scores are numbers.
+    """
+    values = (str(report_id), predictedValidity, predictedValidityCertaintyScore, predictedValidityReasoning,
+              predictedComplexity, predictedComplexityCertaintyScore, predictedComplexityReasoning,
+              predictedOwnershipCertaintyScore, predictedOwnershipReasoning, productArea, squadOwner,
+              datetime.now(timezone.utc).isoformat())
+    row = dict(zip(RESULT_FIELDS, values))
+    for field in CERTAINTY_FIELDS:
+        row[field] = certainty_value(row[field])
+    return row
+
+class CsvWriter:
+    """
+    Appends rows to the CSV output file.
+    """
+    def __init__(self, path):
+        self.file = open(path, "a+", encoding='UTF-8', newline="")  # pylint: disable=R1732
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(CSV_HEADER)
+
+    def write(self, rows):
+        """
+        Writes rows to the file.
+        """
+        self.writer.writerows([row[field] for field in CSV_FIELDS] for row in rows)
+        self.file.flush()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
+
+class JsonlWriter:
+    """
+    Appends rows to the JSONL output file.
+    """
+    def __init__(self, path):
+        self.file = open(path, "a", encoding='UTF-8')  # pylint: disable=R1732
+
+    def write(self, rows):
+        """
+        Writes rows to the file.
+        """
+        self.file.write("".join(json.dumps(row) + "\n" for row in rows))
+        self.file.flush()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
+
+class ChunkedColumnarWriter:
+    """
+    Appends rows to a file of zlib-compressed column chunks.
+    """
+    def __init__(self, path):
+        self.file = open(path, "ab")  # pylint: disable=R1732
+
+    def write(self, rows):
+        """
+        Writes rows to the file as a single chunk.
+        """
+        columns = {field: [row[field] for row in rows] for field in RESULT_FIELDS}
+        chunk = zlib.compress(json.dumps(columns).encode())
+        self.file.write(CHUNK_HEADER.pack(len(chunk)) + chunk)
+        self.file.flush()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
+
+class ParquetWriter:
+    """
+    Writes rows to a Parquet file, one row group per write.
+    """
+    def __init__(self, path):
+        fields = [pyarrow.field(field, pyarrow.float64() if field in CERTAINTY_FIELDS else pyarrow.string()) for field in RESULT_FIELDS]
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        """
+        Writes rows to the file as a row group.
+        """
+        columns = {field: [row[field] for row in rows] for field in RESULT_FIELDS}
+        self.writer.write_table(pyarrow.table(columns, schema=self.schema))
+
+    def close(self):
+        """
+        Writes the footer and closes the file.
+        """
+        self.writer.close()
+
+def output_paths(formats):
+    """
+    Returns the path of the output file of every format, next to CSV_OUTPUT_FILE.
+
+    Args:
+        formats (list): The output formats.
+
+    Returns:
+        dict: The paths keyed by format.
+    """
+    base = os.path.splitext(settings.csv_output_file_path)[0]
+    paths = {}
+    for output_format in formats:
+        if output_format == "csv":
+            paths[output_format] = settings.csv_output_file_path
+        elif output_format == "jsonl":
+            paths[output_format] = f"{base}.jsonl"
+        elif output_format == "columnar" and pyarrow is not None:
+            paths[output_format] = f"{base}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}.parquet"
+        elif output_format == "columnar":
+            paths[output_format] = f"{base}.columns"
+        else:
+            raise ValueError(f"Unknown output format {output_format!r}, expected csv, jsonl or columnar.")
+    return paths
+
+class ResultSink:
+    """
+    Buffers result rows and writes them to the output file of every format.
+    """
+    def __init__(self, formats, flush_rows, flush_seconds):
+        """
+        Initialize the result sink
+
+        formats (list): The output formats: csv, jsonl and/or columnar.
+        flush_rows (int): The number of buffered rows that triggers a flush.
+        flush_seconds (float): The maximum number of seconds a row stays buffered while an event loop is running.
+        """
+        self.paths = output_paths(formats)
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.on_flushed = []
+        self.writers = None
+        self._timer = None
+        self._timer_loop = None
+
+    def _open(self):
+        writers = []
+        for output_format, path in self.paths.items():
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            if output_format == "csv":
+                writers.append(CsvWriter(path))
+            elif output_format == "jsonl":
+                writers.append(JsonlWriter(path))
+            elif pyarrow is not None:
+                writers.append(ParquetWriter(path))
+            else:
+                writers.append(ChunkedColumnarWriter(path))
+        return writers
+
+    def write(self, row, on_flushed=None):
+        """
+        Buffers a row, flushing the buffer when it is full.
+
+        Args:
+            row (dict): The row, as returned by `result_row`.
+            on_flushed (function): Called without arguments once the row has been written to every output file.
+        """
+        self.buffer.append(row)
+        if on_flushed is not None:
+            self.on_flushed.append(on_flushed)
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+        elif self.flush_seconds and (self._timer is None or self._timer_loop.is_closed()):
+            # Without a running event loop the rows wait for the next full buffer or for the sink to be closed.
+            try:
+                self._timer_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._timer = self._timer_loop.call_later(self.flush_seconds, self.flush)
+
+    def flush(self):
+        """
+        Writes the buffered rows to every output file, then calls the `on_flushed` callbacks of the rows.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.buffer:
+            return
+        if self.writers is None:
+            self.writers = self._open()
+        rows, self.buffer = self.buffer, []
+        callbacks, self.on_flushed = self.on_flushed, []
+        for writer in self.writers:
+            writer.write(rows)
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        """
+        Flushes the buffered rows and closes the output files.
+        """
+        self.flush()
+        for writer in self.writers or []:
+            writer.close()
+        self.writers = None
+
+def read_columnar(path):
+    """
+    Reads the rows of a chunked columnar file.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        list: One dict per row, keyed by field.
+    """
+    rows = []
+    with open(path, "rb") as file:
+        while header := file.read(CHUNK_HEADER.size):
+            columns = json.loads(zlib.decompress(file.read(CHUNK_HEADER.unpack(header)[0])))
+            rows.extend(dict(zip(columns, values)) for values in zip(*columns.values()))
+    return rows
+
+_sink = None
+
+def get_sink():
+    """
+    Returns the result sink of this process, opening it when needed.
+
+    Returns:
+        ResultSink: The result sink.
+    """
+    global _sink
+    if _sink is None:
+        formats = [output_format.strip() for output_format in settings.output_formats.split(",") if output_format.strip()]
+        _sink = ResultSink(formats, settings.result_flush_rows, settings.result_flush_seconds)
+        atexit.register(close_sink)
+    return _sink
+
+def close_sink():
+    """
+    Flushes and closes the result sink.
+    """
+    global _sink
+    if _sink is not None:
+        _sink.close()
+        _sink = None
@@ -0,0 +1,98 @@
+"""
+Sync module
+
+This module keeps the cursors of incremental runs. A cursor is the creation time of the newest report seen by a
+previous run with the same program and filters, so the next run only has to ask the reports API for reports created
+after it and can stop paging as soon as it reaches a report it has already seen.
+
+The creation time is used rather than the time of the last activity, because the comments and custom fields posted by
+this tool are activity as well: a cursor on the last activity would bring every triaged report back in the next run.
+
+Functions:
+- cursor_key: Returns the key of the cursor for a set of report filters.
+- load_cursor: Returns the cursor for a set of report filters.
+- save_cursor: Stores the cursor for a set of report filters.
+- parse_timestamp: Parses a timestamp of the HackerOne API.
+- report_created_at: Returns the creation time of a report.
+"""
+import json
+import os
+from datetime import datetime
+
+from config import load_settings
+
+settings = load_settings()
+
+def cursor_key(params):
+    """
+    Returns the key of the cursor for a set of report filters.
+
+    Args:
+        params (dict): The filters of the reports endpoint, including the program.
+
+    Returns:
+        str: The filters as a canonical JSON string.
+    """
+    return json.dumps({key: value for key, value in params.items() if not key.startswith("page[")}, sort_keys=True, default=str)
+
+def _read_cursors():
+    try:
+        with open(settings.sync_cursor_file_path, encoding='UTF-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def load_cursor(params):
+    """
+    Returns the cursor for a set of report filters.
+
+    Args:
+        params (dict): The filters of the reports endpoint, including the program.
+
+    Returns:
+        str: The creation time of the newest report seen by a previous run, or None for the first run.
+    """
+    return _read_cursors().get(cursor_key(params))
+
+def save_cursor(params, created_at):
+    """
+    Stores the cursor for a set of report filters.
+
+    The file is written to a temporary file first and then renamed, so an interrupted run cannot corrupt it.
+
+    Args:
+        params (dict): The filters of the reports endpoint, including the program.
+        created_at (str): The creation time of the newest report that has been processed.
+    """
+    cursors = _read_cursors()
+    cursors[cursor_key(params)] = created_at
+    path = settings.sync_cursor_file_path
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding='UTF-8') as file:
+        json.dump(cursors, file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def parse_timestamp(value):
+    """
+    Parses a timestamp of the HackerOne API, e.g. "2024-05-01T09:30:00.000Z".
+
+    Args:
+        value (str): The timestamp.
+
+    Returns:
+        datetime: The timestamp, or None when the value is empty.
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+def report_created_at(report):
+    """
+    Returns the creation time of a report.
+
+    Args:
+        report (dict): The report as returned by the HackerOne API.
+
+    Returns:
+        datetime: The creation time, or None when the report has none.
+    """
+    return parse_timestamp(report.get("attributes", {}).get("created_at"))
@@ -0,0 +1,191 @@
+"""
+Tests for the actions module.
+"""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import aiohttp
+from actions import (ActionError, check_action_results, current_custom_field_values,
+                     hai_actions, replay_journal)
+from cache import ResultCache
+from journal import ActionJournal
+from sink import ResultSink
+
+PREDICTIONS = ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale")
+
+@patch('journal.settings.journal_file_path', "")
+@patch('actions.get_cache', return_value=None)
+@patch.multiple('actions.settings', cf_1="11", cf_2="12", cf_3="13", cf_4="14")
+@patch('builtins.print')
+class TestHaiActions(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the hai_actions function.
+    """
+    @patch('actions.update_custom_field_value')
+    @patch('actions.post_private_comment')
+    async def test_actions_run_concurrently(self, mock_post_private_comment, mock_update_custom_field_value, _mock_print, _mock_get_cache):
+        """
+        Test that the comment and every custom field are separate actions that run at the same time.
+        """
+        in_flight = 0
+        peak = 0
+
+        async def action(*_args):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        mock_post_private_comment.side_effect = action
+        mock_update_custom_field_value.side_effect = action
+        results = await hai_actions(*PREDICTIONS, "1", True, True, False, False)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(peak, 5)
+        self.assertTrue(all(result.error is None and result.seconds > 0 for result in results))
+
+    @patch('actions.settings.action_concurrency', 2)
+    @patch('actions.update_custom_field_value')
+    async def test_action_concurrency_is_capped(self, mock_update_custom_field_value, _mock_print, _mock_get_cache):
+        """
+        Test that no more than ACTION_CONCURRENCY actions are in flight at the same time.
+        """
+        in_flight = 0
+        peak = 0
+
+        async def action(*_args):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        mock_update_custom_field_value.side_effect = action
+        await asyncio.gather(*(hai_actions(*PREDICTIONS, str(report), False, True, False, False) for report in range(3)))
+        self.assertEqual(peak, 2)
+
+    @patch('actions.update_custom_field_value')
+    @patch('actions.post_private_comment')
+    async def test_failing_action_does_not_stop_the_others(self, mock_post_private_comment, mock_update_custom_field_value, _mock_print, _mock_get_cache):
+        """
+        Test that a failing action is reported with its error while the other actions still run.
+        """
+        mock_post_private_comment.side_effect = aiohttp.ClientError("rate limited")
+        results = await hai_actions(*PREDICTIONS, "1", True, True, False, False)
+        self.assertEqual(mock_update_custom_field_value.call_count, 4)
+        self.assertEqual([result.name for result in results if result.error is not None], ["Private comment"])
+        with self.assertRaises(ActionError):
+            check_action_results("1", results)
+
+    async def test_no_actions(self, _mock_print, _mock_get_cache):
+        """
+        Test that nothing runs when no action is enabled.
+        """
+        self.assertEqual(await hai_actions(*PREDICTIONS, "1", False, False, False, False), [])
+        check_action_results("1", [])
+
+    @patch('actions.get_sink')
+    async def test_result_output(self, mock_get_sink, _mock_print, _mock_get_cache):
+        """
+        Test that the result output writes a row with all fields to the result sink.
+        """
+        results = await hai_actions(*PREDICTIONS, "1", False, False, True, False)
+        self.assertEqual([result.name for result in results], ["Result output"])
+        row = mock_get_sink.return_value.write.call_args.args[0]
+        self.assertEqual((row["report_id"], row["validity_certainty"], row["ownership_reasoning"]), ("1", 90, "r3"))
+
+def custom_field_value(field_id, value):
+    """
+    Returns a custom field value as included in a report by the HackerOne API.
+    """
+    return {
+        "type": "custom-field-value",
+        "attributes": {"value": value},
+        "relationships": {"custom_field_attribute": {"data": {"id": field_id, "type": "custom-field-attribute"}}}
+    }
+
+@patch('journal.settings.journal_file_path', "")
+@patch.multiple('actions.settings', cf_1="11", cf_2="12", cf_3=None, cf_4="14")
+@patch('builtins.print')
+class TestCustomFieldDiff(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for skipping custom fields that are unchanged or not configured.
+    """
+    @patch('actions.get_cache', return_value=None)
+    @patch('actions.update_custom_field_value')
+    async def test_only_changed_fields_are_written(self, mock_update_custom_field_value, _mock_get_cache, _mock_print):
+        """
+        Test that fields that already hold the predicted value, and fields without an ID, are not written.
+        """
+        report_data = {"data": {"relationships": {"custom_field_values": {"data": [
+            custom_field_value("11", "Valid"), custom_field_value("12", "High")
+        ]}}}}
+        results = await hai_actions(*PREDICTIONS, "1", False, True, False, False, report_data=report_data)
+        self.assertEqual([result.name for result in results], ["Custom field 12", "Custom field 14"])
+        self.assertEqual([c.args[1:3] for c in mock_update_custom_field_value.call_args_list], [("12", "Low"), ("14", "Enterprise Scale")])
+
+    async def test_written_values_are_used_without_report_data(self, _mock_print):
+        """
+        Test that the values written by a previous run are used when the report does not include its custom fields.
+        """
+        cache = ResultCache(":memory:", 0, 0)
+        self.addCleanup(cache.close)
+        cache.put_custom_field_value("1", "11", "Valid")
+        with patch('actions.get_cache', return_value=cache):
+            self.assertEqual(current_custom_field_values("1", {"data": {"relationships": {}}}), {"11": "Valid"})
+            self.assertEqual(current_custom_field_values("1", {"data": {"relationships": {"custom_field_values": {"data": []}}}}), {})
+
+@patch('actions.get_cache', return_value=None)
+@patch.multiple('actions.settings', cf_1="11", cf_2=None, cf_3=None, cf_4=None)
+@patch('builtins.print')
+class TestActionJournal(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for journaling and replaying the actions of a report.
+    """
+    def setUp(self):
+        self.journal = ActionJournal(":memory:", 0)
+        self.addCleanup(self.journal.close)
+        patcher = patch('actions.get_journal', return_value=self.journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('actions.update_custom_field_value')
+    @patch('actions.post_private_comment')
+    async def test_replay_runs_only_unfinished_actions(self, mock_post_private_comment, mock_update_custom_field_value, _mock_print, _mock_get_cache):
+        """
+        Test that a failed action stays in the journal and, once its lease has expired, a replay only runs that
+        action, with the journaled result.
+        """
+        mock_post_private_comment.side_effect = aiohttp.ClientError("rate limited")
+        await hai_actions(*PREDICTIONS, "1", True, True, False, False)
+        self.assertEqual(self.journal.done_actions("1"), {"Custom field 11"})
+
+        mock_post_private_comment.side_effect = None
+        self.assertEqual(await replay_journal(False), 0)
+        with patch('journal.time.time', return_value=time.time() + self.journal.lease + 1):
+            self.assertEqual(await replay_journal(False), 1)
+            mock_update_custom_field_value.assert_awaited_once()
+            self.assertEqual(mock_post_private_comment.call_args.args[:2], ("1", "Valid"))
+            self.assertEqual(self.journal.pending(), [])
+            self.assertEqual(await replay_journal(False), 0)
+
+    async def test_result_output_is_done_once_flushed(self, _mock_print, _mock_get_cache):
+        """
+        Test that a buffered row keeps the entry pending, so a crash before the flush replays the result output.
+        """
+        with tempfile.TemporaryDirectory() as directory, patch('sink.settings.csv_output_file_path', os.path.join(directory, "output.csv")):
+            result_sink = ResultSink(["csv"], 100, 0)
+            with patch('actions.get_sink', return_value=result_sink):
+                await hai_actions(*PREDICTIONS, "1", False, False, True, False)
+                self.assertEqual(self.journal.done_actions("1"), set())
+                self.assertEqual([entry[0] for entry in self.journal.pending()], ["1"])
+                result_sink.close()
+        self.assertEqual(self.journal.done_actions("1"), {"Result output"})
+        self.assertEqual(self.journal.pending(), [])
+
+if __name__ == '__main__':
+    unittest.main()
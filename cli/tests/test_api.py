@@ -0,0 +1,68 @@
+"""
+Tests for the api module.
+"""
+import asyncio
+import unittest
+
+from aioresponses import aioresponses
+
+from api import close_session, encode_params, get_report, iter_report_pages
+
+class TestEncodeParams(unittest.TestCase):
+    """
+    Test case for the encode_params function.
+    """
+    def test_encode_params(self):
+        """
+        Test that list values are repeated and None values are dropped.
+        """
+        params = {
+            'filter[program][]': ['handle'],
+            'filter[severity][]': [None],
+            'filter[state][]': ['new', 'triaged'],
+            'page[number]': 2
+        }
+        self.assertEqual(encode_params(params), [
+            ('filter[program][]', 'handle'),
+            ('filter[state][]', 'new'),
+            ('filter[state][]', 'triaged'),
+            ('page[number]', '2')
+        ])
+
+class TestApi(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the requests made by the api module.
+    """
+    async def asyncTearDown(self):
+        await close_session()
+
+    async def test_get_report(self):
+        """
+        Test that a single report is retrieved.
+        """
+        with aioresponses() as mocked:
+            mocked.get('https://api.hackerone.com/v1/reports/1', payload={"data": {"id": "1"}})
+            response = await get_report('1')
+        self.assertEqual(response, {"data": {"id": "1"}})
+
+    async def test_iter_report_pages_prefetches_next_page(self):
+        """
+        Test that the next page is requested before the current page has been processed.
+        """
+        with aioresponses() as mocked:
+            mocked.get('https://api.hackerone.com/v1/reports?filter%5Bprogram%5D%5B%5D=handle&page%5Bnumber%5D=1',
+                       payload={"data": [{"id": "1"}], "links": {"next": "page2"}})
+            mocked.get('https://api.hackerone.com/v1/reports?filter%5Bprogram%5D%5B%5D=handle&page%5Bnumber%5D=2',
+                       payload={"data": [{"id": "2"}], "links": {}})
+            pages = []
+            async for page_number, response in iter_report_pages({'filter[program][]': ['handle']}):
+                if page_number == 1:
+                    # Give the prefetch task a chance to run while page 1 is being processed.
+                    for _ in range(5):
+                        await asyncio.sleep(0)
+                    self.assertEqual(len(mocked.requests), 2)
+                pages.append(response["data"][0]["id"])
+        self.assertEqual(pages, ["1", "2"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for the cache module.
+"""
+import unittest
+from unittest.mock import patch
+
+from cache import ResultCache, report_version
+
+def make_report(title="XSS", state="new"):
+    """
+    Returns a report with the given title and state.
+    """
+    return {"data": {"attributes": {"title": title, "state": state, "vulnerability_information": "Steps"}, "relationships": {}}}
+
+class TestResultCache(unittest.TestCase):
+    """
+    Test case for the result cache.
+    """
+    result = ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale")
+
+    def test_put_and_get(self):
+        """
+        Test that a stored result is returned as a tuple, and unknown keys return None.
+        """
+        cache = ResultCache(":memory:", 0, 0)
+        cache.put("1:a:b", "1", self.result)
+        self.assertEqual(cache.get("1:a:b"), self.result)
+        self.assertIsNone(cache.get("1:a:c"))
+
+    def test_expired_results_are_not_returned(self):
+        """
+        Test that a result older than the time to live is not returned.
+        """
+        cache = ResultCache(":memory:", 60, 0)
+        with patch('cache.time.time', return_value=1000):
+            cache.put("key", "1", self.result)
+        with patch('cache.time.time', return_value=1059):
+            self.assertEqual(cache.get("key"), self.result)
+        with patch('cache.time.time', return_value=1061):
+            self.assertIsNone(cache.get("key"))
+
+    def test_least_recently_used_results_are_evicted(self):
+        """
+        Test that eviction keeps the most recently used results.
+        """
+        cache = ResultCache(":memory:", 0, 2)
+        for number, now in enumerate([1, 2, 3]):
+            with patch('cache.time.time', return_value=now):
+                cache.put(f"key{number}", str(number), self.result)
+        with patch('cache.time.time', return_value=4):
+            cache.get("key0")
+        cache.evict()
+        self.assertIsNotNone(cache.get("key0"))
+        self.assertIsNone(cache.get("key1"))
+        self.assertIsNotNone(cache.get("key2"))
+
+    def test_latest_result_of_a_report(self):
+        """
+        Test that the latest result of a report with the same prompt fingerprint is returned, whatever its content.
+        """
+        cache = ResultCache(":memory:", 0, 0)
+        with patch('cache.time.time', return_value=1):
+            cache.put("1:old:f", "1", self.result)
+        with patch('cache.time.time', return_value=2):
+            cache.put("1:new:f", "1", ("Invalid",) + self.result[1:])
+            cache.put("1:new:g", "1", self.result)
+        self.assertEqual(cache.get_latest("1", "f")[0], "Invalid")
+        self.assertIsNone(cache.get_latest("1", "h"))
+        self.assertIsNone(cache.get_latest("2", "f"))
+
+    def test_report_version(self):
+        """
+        Test that the version changes with the content of a report but not with its state.
+        """
+        self.assertEqual(report_version(make_report()), report_version(make_report(state="triaged")))
+        self.assertNotEqual(report_version(make_report()), report_version(make_report(title="SQLi")))
+        self.assertIsNone(report_version({"data": {}}))
+        self.assertIsNone(report_version(None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Tests for the dedup module.
+"""
+import unittest
+from unittest.mock import patch
+
+from dedup import RecentKeys
+
+class TestRecentKeys(unittest.TestCase):
+    """
+    Test case for the set of recently seen keys.
+    """
+    def test_repeats_within_window(self):
+        """
+        Test that a key is a repeat within the window and new again after it.
+        """
+        keys = RecentKeys(60, 100)
+        with patch('dedup.time.monotonic', return_value=1000):
+            self.assertTrue(keys.add("1"))
+            self.assertFalse(keys.add("1"))
+            self.assertTrue(keys.add("2"))
+        with patch('dedup.time.monotonic', return_value=1061):
+            self.assertTrue(keys.add("1"))
+        self.assertEqual(list(keys.keys), ["1"])
+
+    def test_contains(self):
+        """
+        Test that a key is contained only within the window, without being added.
+        """
+        keys = RecentKeys(60, 100)
+        with patch('dedup.time.monotonic', return_value=1000):
+            keys.add("1")
+            self.assertIn("1", keys)
+            self.assertNotIn("2", keys)
+        with patch('dedup.time.monotonic', return_value=1061):
+            self.assertNotIn("1", keys)
+        self.assertNotIn("2", keys.keys)
+
+    def test_bounded_size(self):
+        """
+        Test that the oldest keys are forgotten once the set is full.
+        """
+        keys = RecentKeys(60, 2)
+        for key in ("1", "2", "3"):
+            keys.add(key)
+        self.assertEqual(list(keys.keys), ["2", "3"])
+        self.assertTrue(keys.add("1"))
+
+    def test_discard(self):
+        """
+        Test that a discarded key is new again.
+        """
+        keys = RecentKeys(60, 100)
+        keys.add("1")
+        keys.discard("1")
+        keys.discard("2")
+        self.assertTrue(keys.add("1"))
+
+if __name__ == '__main__':
+    unittest.main()
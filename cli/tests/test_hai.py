@@ -2,65 +2,66 @@
 Test module for the hai module.
 """
 import asyncio
+import json
 import unittest
 from unittest.mock import MagicMock, patch
 
 import pytest
+from aioresponses import aioresponses
+from termcolor import colored
 
-from hai import (send_individual_prompt, send_to_hai,
-                     wait_for_hai)
+import poller
+from api import close_session, get_session
+from cache import ResultCache
+from hai import (HAI_COMPLETIONS_URL, ownership_rule_fields, send_batch_to_hai, send_individual_prompt,
+                 send_to_hai, split_batch_response, wait_for_hai)
+from ownership import URL_MENTION_CERTAINTY, OwnershipMatch, OwnershipRule
 
-@patch('hai.aiohttp.ClientSession')
-@patch('hai.wait_for_hai')
-class TestSendIndividualPrompt:
+class TestSendIndividualPrompt(unittest.IsolatedAsyncioTestCase):
     """
     Test case for the send_individual_prompt function.
     """
-    @pytest.mark.asyncio
-    async def test_send_individual_prompt(self, mock_wait_for_hai, mock_session):
+    async def asyncTearDown(self):
+        await close_session()
+
+    async def test_send_individual_prompt(self):
         """
         Test case for the send_individual_prompt function.
         """
-        mock_session.return_value.__aenter__.return_value.post.return_value.json = MagicMock()
-        mock_wait_for_hai.return_value = {'state': 'completed'}
-
         report = '1'
-        prompt = {
-            "data": {
-                "type": "completion-request",
-                "attributes": {
-                    "messages": "prompt",
-                    "report_ids": [report]     
-                }
-            },
-        }
-        response = await send_individual_prompt(prompt, report, verbose=False)
-        assert response['state'] == 'completed'
+        prompt = {"role": "user", "content": "prompt"}
+        with aioresponses() as mocked:
+            mocked.post(HAI_COMPLETIONS_URL, payload={'data': {'id': 'c1', 'attributes': {'state': 'completed', 'response': '{}'}}})
+            response = await send_individual_prompt(prompt, report, verbose=False)
+        self.assertEqual(response['state'], 'completed')
+
     @patch('builtins.print')
-    @patch('hai.aiohttp.ClientSession')
-    @patch('hai.wait_for_hai')
-    @pytest.mark.asyncio
-    async def test_send_individual_prompt_verbose(self, mock_print, mock_wait_for_hai, mock_session):
+    async def test_send_individual_prompt_verbose(self, mock_print):
         """
         Test case for the send_individual_prompt function with verbose mode enabled.
         """
-        mock_session.return_value.__aenter__.return_value.post.return_value.json = MagicMock()
-        mock_wait_for_hai.return_value = {'state': 'completed'}
-
         report = '1'
-        prompt = {
-            "data": {
-                "type": "completion-request",
-                "attributes": {
-                    "messages": "prompt",
-                    "report_ids": [report]     
-                }
-            },
-        }
-        response = await send_individual_prompt(prompt, report, verbose=True)
+        prompt = {"role": "user", "content": "prompt"}
+        with aioresponses() as mocked:
+            mocked.post(HAI_COMPLETIONS_URL, payload={'data': {'id': 'c1', 'attributes': {'state': 'completed', 'response': '{}'}}})
+            response = await send_individual_prompt(prompt, report, verbose=True)
 
-        mock_print.assert_any_call("Request that is sent to Hai")
-        assert response['state'] == 'completed'
+        mock_print.assert_any_call(colored("Request sent to Hai:", 'blue'))
+        self.assertEqual(response['state'], 'completed')
+
+    @patch.object(poller.settings, 'hai_poll_initial_interval', 0.001)
+    async def test_send_individual_prompt_polls_on_shared_session(self):
+        """
+        Test that the completion is polled until it is completed, reusing the shared session.
+        """
+        with aioresponses() as mocked:
+            mocked.post(HAI_COMPLETIONS_URL, payload={'data': {'id': 'c1', 'attributes': {'state': 'created'}}})
+            mocked.get(f"{HAI_COMPLETIONS_URL}/c1", payload={'data': {'id': 'c1', 'attributes': {'state': 'created'}}})
+            mocked.get(f"{HAI_COMPLETIONS_URL}/c1", payload={'data': {'id': 'c1', 'attributes': {'state': 'completed', 'response': '{}'}}})
+            session = get_session()
+            response = await send_individual_prompt({"role": "user", "content": "prompt"}, '1', verbose=False)
+            self.assertIs(get_session(), session)
+        self.assertEqual(response['state'], 'completed')
 
 class TestWaitForHai(unittest.TestCase):
     """
@@ -77,8 +78,7 @@ class TestWaitForHai(unittest.TestCase):
                 }
             }
         }
-        loop = asyncio.get_event_loop()
-        response = loop.run_until_complete(wait_for_hai(response_data, verbose=False))
+        response = asyncio.run(wait_for_hai(response_data, verbose=False))
         self.assertEqual(response['state'], 'completed')
 
     def test_wait_for_hai_verbose(self):
@@ -93,8 +93,7 @@ class TestWaitForHai(unittest.TestCase):
             }
         }
 
-        loop = asyncio.get_event_loop()
-        response = loop.run_until_complete(wait_for_hai(response_data, verbose=True))
+        response = asyncio.run(wait_for_hai(response_data, verbose=True))
         self.assertEqual(response['state'], 'completed')
 
 class TestSendToHai(unittest.TestCase):
@@ -128,3 +127,224 @@ class TestSendToHai(unittest.TestCase):
         report = '1'
         response = await send_to_hai(report, verbose=True)
         assert response['state'] == 'completed'
+
+class TestSendToHaiCombined(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the combined mode of the send_to_hai function.
+    """
+    validity = {"predictedValidity": "Valid", "validityCertaintyScore": 90, "validityReasoning": "r1"}
+    complexity = {"predictedComplexity": "Low", "complexityCertaintyScore": 80, "complexityReasoning": "r2"}
+    ownership = {"productArea": "2FA", "squadOwner": "Enterprise Scale", "ownershipCertaintyScore": 70, "ownershipReasoning": "r3"}
+
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA")))
+    @patch('hai.send_individual_prompt')
+    async def test_combined_sends_a_single_prompt(self, mock_send_individual_prompt):
+        """
+        Test that a complete combined answer is used without sending the separate prompts.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps({**self.validity, **self.complexity, **self.ownership})}
+        result = await send_to_hai('1', False, combined=True)
+        mock_send_individual_prompt.assert_called_once()
+        self.assertEqual(result, ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale"))
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA")))
+    @patch('hai.send_individual_prompt')
+    async def test_combined_falls_back_for_missing_fields(self, mock_send_individual_prompt, _mock_print):
+        """
+        Test that only the prompts whose fields are missing from the combined answer are sent separately.
+        """
+        mock_send_individual_prompt.side_effect = [
+            {'response': json.dumps({**self.validity, **self.complexity})},
+            {'response': json.dumps(self.ownership)}
+        ]
+        result = await send_to_hai('1', False, combined=True)
+        self.assertEqual(mock_send_individual_prompt.call_count, 2)
+        self.assertIn("evaluate the ownership", mock_send_individual_prompt.call_args.args[0]['content'])
+        self.assertEqual(result, ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale"))
+
+class TestSendToHaiCascade(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the cascade mode of the send_to_hai function.
+    """
+    complexity = {"predictedComplexity": "Low", "complexityCertaintyScore": 80, "complexityReasoning": "r2"}
+    ownership = {"productArea": "2FA", "squadOwner": "Enterprise Scale", "ownershipCertaintyScore": 70, "ownershipReasoning": "r3"}
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership')
+    @patch('hai.send_individual_prompt')
+    async def test_confidently_invalid_report_skips_other_prompts(self, mock_send_individual_prompt, mock_load_ownership, _mock_print):
+        """
+        Test that only the validity prompt is sent for a report that is Invalid with a high certainty.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps({"predictedValidity": "Invalid", "validityCertaintyScore": "95%", "validityReasoning": "spam"})}
+        result = await send_to_hai('1', False, cascade=True)
+        mock_send_individual_prompt.assert_called_once()
+        mock_load_ownership.assert_not_called()
+        self.assertEqual(result[:4], ("Invalid", "95%", "spam", "Not evaluated"))
+        self.assertEqual((result[4], result[6], result[8], result[9]), (0, 0, "Not evaluated", "Not evaluated"))
+
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA")))
+    @patch('hai.send_individual_prompt')
+    async def test_uncertain_invalid_report_runs_other_prompts(self, mock_send_individual_prompt):
+        """
+        Test that the other prompts are sent when the report is Invalid with a certainty below the threshold.
+        """
+        mock_send_individual_prompt.side_effect = [
+            {'response': json.dumps({"predictedValidity": "Invalid", "validityCertaintyScore": 60, "validityReasoning": "r1"})},
+            {'response': json.dumps(self.complexity)},
+            {'response': json.dumps(self.ownership)}
+        ]
+        result = await send_to_hai('1', False, cascade=True)
+        self.assertEqual(mock_send_individual_prompt.call_count, 3)
+        self.assertEqual(result, ("Invalid", 60, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale"))
+
+class TestResultCache(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the result cache of the send_to_hai function.
+    """
+    report_data = {"data": {"attributes": {"title": "XSS", "vulnerability_information": "Steps"}}}
+    fields = {
+        "predictedValidity": "Valid", "validityCertaintyScore": 90, "validityReasoning": "r1",
+        "predictedComplexity": "Low", "complexityCertaintyScore": 80, "complexityReasoning": "r2",
+        "productArea": "2FA", "squadOwner": "Enterprise Scale", "ownershipCertaintyScore": 70, "ownershipReasoning": "r3"
+    }
+
+    def setUp(self):
+        cache = ResultCache(":memory:", 0, 0)
+        patcher = patch('hai.get_cache', return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(cache.close)
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA", fingerprint="f")))
+    @patch('hai.send_individual_prompt')
+    async def test_unchanged_report_is_answered_from_the_cache(self, mock_send_individual_prompt, _mock_print):
+        """
+        Test that a second run of an unchanged report does not send anything to Hai, unless it is refreshed.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps(self.fields)}
+        first = await send_to_hai('1', False, combined=True, report_data=self.report_data)
+        second = await send_to_hai('1', False, combined=True, report_data=self.report_data)
+        mock_send_individual_prompt.assert_called_once()
+        self.assertEqual(first, second)
+
+        await send_to_hai('1', False, combined=True, report_data=self.report_data, refresh=True)
+        self.assertEqual(mock_send_individual_prompt.call_count, 2)
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA", fingerprint="f")))
+    @patch('hai.send_individual_prompt')
+    async def test_cached_reports_are_left_out_of_a_batch(self, mock_send_individual_prompt, _mock_print):
+        """
+        Test that only the reports without a cached result are sent in the batch prompt.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps({**self.fields, "reportId": "1"})}
+        await send_to_hai('1', False, combined=True, report_data=self.report_data)
+        other = {"data": {"attributes": {"title": "SQLi"}}}
+        mock_send_individual_prompt.return_value = {'response': json.dumps([{**self.fields, "reportId": "2"}])}
+        results = await send_batch_to_hai(["1", "2"], False, report_data={"1": self.report_data, "2": other})
+        self.assertEqual(mock_send_individual_prompt.call_args.args[1], ["2"])
+        self.assertEqual(set(results), {"1", "2"})
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA", fingerprint="f")))
+    @patch('hai.send_individual_prompt')
+    async def test_partial_evaluation_reuses_the_previous_result(self, mock_send_individual_prompt, _mock_print):
+        """
+        Test that only the requested evaluations are sent to Hai and the others are taken from the previous result.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps(self.fields)}
+        await send_to_hai('1', False, combined=True, report_data=self.report_data)
+        mock_send_individual_prompt.return_value = {'response': json.dumps({
+            "predictedComplexity": "High", "complexityCertaintyScore": 60, "complexityReasoning": "r4"
+        })}
+        result = await send_to_hai('1', False, report_data=self.report_data, evaluations=("complexity",))
+        self.assertEqual(mock_send_individual_prompt.call_count, 2)
+        self.assertEqual(result, ("Valid", 90, "r1", "High", 60, "r4", 70, "r3", "2FA", "Enterprise Scale"))
+
+        await send_to_hai('2', False, report_data=self.report_data, evaluations=("complexity",))
+        self.assertEqual(mock_send_individual_prompt.call_count, 5)
+
+class TestOwnershipRuleFastPath(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for skipping the ownership prompt when an ownership rule matches.
+    """
+    validity = {"predictedValidity": "Valid", "validityCertaintyScore": 90, "validityReasoning": "r1"}
+    complexity = {"predictedComplexity": "Low", "complexityCertaintyScore": 80, "complexityReasoning": "r2"}
+    rule = OwnershipMatch(OwnershipRule("asset", "app.example.com", "Inbox", "Lollipop"), 100)
+
+    @patch('hai.load_ownership')
+    @patch('hai.load_ownership_rules', MagicMock(return_value=MagicMock(match=MagicMock(return_value=rule))))
+    @patch('hai.send_individual_prompt')
+    async def test_ownership_prompt_is_skipped(self, mock_send_individual_prompt, mock_load_ownership):
+        """
+        Test that only the validity and complexity prompts are sent and the ownership fields come from the rule.
+        """
+        mock_send_individual_prompt.side_effect = [{'response': json.dumps(self.validity)}, {'response': json.dumps(self.complexity)}]
+        result = await send_to_hai('1', False, report_data={"data": {}})
+        self.assertEqual(mock_send_individual_prompt.call_count, 2)
+        mock_load_ownership.assert_not_called()
+        self.assertEqual(result[:6], ("Valid", 90, "r1", "Low", 80, "r2"))
+        self.assertEqual((result[6], result[8], result[9]), (100, "Inbox", "Lollipop"))
+
+    def test_mentioned_url_does_not_skip_the_ownership_prompt(self):
+        """
+        Test that a rule that only matches a URL mentioned in the report leaves the ownership to Hai.
+        """
+        mentioned = OwnershipMatch(OwnershipRule("url", "^https://docs", "Docs", "OSHA"), URL_MENTION_CERTAINTY)
+        with patch('hai.load_ownership_rules', MagicMock(return_value=MagicMock(match=MagicMock(return_value=mentioned)))):
+            self.assertEqual(ownership_rule_fields({"data": {}}), {})
+        with patch('hai.load_ownership_rules', MagicMock(return_value=MagicMock(match=MagicMock(return_value=self.rule)))):
+            self.assertEqual(ownership_rule_fields({"data": {}})["ownershipCertaintyScore"], 100)
+
+    @patch('hai.load_ownership_rules', MagicMock(return_value=MagicMock(match=MagicMock(return_value=rule))))
+    @patch('hai.send_individual_prompt')
+    async def test_combined_prompt_leaves_out_ownership(self, mock_send_individual_prompt):
+        """
+        Test that the combined prompt only asks for validity and complexity when a rule matches.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps({**self.validity, **self.complexity})}
+        result = await send_to_hai('1', False, combined=True, report_data={"data": {}})
+        mock_send_individual_prompt.assert_called_once()
+        content = mock_send_individual_prompt.call_args.args[0]['content']
+        self.assertIn("evaluate the validity and the complexity", content)
+        self.assertNotIn("ownership table", content)
+        self.assertEqual(result[8:], ("Inbox", "Lollipop"))
+
+class TestSendBatchToHai(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the send_batch_to_hai function.
+    """
+    fields = {
+        "predictedValidity": "Valid", "validityCertaintyScore": 90, "validityReasoning": "r1",
+        "predictedComplexity": "Low", "complexityCertaintyScore": 80, "complexityReasoning": "r2",
+        "productArea": "2FA", "squadOwner": "Enterprise Scale", "ownershipCertaintyScore": 70, "ownershipReasoning": "r3"
+    }
+
+    def test_split_batch_response(self):
+        """
+        Test that arrays and objects keyed by report ID are both split per report, and incomplete reports are dropped.
+        """
+        as_array = json.dumps([{"reportId": 1, **self.fields}, {"reportId": "2", "predictedValidity": "Valid"}])
+        self.assertEqual(split_batch_response(as_array, ["1", "2", "3"]), {"1": {"reportId": 1, **self.fields}, "2": None, "3": None})
+        as_object = json.dumps({"1": self.fields})
+        self.assertEqual(split_batch_response(as_object, ["1"]), {"1": {**self.fields, "reportId": "1"}})
+
+    @patch('builtins.print')
+    @patch('hai.load_ownership', MagicMock(return_value=MagicMock(prompt_text="Enterprise Scale: 2FA")))
+    @patch('hai.send_to_hai')
+    @patch('hai.send_individual_prompt')
+    async def test_malformed_reports_are_sent_again(self, mock_send_individual_prompt, mock_send_to_hai, _mock_print):
+        """
+        Test that one completion request is sent for the batch and only incomplete reports are sent again.
+        """
+        mock_send_individual_prompt.return_value = {'response': json.dumps([{"reportId": "1", **self.fields}])}
+        mock_send_to_hai.return_value = ("retried",)
+        results = await send_batch_to_hai(["1", "2"], False, combined=True)
+        mock_send_individual_prompt.assert_called_once()
+        self.assertEqual(mock_send_individual_prompt.call_args.args[1], ["1", "2"])
+        mock_send_to_hai.assert_called_once_with("2", False, report_data=None, combined=True)
+        self.assertEqual(results["1"], ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale"))
+        self.assertEqual(results["2"], ("retried",))
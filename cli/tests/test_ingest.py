@@ -0,0 +1,79 @@
+"""
+Tests for the webhook ingestion of the webserver (webserver/ingest.py).
+"""
+import hmac
+import json
+import os
+import sqlite3
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'webserver'))
+from ingest import Ingestor  # pylint: disable=C0413,E0401
+from report_queue import BatchingEnqueuer  # pylint: disable=C0413
+
+SECRET = b"secret"
+
+def signed(payload):
+    """
+    Returns the body of a webhook and its X-H1-Signature header.
+    """
+    body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+    return body, f"sha256={hmac.new(SECRET, body, 'sha256').hexdigest()}"
+
+class FailingQueue:
+    """
+    Stands in for a queue whose first write fails.
+    """
+    def __init__(self):
+        self.report_ids = []
+        self.failures = 1
+        self.written = threading.Event()
+
+    def enqueue(self, report_ids, urgencies=None):  # pylint: disable=W0613
+        """
+        Fails the first write and records the others.
+        """
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.report_ids.extend(report_ids)
+        self.written.set()
+
+@patch('builtins.print')
+class TestIngestor(unittest.TestCase):
+    """
+    Test case for the handling of webhook requests.
+    """
+    def setUp(self):
+        self.queue = FailingQueue()
+        self.writer = BatchingEnqueuer(self.queue, 1, 0.01)
+        self.addCleanup(self.writer.close)
+        self.ingestor = Ingestor(SECRET, self.writer)
+
+    def test_malformed_delivery_does_not_hide_its_redelivery(self, _mock_print):
+        """
+        Test that a delivery rejected for its body is handled again when it is delivered again.
+        """
+        self.queue.failures = 0
+        body, signature = signed("{not json")
+        self.assertEqual(self.ingestor.handle(body, signature, "d1", "report_created")[0], 400)
+        body, signature = signed({"data": {"report": {"id": "1"}}})
+        self.assertEqual(self.ingestor.handle(body, signature, "d1", "report_created"), (202, {"success": True, "queued": True}))
+        self.assertEqual(self.ingestor.handle(body, signature, "d1", "report_created"), (202, {"success": True, "duplicate": True}))
+
+    def test_failed_write_is_retried_without_duplicates(self, _mock_print):
+        """
+        Test that a job whose write failed is written once it succeeds, and its redelivery is not written again.
+        """
+        body, signature = signed({"data": {"report": {"id": "1"}}})
+        self.assertEqual(self.ingestor.handle(body, signature, "d1", "report_created")[1], {"success": True, "queued": True})
+        self.assertTrue(self.queue.written.wait(5))
+        self.assertEqual(self.ingestor.handle(body, signature, "d1", "report_created")[1], {"success": True, "duplicate": True})
+        self.writer.close()
+        self.assertEqual(self.queue.report_ids, ["1"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for the journal module.
+"""
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from journal import ActionJournal
+
+RESULT = ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale")
+FLAGS = {"comment_hai_flag": True, "custom_field_hai_flag": False, "csv_output_flag": True}
+
+class TestActionJournal(unittest.TestCase):
+    """
+    Test case for the action journal.
+    """
+    def setUp(self):
+        self.journal = ActionJournal(":memory:", 0)
+        self.addCleanup(self.journal.close)
+
+    def test_pending_entries(self):
+        """
+        Test that an entry is pending with its result and flags until it is finished.
+        """
+        self.journal.begin("1", RESULT, FLAGS)
+        self.journal.begin("2", RESULT, FLAGS)
+        self.journal.finish("2")
+        self.assertEqual(self.journal.pending(), [("1", RESULT, FLAGS)])
+
+    def test_done_actions(self):
+        """
+        Test that done actions are remembered, and starting the report again forgets them.
+        """
+        self.journal.begin("1", RESULT, FLAGS)
+        self.journal.action_done("1", "Private comment")
+        self.assertEqual(self.journal.done_actions("1"), {"Private comment"})
+        self.journal.begin("1", RESULT, FLAGS)
+        self.assertEqual(self.journal.done_actions("1"), set())
+
+    def test_compact(self):
+        """
+        Test that compaction deletes finished entries with their actions and keeps pending ones.
+        """
+        self.journal.begin("1", RESULT, FLAGS)
+        self.journal.action_done("1", "Private comment")
+        self.journal.finish("1")
+        self.journal.begin("2", RESULT, FLAGS)
+        self.journal.action_done("2", "Private comment")
+        self.journal.compact()
+        self.assertEqual(self.journal.connection.execute("SELECT report_id FROM entries").fetchall(), [("2",)])
+        self.assertEqual(self.journal.done_actions("1"), set())
+        self.assertEqual(self.journal.done_actions("2"), {"Private comment"})
+
+    def test_compact_drops_entries_past_retention(self):
+        """
+        Test that unfinished entries older than the retention are no longer replayed.
+        """
+        self.journal.retention = 60
+        with patch('journal.time.time', return_value=time.time() - 120):
+            self.journal.begin("1", RESULT, FLAGS)
+        self.journal.begin("2", RESULT, FLAGS)
+        self.journal.compact()
+        self.assertEqual([entry[0] for entry in self.journal.pending()], ["2"])
+
+class TestJournalLeases(unittest.TestCase):
+    """
+    Test case for the leases of a journal shared by several processes.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "journal.sqlite3")
+
+    def open_journal(self, owner):
+        """
+        Opens the shared journal as if from another process.
+        """
+        journal = ActionJournal(self.path, 0, 60)
+        journal.owner = owner
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_live_entries_are_not_claimed(self):
+        """
+        Test that an entry is only claimed by another process once its lease has expired, and only by one process.
+        """
+        running, starting, other = self.open_journal("a:1"), self.open_journal("b:2"), self.open_journal("c:3")
+        with patch('journal.time.time', return_value=1000):
+            running.begin("1", RESULT, FLAGS)
+        with patch('journal.time.time', return_value=1050):
+            running.action_done("1", "Private comment")
+        with patch('journal.time.time', return_value=1100):
+            self.assertEqual(starting.claim(), [])
+        with patch('journal.time.time', return_value=1111):
+            self.assertEqual(starting.claim(), [("1", RESULT, FLAGS)])
+            self.assertEqual(other.claim(), [])
+        with patch('journal.time.time', return_value=1150):
+            running.action_done("1", "Result output")
+        with patch('journal.time.time', return_value=1172):
+            self.assertEqual(other.claim(), [("1", RESULT, FLAGS)])
+
+    def test_entries_of_a_dead_process_are_claimed_right_away(self):
+        """
+        Test that the entries of a process on this host that is no longer running are claimed before their lease expires.
+        """
+        crashed = self.open_journal(f"{socket.gethostname()}:999999999")
+        crashed.begin("1", RESULT, FLAGS)
+        self.open_journal(f"{socket.gethostname()}:{os.getpid()}").begin("2", RESULT, FLAGS)
+        self.open_journal("elsewhere:1").begin("3", RESULT, FLAGS)
+        self.assertEqual([entry[0] for entry in self.open_journal("b:2").claim()], ["1"])
+
+    def test_journal_without_leases_is_migrated(self):
+        """
+        Test that the entries of a journal created before leases can be claimed.
+        """
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE entries (report_id TEXT PRIMARY KEY, result TEXT NOT NULL, flags TEXT NOT NULL, status TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        connection.execute("INSERT INTO entries VALUES ('1', '[]', '{}', 'pending', ?)", (time.time(),))
+        connection.commit()
+        connection.close()
+        self.assertEqual(self.open_journal("a:1").claim(), [("1", (), {})])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,7 +17,7 @@ class TestMain(unittest.TestCase):
 
     @patch('main.parse_args', return_value=argparse.Namespace(
         rating=None, state=None, reference=False, report=None,
-        comment_hai=False, custom_field_hai=False, csv_output=False, verbose=False
+        comment_hai=False, custom_field_hai=False, csv_output=False, verbose=False, concurrency=1, combined=False, cascade=False, refresh=False, batch_size=1
     ))
     @patch('sys.stdout', new_callable=io.StringIO)
     def test_main(self, mock_stdout, mock_args):
@@ -36,7 +36,7 @@ class TestMain(unittest.TestCase):
 
     def test_parse_args(self):
         """Test the parse_args function."""
-        sys.argv = ['main.py', '-r', 'none', '-s', 'new', '-i', '--report', '123', '-c', '-f', '-o', '-v']
+        sys.argv = ['main.py', '-r', 'none', '-s', 'new', '-i', '--report', '123', '-c', '-f', '-o', '-v', '-n', '4', '--combined', '--refresh', '-b', '5']
         args = parse_args()
         self.assertEqual(args.rating, 'none')
         self.assertEqual(args.state, 'new')
@@ -46,6 +46,20 @@ class TestMain(unittest.TestCase):
         self.assertEqual(args.custom_field_hai, True)
         self.assertEqual(args.csv_output, True)
         self.assertEqual(args.verbose, True)
+        self.assertEqual(args.concurrency, 4)
+        self.assertEqual(args.combined, True)
+        self.assertEqual(args.cascade, False)
+        self.assertEqual(args.refresh, True)
+        self.assertEqual(args.batch_size, 5)
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    def test_cascade_is_rejected_with_batches(self, _mock_stderr):
+        """Test that --cascade is only accepted when reports are sent to Hai one at a time."""
+        sys.argv = ['main.py', '--report', '123', '--cascade']
+        self.assertEqual(parse_args().cascade, True)
+        sys.argv = ['main.py', '--report', '123', '--cascade', '-b', '5']
+        with self.assertRaises(SystemExit):
+            parse_args()
 
     @patch('sys.exit')
     @patch('argparse.ArgumentParser.print_help')
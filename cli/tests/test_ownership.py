@@ -0,0 +1,185 @@
+"""
+Tests for the ownership module.
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ownership import (URL_MENTION_CERTAINTY, BM25Index, OwnershipRules, OwnershipTable, encode_for_prompt,
+                       load_ownership, load_ownership_rules, parse_ownership, report_search_text)
+
+class TestOwnership(unittest.TestCase):
+    """
+    Test case for the ownership module.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.path = os.path.join(self.directory.name, "ownership.csv")
+        self.write("Product Area,Squad Owner\n2FA,Enterprise Scale\nDark Mode,OSHA\nCustom Fields,Enterprise Scale\n\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content, mtime_ns=None):
+        """
+        Writes the ownership file, optionally with a fixed modification time.
+        """
+        with open(self.path, "w", encoding="UTF-8") as file:
+            file.write(content)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def test_parse_ownership(self):
+        """
+        Test that rows are parsed by column name and empty rows are skipped.
+        """
+        rows = parse_ownership("Product Area,Squad Owner\n\"Bounty, Calculator\",Lollipop\n,\n")
+        self.assertEqual(rows, [{"Product Area": "Bounty, Calculator", "Squad Owner": "Lollipop"}])
+
+    def test_encode_for_prompt(self):
+        """
+        Test that product areas are grouped per squad owner.
+        """
+        rows = parse_ownership("Product Area,Squad Owner\n2FA,Enterprise Scale\nDark Mode,OSHA\nCustom Fields,Enterprise Scale\n")
+        self.assertEqual(encode_for_prompt(rows), "Enterprise Scale: 2FA | Custom Fields\nOSHA: Dark Mode")
+
+    def test_load_ownership_is_cached_until_the_file_changes(self):
+        """
+        Test that the file is only read again when its modification time changes.
+        """
+        self.write("Product Area,Squad Owner\n2FA,Enterprise Scale\n", mtime_ns=1_000_000_000)
+        table = load_ownership(self.path)
+        with patch('ownership.open') as mock_open:
+            self.assertIs(load_ownership(self.path), table)
+            mock_open.assert_not_called()
+
+        self.write("Product Area,Squad Owner\nDark Mode,OSHA\n", mtime_ns=2_000_000_000)
+        reloaded = load_ownership(self.path)
+        self.assertEqual(reloaded.prompt_text, "OSHA: Dark Mode")
+        self.assertNotEqual(reloaded.fingerprint, table.fingerprint)
+
+class TestShortlist(unittest.TestCase):
+    """
+    Test case for the ownership shortlist.
+    """
+    rows = parse_ownership(
+        "Product Area,Squad Owner,Keywords\n"
+        "2FA,Enterprise Scale,totp otp authentication\n"
+        "Dark Mode,OSHA,theme\n"
+        "Bounty Calculator,Lollipop,payout\n"
+        "CVE Directory,Data Platform,\n"
+    )
+
+    def test_bm25_ranks_matching_rows_first(self):
+        """
+        Test that rows matching the search text rank first and rows without a match are left out.
+        """
+        index = BM25Index(["2FA totp", "Dark Mode theme", "Bounty Calculator payout"])
+        self.assertEqual(index.search("Bypass of TOTP on 2FA", 2), [0])
+        self.assertEqual(index.search("nothing matches", 2), [])
+
+    def test_prompt_text_is_shortlisted(self):
+        """
+        Test that only the best matching rows are encoded once the table is larger than the shortlist.
+        """
+        table = OwnershipTable(self.rows, 0, "fingerprint")
+        self.assertEqual(table.prompt_text_for("Payout rounding in bounty calculator", 2), "Lollipop: Bounty Calculator")
+        self.assertIs(table.prompt_text_for("Payout rounding", 0), table.prompt_text)
+        self.assertIs(table.prompt_text_for("unrelated", 2), table.prompt_text)
+
+    def test_report_search_text(self):
+        """
+        Test that the title, weakness and asset of a report are used as search text.
+        """
+        report = {"data": {
+            "attributes": {"title": "OTP bypass"},
+            "relationships": {
+                "weakness": {"data": {"attributes": {"name": "Improper Authentication"}}},
+                "structured_scope": {"data": {"attributes": {"asset_identifier": "auth.example.com"}}}
+            }
+        }}
+        self.assertEqual(report_search_text(report), "OTP bypass Improper Authentication auth.example.com")
+        self.assertEqual(report_search_text(None), "")
+
+def make_report(asset=None, weakness_id=None, text=""):
+    """
+    Returns a report with the given asset, weakness and vulnerability information.
+    """
+    return {"data": {
+        "attributes": {"vulnerability_information": text},
+        "relationships": {
+            "weakness": {"data": {"id": weakness_id}},
+            "structured_scope": {"data": {"attributes": {"asset_identifier": asset}}}
+        }
+    }}
+
+class TestOwnershipRules(unittest.TestCase):
+    """
+    Test case for the ownership rules.
+    """
+    rules = OwnershipRules(parse_ownership(
+        "Type,Pattern,Product Area,Squad Owner\n"
+        "asset,app.example.com,Inbox,Lollipop\n"
+        "asset,*.example.com,Website,OSHA\n"
+        "asset,com.example.*,Mobile,Cortex\n"
+        "asset,com.example.beta*,Mobile Beta,Cortex\n"
+        "url,^https://docs\\.example\\.com/,Docs,OSHA\n"
+        "weakness,57,Flagged Accounts,PXP Squad\n"
+        "weakness,60,Website,OSHA\n"
+    ), 0, "fingerprint")
+
+    def test_most_specific_asset_rule_matches(self):
+        """
+        Test that an exact asset wins over a suffix, and the longest prefix wins over a shorter one.
+        """
+        self.assertEqual(self.rules.match(make_report("App.Example.com")), (self.rules.assets["app.example.com"][0], 100))
+        self.assertEqual(self.rules.match(make_report("www.example.com")).rule.product_area, "Website")
+        self.assertEqual(self.rules.match(make_report("com.example.app")).rule.product_area, "Mobile")
+        self.assertEqual(self.rules.match(make_report("com.example.beta.app")).rule.product_area, "Mobile Beta")
+        self.assertIsNone(self.rules.match(make_report("example.org")))
+
+    def test_url_and_weakness_rules_match(self):
+        """
+        Test that URL rules match URLs in the report with a lower certainty, and weakness rules match the weakness ID.
+        """
+        rule, certainty = self.rules.match(make_report(text="See https://docs.example.com/api for details"))
+        self.assertEqual((rule.rule_type, rule.squad_owner, certainty), ("url", "OSHA", URL_MENTION_CERTAINTY))
+        self.assertEqual(self.rules.match(make_report("https://docs.example.com/")).certainty, 100)
+        self.assertEqual(self.rules.match(make_report(weakness_id="57")), (self.rules.weaknesses["57"][0], 100))
+        self.assertIsNone(self.rules.match(make_report(text="See https://www.example.org/")))
+
+    def test_mentioned_urls_do_not_override_the_asset(self):
+        """
+        Test that a URL mentioned in the report is ignored when the asset or weakness of the report matches a rule.
+        """
+        report = make_report("www.example.com", text="Reproduced with https://docs.example.com/api")
+        self.assertEqual(self.rules.match(report), (self.rules.asset_suffixes.longest_prefix("moc.elpmaxe.www")[0], 100))
+        report = make_report(weakness_id="57", text="Reproduced with https://docs.example.com/api")
+        self.assertEqual(self.rules.match(report).rule.product_area, "Flagged Accounts")
+
+    def test_conflicting_rules_do_not_match(self):
+        """
+        Test that a report is only matched when every matching rule agrees on the owner.
+        """
+        self.assertEqual(self.rules.match(make_report("www.example.com", weakness_id="60")).rule.product_area, "Website")
+        self.assertIsNone(self.rules.match(make_report("www.example.com", weakness_id="57")))
+        self.assertIsNone(self.rules.match(None))
+
+    def test_invalid_rules_are_rejected(self):
+        """
+        Test that rules with an unknown type or an invalid URL pattern raise a ValueError.
+        """
+        with self.assertRaises(ValueError):
+            OwnershipRules(parse_ownership("Type,Pattern,Product Area,Squad Owner\nhost,example.com,Website,OSHA\n"), 0, "fingerprint")
+        with self.assertRaises(ValueError):
+            OwnershipRules(parse_ownership("Type,Pattern,Product Area,Squad Owner\nurl,[,Website,OSHA\n"), 0, "fingerprint")
+
+    def test_load_ownership_rules_without_a_file(self):
+        """
+        Test that there are no rules when the rules file does not exist.
+        """
+        self.assertIsNone(load_ownership_rules(os.path.join(tempfile.gettempdir(), "does-not-exist.csv")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for the pipeline module.
+"""
+import asyncio
+import io
+import unittest
+from unittest.mock import patch
+
+from pipeline import run_pipeline
+
+class TestRunPipeline(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the run_pipeline function.
+    """
+    async def test_results_are_returned_in_item_order(self):
+        """
+        Test that results keep the order of the items even when later items finish first.
+        """
+        async def worker(item):
+            await asyncio.sleep(0.01 * (5 - item))
+            return item * 2
+
+        results = await run_pipeline(range(5), worker, concurrency=5)
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+
+    async def test_concurrency_is_capped(self):
+        """
+        Test that no more than `concurrency` items are in flight at the same time.
+        """
+        in_flight = 0
+        peak = 0
+
+        async def worker(_item):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        await run_pipeline(range(10), worker, concurrency=3)
+        self.assertEqual(peak, 3)
+
+    async def test_items_from_an_async_iterator_start_as_they_arrive(self):
+        """
+        Test that an item from an asynchronous iterator is processed before the iterator has finished.
+        """
+        started = []
+
+        async def source():
+            for item in range(3):
+                yield item
+                await asyncio.sleep(0.01)
+            self.assertEqual(started, [0, 1, 2])
+
+        async def worker(item):
+            started.append(item)
+            return item
+
+        with patch('sys.stdout', new_callable=io.StringIO):
+            results = await run_pipeline(source(), worker, concurrency=2)
+        self.assertEqual(results, [0, 1, 2])
+
+    async def test_failures_are_isolated(self):
+        """
+        Test that a failing item does not stop the other items.
+        """
+        async def worker(item):
+            if item == 1:
+                raise ValueError("boom")
+            return item
+
+        with patch('sys.stdout', new_callable=io.StringIO):
+            results = await run_pipeline([0, 1, 2], worker, concurrency=2)
+        self.assertEqual(results, [0, None, 2])
+
+    async def test_output_is_released_in_item_order(self):
+        """
+        Test that the output of every item is printed as one block in item order.
+        """
+        async def worker(item):
+            print(f"start {item}")
+            await asyncio.sleep(0.01 * (3 - item))
+            print(f"end {item}")
+
+        with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+            await run_pipeline(range(3), worker, concurrency=3)
+        lines = mock_stdout.getvalue().splitlines()
+        self.assertEqual(lines[:6], ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests for the poller module.
+"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from aioresponses import aioresponses
+
+import poller
+from api import close_session
+from poller import HAI_COMPLETIONS_URL, get_poller, wait_for_completion
+
+def completion(completion_id, state):
+    """
+    Returns a completion response in the given state.
+    """
+    return {'data': {'id': completion_id, 'attributes': {'state': state, 'response': completion_id}}}
+
+@patch.object(poller.settings, 'hai_poll_initial_interval', 0.001)
+@patch.object(poller.settings, 'hai_poll_max_interval', 0.01)
+@patch('builtins.print')
+class TestWaitForCompletion(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the wait_for_completion function.
+    """
+    async def asyncTearDown(self):
+        await close_session()
+
+    async def test_completions_are_polled_by_one_task(self, _mock_print):
+        """
+        Test that every outstanding completion is polled by the same task and resolved when it completes.
+        """
+        with aioresponses() as mocked:
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'created'))
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'completed'))
+            mocked.get(f"{HAI_COMPLETIONS_URL}/b", payload=completion('b', 'completed'))
+            waiters = [asyncio.create_task(wait_for_completion(completion_id)) for completion_id in ('a', 'b')]
+            await asyncio.sleep(0)
+            poller_task = get_poller()._task  # pylint: disable=W0212
+            results = await asyncio.gather(*waiters)
+        self.assertEqual([result['response'] for result in results], ['a', 'b'])
+        self.assertIs(get_poller()._task, poller_task)  # pylint: disable=W0212
+
+    @patch.object(poller.settings, 'hai_completion_timeout', 0.02)
+    async def test_completion_is_given_up_after_its_deadline(self, _mock_print):
+        """
+        Test that a completion that never finishes resolves to None once its deadline has passed.
+        """
+        with aioresponses() as mocked:
+            mocked.get(f"{HAI_COMPLETIONS_URL}/slow", payload=completion('slow', 'created'), repeat=True)
+            result = await wait_for_completion('slow')
+        self.assertIsNone(result)
+
+    async def test_failed_completion_resolves_right_away(self, _mock_print):
+        """
+        Test that a completion Hai reports as failed resolves to None without waiting for its deadline.
+        """
+        with aioresponses() as mocked:
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'errored'))
+            result = await asyncio.wait_for(wait_for_completion('a'), 1)
+        self.assertIsNone(result)
+
+    async def test_malformed_response_is_polled_again(self, _mock_print):
+        """
+        Test that a response that is not JSON is retried and does not stop the polling of the other completions.
+        """
+        with aioresponses() as mocked:
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", body="{not json", content_type='application/json')
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'completed'))
+            mocked.get(f"{HAI_COMPLETIONS_URL}/b", payload=completion('b', 'created'))
+            mocked.get(f"{HAI_COMPLETIONS_URL}/b", payload=completion('b', 'completed'))
+            results = await asyncio.wait_for(asyncio.gather(wait_for_completion('a'), wait_for_completion('b')), 1)
+        self.assertEqual([result['response'] for result in results], ['a', 'b'])
+
+    async def test_rate_limited_poll_is_polled_again(self, _mock_print):
+        """
+        Test that a 429 or 5xx poll is retried after its Retry-After, while another 4xx fails the completion.
+        """
+        with aioresponses() as mocked:
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", status=429, payload={'errors': [{'title': 'Too many requests'}]}, headers={'Retry-After': '0.02'})
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", status=503, payload={'errors': []})
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'completed'))
+            mocked.get(f"{HAI_COMPLETIONS_URL}/b", status=404, payload={'errors': [{'title': 'Not found'}]})
+            started = asyncio.get_running_loop().time()
+            results = await asyncio.wait_for(asyncio.gather(wait_for_completion('a'), wait_for_completion('b')), 1)
+        self.assertEqual(results[0]['response'], 'a')
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - started, 0.02)
+        self.assertIsNone(results[1])
+
+    async def test_unexpected_error_fails_only_its_completion(self, _mock_print):
+        """
+        Test that an unexpected error while polling a completion fails that completion and not the others.
+        """
+        original_poll = poller.CompletionPoller._poll  # pylint: disable=W0212
+
+        async def poll(self, pending):
+            if pending.completion_id == 'a':
+                raise KeyError('state')
+            await original_poll(self, pending)
+
+        with aioresponses() as mocked, patch.object(poller.CompletionPoller, '_poll', poll):
+            mocked.get(f"{HAI_COMPLETIONS_URL}/b", payload=completion('b', 'completed'))
+            results = await asyncio.wait_for(asyncio.gather(wait_for_completion('a'), wait_for_completion('b')), 1)
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1]['response'], 'b')
+
+    async def test_poller_is_restarted_when_it_stops(self, _mock_print):
+        """
+        Test that the poller task is restarted when it stops with an error while completions are outstanding.
+        """
+        original_run = poller.CompletionPoller._run  # pylint: disable=W0212
+        runs = []
+
+        async def run(self):
+            runs.append(self)
+            if len(runs) == 1:
+                raise RuntimeError("poller crashed")
+            await original_run(self)
+
+        with aioresponses() as mocked, patch.object(poller.CompletionPoller, '_run', run):
+            mocked.get(f"{HAI_COMPLETIONS_URL}/a", payload=completion('a', 'completed'))
+            result = await asyncio.wait_for(wait_for_completion('a'), 1)
+        self.assertEqual(result['response'], 'a')
+        self.assertEqual(len(runs), 2)
+
+    async def test_poll_interval_backs_off(self, _mock_print):
+        """
+        Test that the interval between two polls grows up to the maximum interval.
+        """
+        pending = poller._PendingCompletion('a', None, 0.0)  # pylint: disable=W0212
+        intervals = []
+        for _ in range(10):
+            pending.reschedule(0.0)
+            intervals.append(pending.interval)
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
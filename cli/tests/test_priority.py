@@ -0,0 +1,77 @@
+"""
+Tests for the priority module.
+"""
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import metrics
+from priority import observe_time_to_triage, prioritized, priority_key, report_urgency, severity_rating
+
+def make_report(rating=None, signal=None, reputation=None, created_at="2026-10-01T00:00:00.000Z"):
+    """
+    Returns a report with the given severity rating, reporter statistics and creation time.
+    """
+    reporter = {key: value for key, value in (("signal", signal), ("reputation", reputation)) if value is not None}
+    relationships = {"reporter": {"data": {"attributes": reporter}}}
+    if rating is not None:
+        relationships["severity"] = {"data": {"attributes": {"rating": rating}}}
+    return {"data": {"id": "1", "attributes": {"created_at": created_at}, "relationships": relationships}}
+
+NOW = datetime(2026, 10, 17, tzinfo=timezone.utc)
+
+class TestPriority(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the priority of reports.
+    """
+    def test_report_urgency(self):
+        """
+        Test that the severity outweighs the reporter, which outweighs the age of a report.
+        """
+        def urgency(**kwargs):
+            return report_urgency(make_report(**kwargs), NOW)
+
+        self.assertEqual(severity_rating(make_report("Critical")), "critical")
+        self.assertGreater(urgency(rating="critical", signal=-10), urgency(rating="high", signal=7))
+        self.assertGreater(urgency(rating="medium", signal=7), urgency(rating="medium", signal=0))
+        self.assertGreater(urgency(rating="low", reputation=5000), urgency(rating="low", reputation=10))
+        self.assertGreater(urgency(rating="low", created_at="2026-08-01T00:00:00.000Z"), urgency(rating="low"))
+        self.assertGreater(urgency(rating="low", signal=7), urgency(rating="none", signal=7))
+        self.assertEqual(urgency(), report_urgency(make_report("medium"), NOW))
+        self.assertEqual(report_urgency(None), report_urgency({"relationships": {}}, NOW))
+
+    @patch('priority.settings.priority_aging_seconds', 600)
+    def test_priority_key_ages(self):
+        """
+        Test that an urgent report only overtakes reports queued less than the aging time before it.
+        """
+        self.assertLess(priority_key(1.0, 1000), priority_key(0.0, 500))
+        self.assertLess(priority_key(0.0, 500), priority_key(1.0, 1101))
+        with patch('priority.settings.priority_aging_seconds', 0):
+            self.assertLess(priority_key(0.0, 500), priority_key(1.0, 501))
+
+    async def test_prioritized(self):
+        """
+        Test that the items that arrived while the consumer was busy are yielded most urgent first.
+        """
+        async def items():
+            for item in ("none", "critical", "low", "high"):
+                yield item
+
+        urgency = {"none": 0.0, "low": 0.25, "high": 0.75, "critical": 1.0}
+        ordered = prioritized(items(), urgency.get)
+        self.assertEqual([item async for item in ordered], ["critical", "high", "low", "none"])
+
+    @patch('priority.time.monotonic', return_value=130)
+    def test_observe_time_to_triage(self, _mock_monotonic):
+        """
+        Test that the time to triage is recorded by severity rating.
+        """
+        metrics.start()
+        observe_time_to_triage(make_report("critical"), 100)
+        observe_time_to_triage(make_report("critical"), 120)
+        observe_time_to_triage(None, 125)
+        self.assertEqual(metrics.timings, {"Time to triage (critical)": (2, 40, 30), "Time to triage (unrated)": (1, 5, 5)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Tests for the report queue module.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from report_queue import BatchingEnqueuer, ReportQueue
+
+class TestReportQueue(unittest.TestCase):
+    """
+    Test case for the report queue.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(self.directory.cleanup)
+        self.queue = ReportQueue(os.path.join(self.directory.name, "queue.sqlite3"), 60, 2)
+        self.addCleanup(self.queue.close)
+
+    def test_claim_and_ack(self):
+        """
+        Test that claimed jobs are hidden from other claims and acknowledged jobs are removed.
+        """
+        self.queue.enqueue(["1", "2", "3"])
+        jobs = self.queue.claim(2)
+        self.assertEqual([job.report_id for job in jobs], ["1", "2"])
+        self.assertEqual([job.report_id for job in self.queue.claim(5)], ["3"])
+        self.assertEqual(self.queue.claim(), [])
+        self.queue.ack(jobs[0])
+        self.assertEqual(self.queue.stats(), {"ready": 0, "claimed": 2, "dead": 0})
+
+    def test_visibility_timeout(self):
+        """
+        Test that a job that is not acknowledged in time is redelivered.
+        """
+        self.queue.enqueue(["1"])
+        self.queue.claim()
+        with patch('report_queue.time.time', return_value=time.time() + 3600):
+            jobs = self.queue.claim()
+        self.assertEqual([(job.report_id, job.attempts) for job in jobs], [("1", 2)])
+
+    def test_nack_parks_job_after_max_attempts(self):
+        """
+        Test that a failed job is retried until it has used up its attempts.
+        """
+        self.queue.enqueue(["1"])
+        self.queue.nack(self.queue.claim()[0])
+        job = self.queue.claim()[0]
+        self.assertEqual(job.attempts, 2)
+        self.queue.nack(job)
+        self.assertEqual(self.queue.claim(), [])
+        self.assertEqual(self.queue.stats(), {"ready": 0, "claimed": 0, "dead": 1})
+
+    @patch('priority.settings.priority_aging_seconds', 900)
+    def test_urgent_jobs_are_claimed_first(self):
+        """
+        Test that more urgent jobs are claimed first, but not before jobs that have waited longer than the aging time.
+        """
+        with patch('report_queue.time.time', return_value=1000):
+            self.queue.enqueue(["old"], [0.0])
+        with patch('report_queue.time.time', return_value=1500):
+            self.queue.enqueue(["low", "unrated", "critical"], [0.1, None, 1.0])
+        with patch('report_queue.time.time', return_value=2000):
+            self.queue.enqueue(["late critical"], [1.0])
+            jobs = self.queue.claim(5)
+        self.assertEqual([job.report_id for job in jobs], ["critical", "old", "unrated", "late critical", "low"])
+
+    def test_batching_enqueuer(self):
+        """
+        Test that the enqueuer writes every report ID, and closing it writes the last batch.
+        """
+        enqueuer = BatchingEnqueuer(self.queue, 2, 60)
+        for report_id in ("1", "2", "3"):
+            enqueuer.put(report_id)
+        enqueuer.put("4", 1.0)
+        enqueuer.close()
+        self.assertEqual([job.report_id for job in self.queue.claim(5)], ["4", "1", "2", "3"])
+
+    @patch('builtins.print')
+    def test_unwritten_report_ids_are_recovered(self, _mock_print):
+        """
+        Test that the report IDs that cannot be written before the enqueuer is closed are written by the next one.
+        """
+        recovery_path = os.path.join(self.directory.name, "queue.sqlite3.unwritten")
+        with patch.object(self.queue, 'enqueue', side_effect=sqlite3.OperationalError("disk I/O error")):
+            enqueuer = BatchingEnqueuer(self.queue, 10, 60, recovery_path)
+            enqueuer.put("1")
+            enqueuer.put("2", 1.0)
+            enqueuer.close()
+        self.assertEqual(self.queue.claim(5), [])
+        self.assertTrue(os.path.exists(recovery_path))
+        enqueuer = BatchingEnqueuer(self.queue, 10, 60, recovery_path)
+        enqueuer.put("3")
+        enqueuer.close()
+        self.assertEqual([job.report_id for job in self.queue.claim(5)], ["2", "1", "3"])
+        self.assertFalse(os.path.exists(recovery_path))
+
+if __name__ == '__main__':
+    unittest.main()
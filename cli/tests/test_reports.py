@@ -2,11 +2,17 @@
 Tests for the reports module.
 """
 import asyncio
+import os
+import tempfile
 import unittest
 from unittest.mock import call, patch
 
-from reports import (get_reports, load_settings, show_reports,
-                         show_single_report)
+import metrics
+
+import aiohttp
+from actions import ActionError, ActionResult
+from reports import (get_all_reports, get_reports, iter_reports_by_id, load_settings, make_batches,
+                         show_reports, show_single_report, triage_batch, triage_report)
 
 class TestLoadApiVariables(unittest.TestCase):
     """
@@ -32,15 +38,14 @@ class TestReports(unittest.TestCase):
     """
     Test case for the reports module.
     """
-    @patch('reports.requests.get')
+    @patch('reports.get_report')
     @patch('reports.send_to_hai')
     @patch('reports.hai_actions')
     def test_get_reports(self, mock_hai_actions, mock_send_to_hai, mock_get):
         """
         Test the get_reports function.
         """
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = {
+        mock_get.return_value = {
             "data": {
                 "id": "1",
                 "attributes": {"title": "Test Report", "state": "new"}
@@ -54,9 +59,135 @@ class TestReports(unittest.TestCase):
         mock_send_to_hai.assert_called_once()
         mock_hai_actions.assert_called_once()
 
-# WIP
-# class TestGetAllReports(unittest.IsolatedAsyncioTestCase):
-#     def test_get_all_reports(self, mock_show_reports):
+class TestIterReportsById(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the iter_reports_by_id function.
+    """
+    async def collect(self, report_ids):
+        """
+        Returns the reports yielded for the given IDs, keyed by ID.
+        """
+        return {report: response async for report, response in iter_reports_by_id(report_ids)}
+
+    @patch('reports.get_report')
+    @patch('reports.get_json')
+    async def test_reports_are_looked_up_with_a_list_filter(self, mock_get_json, mock_get_report):
+        """
+        Test that the IDs are looked up in one request, and only the reports it does not return are retrieved one by one.
+        """
+        mock_get_json.return_value = {"data": [{"id": "2"}, {"id": "1"}]}
+        mock_get_report.return_value = {"data": {"id": "3"}}
+        reports = await self.collect(["1", "2", "3"])
+        self.assertEqual(mock_get_json.call_args.args[1]['filter[id][]'], ["1", "2", "3"])
+        mock_get_report.assert_called_once_with("3", None)
+        self.assertEqual(reports, {"1": {"id": "1"}, "2": {"id": "2"}, "3": {"data": {"id": "3"}}})
+
+    @patch('builtins.print')
+    @patch('reports.get_report')
+    @patch('reports.get_json')
+    async def test_failed_lookups_fall_back_to_single_requests(self, mock_get_json, mock_get_report, _mock_print):
+        """
+        Test that the reports of a failed list lookup are retrieved one by one, and errors are yielded per report.
+        """
+        mock_get_json.side_effect = aiohttp.ClientError("unsupported filter")
+        mock_get_report.side_effect = [{"id": "1"}, aiohttp.ClientError("not found")]
+        reports = await self.collect(["1", "2"])
+        self.assertEqual(mock_get_report.call_count, 2)
+        self.assertEqual(reports["1"], {"id": "1"})
+        self.assertIsInstance(reports["2"], aiohttp.ClientError)
+
+class TestGetAllReports(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the get_all_reports function.
+    """
+    @patch('reports.show_reports')
+    @patch('reports.iter_report_pages')
+    async def test_get_all_reports(self, mock_iter_report_pages, mock_show_reports):
+        """
+        Test that every page is passed to show_reports with the filters applied.
+        """
+        pages = [
+            (1, {"data": [], "links": {"next": "page2"}}),
+            (2, {"data": [], "links": {}})
+        ]
+
+        async def iter_pages(_params):
+            for page in pages:
+                yield page
+
+        mock_iter_report_pages.side_effect = iter_pages
+        await get_all_reports('high', 'new', True, False, False, False, False, 2)
+        params = mock_iter_report_pages.call_args.args[0]
+        self.assertEqual(params['filter[severity][]'], ['high'])
+        self.assertEqual(params['filter[state][]'], ['new'])
+        self.assertEqual(params['filter[issue_tracker_reference_id__null]'], [True])
+        self.assertEqual(mock_show_reports.call_args_list, [
+            call(pages[0][1], False, False, False, False, 2, None, 1),
+            call(pages[1][1], False, False, False, False, 2, None, 1)
+        ])
+
+def make_page(*created_at, has_next=False):
+    """
+    Returns a page of reports with the given creation times.
+    """
+    data = [{"id": str(number), "attributes": {"created_at": value}} for number, value in enumerate(created_at)]
+    return {"data": data, "links": {"next": "next"} if has_next else {}}
+
+class TestIncrementalSync(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the incremental mode of the get_all_reports function.
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(directory.cleanup)
+        patcher = patch('sync.settings.sync_cursor_file_path', os.path.join(directory.name, "cursors.json"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def iter_pages(self, pages):
+        """
+        Returns a replacement for iter_report_pages that yields the given pages and records the filters.
+        """
+        async def iter_report_pages(params):
+            self.params = params
+            for number, page in enumerate(pages, 1):
+                yield number, page
+        return iter_report_pages
+
+    @patch('reports.show_reports')
+    @patch('reports.iter_report_pages')
+    async def test_second_run_only_retrieves_new_reports(self, mock_iter_report_pages, mock_show_reports):
+        """
+        Test that the cursor of the first run filters the second run, which stops at the first report already seen.
+        """
+        mock_iter_report_pages.side_effect = self.iter_pages([make_page("2024-05-02T00:00:00.000Z", "2024-05-01T00:00:00.000Z")])
+        await get_all_reports('high', 'new', False, False, False, False, False, incremental=True)
+        self.assertEqual(self.params['sort'], ['-reports.created_at'])
+        self.assertNotIn('filter[created_at__gt]', self.params)
+
+        mock_iter_report_pages.side_effect = self.iter_pages([
+            make_page("2024-05-03T00:00:00.000Z", "2024-05-02T00:00:00.000Z", has_next=True),
+            make_page("2024-05-01T00:00:00.000Z")
+        ])
+        mock_show_reports.reset_mock()
+        await get_all_reports('high', 'new', False, False, False, False, False, incremental=True)
+        self.assertEqual(self.params['filter[created_at__gt]'], ["2024-05-02T00:00:00.000Z"])
+        mock_show_reports.assert_called_once()
+        self.assertEqual([report["id"] for report in mock_show_reports.call_args.args[0]["data"]], ["0"])
+
+    @patch('builtins.print')
+    @patch('reports.show_reports')
+    @patch('reports.iter_report_pages')
+    async def test_cursor_is_kept_when_reports_fail(self, mock_iter_report_pages, mock_show_reports, _mock_print):
+        """
+        Test that the cursor is not moved forward when a report of the run failed.
+        """
+        mock_iter_report_pages.side_effect = self.iter_pages([make_page("2024-05-02T00:00:00.000Z")])
+        mock_show_reports.side_effect = lambda *args: metrics.incr(metrics.REPORTS_FAILED)
+        await get_all_reports('high', 'new', False, False, False, False, False, incremental=True)
+        mock_show_reports.side_effect = None
+        await get_all_reports('high', 'new', False, False, False, False, False, incremental=True)
+        self.assertNotIn('filter[created_at__gt]', self.params)
 
 class TestShowReports(unittest.IsolatedAsyncioTestCase):
     """
@@ -85,8 +216,72 @@ class TestShowReports(unittest.IsolatedAsyncioTestCase):
         mock_hai_actions.return_value = None
         await show_reports(response, False, False, False, False)
         self.assertEqual(mock_show_single_report.call_count, 2)
-        self.assertEqual(mock_send_to_hai.call_args_list, [call("1", False), call("2", False)])
-        self.assertEqual(mock_hai_actions.call_args_list, [call(None, None, None, None, None, None, None, None, None, None, '1', False, False, False, False), call(None, None, None, None, None, None, None, None, None, None, '2', False, False, False, False)])
+        self.assertEqual(mock_send_to_hai.call_args_list, [
+            call("1", False, report_data=response["data"][0]),
+            call("2", False, report_data=response["data"][1])
+        ])
+        self.assertEqual(mock_hai_actions.call_args_list, [call(None, None, None, None, None, None, None, None, None, None, '1', False, False, False, False, report_data=response["data"][0]), call(None, None, None, None, None, None, None, None, None, None, '2', False, False, False, False, report_data=response["data"][1])])
+
+    @patch('reports.show_single_report')
+    @patch('reports.send_to_hai')
+    @patch('reports.hai_actions')
+    async def test_show_reports_prints_the_real_counts(self, mock_hai_actions, mock_send_to_hai, _mock_show_single_report):
+        """
+        Test that the reports that failed are not counted as successfully processed.
+        """
+        response = {"data": [{"id": "1", "attributes": {}}, {"id": "2", "attributes": {}}]}
+        mock_send_to_hai.side_effect = [(None,) * 10, None]
+        mock_hai_actions.return_value = []
+        metrics.start()
+        with patch('builtins.print') as mock_print:
+            await show_reports(response, False, False, False, False)
+        printed = [str(args[0]) for args, _ in mock_print.call_args_list]
+        self.assertTrue(any("1 report has been successfully processed" in line for line in printed))
+        self.assertTrue(any("1 report failed" in line for line in printed))
+
+class TestTriageBatch(unittest.IsolatedAsyncioTestCase):
+    """
+    Test case for the triage_batch function.
+    """
+    @patch('reports.send_batch_to_hai')
+    @patch('reports.hai_actions')
+    async def test_triage_batch(self, mock_hai_actions, mock_send_batch_to_hai):
+        """
+        Test that the actions run for every report Hai evaluated, and not for the others.
+        """
+        result = ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale")
+        mock_send_batch_to_hai.return_value = {"1": result, "2": None}
+        with patch('builtins.print'):
+            results = await triage_batch(["1", "2"], False, False, True, False, {"combined": True})
+        mock_send_batch_to_hai.assert_called_once_with(["1", "2"], False, report_data={"1": None, "2": None}, combined=True)
+        self.assertEqual(results, [result, None])
+        self.assertEqual(mock_hai_actions.call_args_list, [call(*result, "1", False, True, False, False, report_data=None)])
+
+    @patch('reports.send_to_hai')
+    @patch('reports.send_batch_to_hai')
+    @patch('reports.hai_actions')
+    async def test_failed_actions_are_not_counted_as_processed(self, mock_hai_actions, mock_send_batch_to_hai, mock_send_to_hai):
+        """
+        Test that a report whose actions failed is only counted as failed.
+        """
+        result = ("Valid", 90, "r1", "Low", 80, "r2", 70, "r3", "2FA", "Enterprise Scale")
+        mock_send_batch_to_hai.return_value = {"1": result, "2": result}
+        mock_send_to_hai.return_value = result
+        mock_hai_actions.side_effect = [[ActionResult("Private comment", 0.1, None)], [ActionResult("Private comment", 0.1, OSError("down"))]]
+        metrics.start()
+        with patch('builtins.print'):
+            await triage_batch(["1", "2"], False, True, False, False)
+            mock_hai_actions.side_effect = [[ActionResult("Private comment", 0.1, OSError("down"))]]
+            with self.assertRaises(ActionError):
+                await triage_report("3", False, True, False, False)
+        self.assertEqual((metrics.get(metrics.REPORTS_PROCESSED), metrics.get(metrics.REPORTS_FAILED)), (1, 1))
+
+    def test_make_batches(self):
+        """
+        Test that report IDs are split into batches of at most batch_size reports.
+        """
+        self.assertEqual(make_batches(["1", "2", "3"], 2), [["1", "2"], ["3"]])
+        self.assertEqual(make_batches(["1", "2"], 1), [["1"], ["2"]])
 
 class TestShowSingleReport(unittest.TestCase):
     """
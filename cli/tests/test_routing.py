@@ -0,0 +1,57 @@
+"""
+Tests for the routing module.
+"""
+import unittest
+from unittest.mock import patch
+
+from routing import FULL, IGNORE, PARTIAL, Route, job_line, load_routes, parse_job, parse_route
+
+class TestRouting(unittest.TestCase):
+    """
+    Test case for the routing of webhook events.
+    """
+    def test_parse_route(self):
+        """
+        Test that routes are parsed, partial evaluations are ordered, and unknown routes are rejected.
+        """
+        self.assertEqual(parse_route("full"), Route(FULL, None))
+        self.assertEqual(parse_route(" ignore "), Route(IGNORE, None))
+        self.assertEqual(parse_route("partial:complexity+validity"), Route(PARTIAL, ("validity", "complexity")))
+        self.assertEqual(parse_route("partial:validity+complexity+ownership"), Route(FULL, None))
+        for text in ("skip", "partial", "partial:severity", "full:validity"):
+            with self.assertRaises(ValueError):
+                parse_route(text)
+
+    @patch('routing.settings.webhook_default_route', "ignore")
+    @patch('routing.settings.webhook_event_routes', "report_closed_as_duplicate=full, custom_event=partial:ownership")
+    def test_load_routes(self):
+        """
+        Test that the configured routes override the default routes.
+        """
+        routes, default_route = load_routes()
+        self.assertEqual(routes["report_created"], Route(FULL, None))
+        self.assertEqual(routes["report_closed_as_duplicate"], Route(FULL, None))
+        self.assertEqual(routes["custom_event"], Route(PARTIAL, ("ownership",)))
+        self.assertEqual(default_route, Route(IGNORE, None))
+
+    @patch('routing.settings.webhook_default_route', "full")
+    @patch('routing.settings.webhook_event_routes', "")
+    def test_default_routes_use_hackerone_event_names(self):
+        """
+        Test that a new comment, sent by HackerOne as report_comment_created, only re-evaluates the validity.
+        """
+        routes, _ = load_routes()
+        self.assertEqual(routes["report_comment_created"], Route(PARTIAL, ("validity",)))
+        self.assertNotIn("report_comments_created", routes)
+
+    def test_job_round_trip(self):
+        """
+        Test that a job is parsed back into its report ID and evaluations.
+        """
+        self.assertEqual(job_line("12345"), "12345")
+        self.assertEqual(parse_job("12345\n"), ("12345", None))
+        self.assertEqual(job_line("12345", ("validity", "complexity")), "12345 validity,complexity")
+        self.assertEqual(parse_job("12345 validity,complexity"), ("12345", ("validity", "complexity")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests for the sink module.
+"""
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sink
+from sink import ResultSink, read_columnar, result_row
+
+PREDICTIONS = ("Valid", "90%", "r1", "Low", "80", "r2", 70, "r3", "2FA", "Enterprise Scale")
+
+class TestResultSink(unittest.TestCase):
+    """
+    Test case for the result sink.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(self.directory.cleanup)
+        self.csv_path = os.path.join(self.directory.name, "output.csv")
+        patcher = patch('sink.settings.csv_output_file_path', self.csv_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_result_row_parses_certainties(self):
+        """
+        Test that a row has every field, with the certainty scores as numbers.
+        """
+        row = result_row("1", *PREDICTIONS)
+        self.assertEqual(list(row), list(sink.RESULT_FIELDS))
+        self.assertEqual((row["validity_certainty"], row["complexity_certainty"], row["ownership_certainty"]), (90, 80, 70))
+        self.assertEqual(row["validity_reasoning"], "r1")
+
+    def test_rows_are_buffered_until_flush_rows(self):
+        """
+        Test that nothing is written before the buffer is full, and the CSV keeps its header and columns.
+        """
+        result_sink = ResultSink(["csv"], 2, 0)
+        result_sink.write(result_row("1", *PREDICTIONS))
+        self.assertFalse(os.path.exists(self.csv_path))
+        result_sink.write(result_row("2", *PREDICTIONS))
+        with open(self.csv_path, encoding='UTF-8') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], sink.CSV_HEADER)
+        self.assertEqual(rows[1:], [[report_id, "Valid", "Low", "2FA", "Enterprise Scale"] for report_id in ("1", "2")])
+        result_sink.close()
+
+    def test_close_flushes_every_format(self):
+        """
+        Test that closing the sink writes the buffered rows to the JSONL and columnar files with all fields.
+        """
+        with patch('sink.pyarrow', None):
+            result_sink = ResultSink(["jsonl", "columnar"], 100, 0)
+            for report_id in ("1", "2", "3"):
+                result_sink.write(result_row(report_id, *PREDICTIONS))
+            result_sink.flush()
+            result_sink.write(result_row("4", *PREDICTIONS))
+            result_sink.close()
+
+        with open(result_sink.paths["jsonl"], encoding='UTF-8') as file:
+            jsonl_rows = [json.loads(line) for line in file]
+        columnar_rows = read_columnar(result_sink.paths["columnar"])
+        self.assertEqual([row["report_id"] for row in jsonl_rows], ["1", "2", "3", "4"])
+        self.assertEqual(columnar_rows, jsonl_rows)
+        self.assertEqual(columnar_rows[0]["ownership_reasoning"], "r3")
+
+    def test_flush_after_flush_seconds(self):
+        """
+        Test that a row is written after RESULT_FLUSH_SECONDS while the event loop is running.
+        """
+        result_sink = ResultSink(["jsonl"], 100, 0.01)
+
+        async def write_and_wait():
+            result_sink.write(result_row("1", *PREDICTIONS))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(write_and_wait())
+        self.assertEqual(result_sink.buffer, [])
+        self.assertTrue(os.path.exists(result_sink.paths["jsonl"]))
+        result_sink.close()
+
+    def test_on_flushed_is_called_after_the_write(self):
+        """
+        Test that the callback of a row is only called once the row has been written.
+        """
+        result_sink = ResultSink(["jsonl"], 2, 0)
+        flushed = []
+        result_sink.write(result_row("1", *PREDICTIONS), lambda: flushed.append(os.path.exists(result_sink.paths["jsonl"])))
+        self.assertEqual(flushed, [])
+        result_sink.write(result_row("2", *PREDICTIONS))
+        self.assertEqual(flushed, [True])
+        result_sink.close()
+
+    def test_unknown_format(self):
+        """
+        Test that an unknown output format is rejected.
+        """
+        with self.assertRaises(ValueError):
+            ResultSink(["xml"], 100, 0)
+
+if __name__ == '__main__':
+    unittest.main()
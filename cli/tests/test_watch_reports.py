@@ -0,0 +1,326 @@
+"""
+Tests for the report watcher (watcher/watch_reports.py).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'watcher'))
+from watch_reports import Checkpoint, FileTailer, TriageWorkers  # pylint: disable=C0413,E0401
+
+class TestFileTailer(unittest.TestCase):
+    """
+    Test case for the tailer of report_ids.txt.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "report_ids.txt")
+
+    def append(self, text, path=None):
+        """
+        Appends text to the watched file.
+        """
+        with open(path or self.path, 'a', encoding='UTF-8') as f:
+            f.write(text)
+
+    def test_partial_last_line_is_held_back(self):
+        """
+        Test that a last line without a newline is only returned once it is complete.
+        """
+        self.append("1\n12")
+        tailer = FileTailer(self.path)
+        self.assertEqual(tailer.read_new_lines(), [("1", 2)])
+        self.append("3")
+        self.assertEqual(tailer.read_new_lines(), [])
+        self.append("\n\n4\n")
+        self.assertEqual(tailer.read_new_lines(), [("123", 6), ("4", 9)])
+
+    def test_resumes_from_offset(self):
+        """
+        Test that a tailer started from a saved offset only returns the lines after it.
+        """
+        self.append("1\n2\n")
+        inode = os.stat(self.path).st_ino
+        self.append("3\n")
+        tailer = FileTailer(self.path, 4, inode)
+        self.assertEqual(tailer.read_new_lines(), [("3", 6)])
+        self.assertEqual(tailer.generation, 0)
+
+    def test_truncation_restarts_from_the_start(self):
+        """
+        Test that a file truncated below the offset is read again from the start in a new generation.
+        """
+        self.append("1\n2\n")
+        tailer = FileTailer(self.path)
+        tailer.read_new_lines()
+        with open(self.path, 'w', encoding='UTF-8') as f:
+            f.write("3\n")
+        self.assertEqual(tailer.read_new_lines(), [("3", 2)])
+        self.assertEqual(tailer.generation, 1)
+
+    def test_rotation_restarts_from_the_start(self):
+        """
+        Test that a file replaced by another file is read from the start in a new generation.
+        """
+        self.append("1\n2\n")
+        tailer = FileTailer(self.path)
+        tailer.read_new_lines()
+        rotated = os.path.join(self.directory.name, "new.txt")
+        self.append("3\n4\n5\n", rotated)
+        os.replace(rotated, self.path)
+        self.assertEqual(tailer.read_new_lines(), [("3", 2), ("4", 4), ("5", 6)])
+        self.assertEqual(tailer.generation, 1)
+        self.assertEqual(tailer.inode, os.stat(self.path).st_ino)
+
+class TestCheckpoint(unittest.TestCase):
+    """
+    Test case for the watcher checkpoint.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "checkpoint.json")
+
+    def test_offset_only_advances_over_a_contiguous_prefix(self):
+        """
+        Test that a report finishing before an earlier one does not move the offset past the earlier one.
+        """
+        checkpoint = Checkpoint(self.path, 100, 3600)
+        for end_offset in (2, 4, 6):
+            checkpoint.track(0, 1, end_offset)
+        checkpoint.mark_done(0, 4)
+        checkpoint.mark_done(0, 6)
+        self.assertIsNone(checkpoint.offset)
+        checkpoint.mark_done(0, 2)
+        self.assertEqual(checkpoint.offset, 6)
+
+    def test_saved_in_batches_and_reloaded(self):
+        """
+        Test that the offset is written after every `every` reports, atomically, and reloaded by a new checkpoint.
+        """
+        checkpoint = Checkpoint(self.path, 2, 3600)
+        for end_offset in (2, 4, 6):
+            checkpoint.track(0, 7, end_offset)
+        checkpoint.mark_done(0, 2)
+        self.assertFalse(os.path.exists(self.path))
+        checkpoint.mark_done(0, 4)
+        self.assertEqual(Checkpoint(self.path, 2, 3600).load(), (4, 7, []))
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+        checkpoint.mark_done(0, 6)
+        self.assertEqual(Checkpoint(self.path, 2, 3600).offset, 4)
+        checkpoint.save()
+        restarted = Checkpoint(self.path, 2, 3600)
+        self.assertEqual((restarted.offset, restarted.inode), (6, 7))
+
+    def test_saved_after_seconds(self):
+        """
+        Test that the offset is written once WATCHER_CHECKPOINT_SECONDS have passed, even before `every` reports.
+        """
+        with patch('watch_reports.time.monotonic', return_value=1000):
+            checkpoint = Checkpoint(self.path, 100, 5)
+        checkpoint.track(0, 7, 2)
+        with patch('watch_reports.time.monotonic', return_value=1006):
+            checkpoint.mark_done(0, 2)
+        self.assertEqual(Checkpoint(self.path, 100, 5).offset, 2)
+
+    def test_saved_when_idle(self):
+        """
+        Test that save_if_due writes triaged reports once WATCHER_CHECKPOINT_SECONDS have passed, without another report.
+        """
+        with patch('watch_reports.time.monotonic', return_value=1000):
+            checkpoint = Checkpoint(self.path, 100, 5)
+            checkpoint.track(0, 7, 2)
+            checkpoint.mark_done(0, 2)
+            checkpoint.save_if_due()
+        self.assertFalse(os.path.exists(self.path))
+        with patch('watch_reports.time.monotonic', return_value=1006):
+            checkpoint.save_if_due()
+        self.assertEqual(Checkpoint(self.path, 100, 5).offset, 2)
+
+    def test_failed_reports_are_kept_for_a_retry(self):
+        """
+        Test that a failed report advances the offset only together with its place on the saved retry list.
+        """
+        checkpoint = Checkpoint(self.path, 1, 3600)
+        checkpoint.track(0, 7, 2)
+        checkpoint.track(0, 7, 4)
+        checkpoint.settle(0, 2, "1", RuntimeError("Hai did not respond"))
+        checkpoint.settle(0, 4, "2", None)
+        restarted = Checkpoint(self.path, 1, 3600)
+        self.assertEqual((restarted.offset, restarted.failed), (4, ["1"]))
+        restarted.retried("1", RuntimeError("Hai did not respond"))
+        self.assertEqual(Checkpoint(self.path, 1, 3600).failed, ["1"])
+        restarted.retried("1", None)
+        self.assertEqual(Checkpoint(self.path, 1, 3600).failed, [])
+
+def rated_report(rating):
+    """
+    Returns a report with the given severity rating.
+    """
+    return {"data": {"attributes": {}, "relationships": {"severity": {"data": {"attributes": {"rating": rating}}}}}}
+
+class TestTriageWorkers(unittest.TestCase):
+    """
+    Test case for the triage workers of the watcher.
+    """
+    ratings = {"1": "none", "2": "low", "3": "critical", "4": "high"}
+
+    def setUp(self):
+        self.triaged = []
+        self.workers = None
+        self.most_waiting = 0
+        self.retrieving = 0
+        self.most_retrieving = 0
+        self.close_session = AsyncMock()
+        self.close_sink = MagicMock()
+        for target, value in (
+            ('watch_reports.replay_journal', AsyncMock()),
+            ('watch_reports.retrieve_report', self.retrieve_report),
+            ('watch_reports.run_python_tool', self.run_python_tool),
+            ('watch_reports.close_session', self.close_session),
+            ('watch_reports.close_sink', self.close_sink),
+            ('watch_reports.metrics.print_summary', MagicMock()),
+            ('builtins.print', MagicMock())
+        ):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def retrieve_report(self, job):
+        """
+        Stands in for the retrieval of a report, counting the retrievals in flight.
+        """
+        self.retrieving += 1
+        self.most_retrieving = max(self.most_retrieving, self.retrieving)
+        await asyncio.sleep(0.01)
+        self.retrieving -= 1
+        if job.startswith("broken"):
+            raise KeyError("data")
+        return rated_report(self.ratings.get(job, "none"))
+
+    async def run_python_tool(self, job, report_data):
+        """
+        Stands in for the triage of a report; report 5 fails.
+        """
+        self.most_waiting = max(self.most_waiting, self.workers.queue.qsize())
+        await asyncio.sleep(0.2 if not self.triaged else 0)
+        self.triaged.append(job)
+        if job == "5":
+            raise RuntimeError("Hai did not respond")
+
+    def run_jobs(self, workers, jobs, settle=None):
+        """
+        Queues jobs from this thread and returns the error of every job once they have all been triaged.
+        """
+        self.workers = workers
+        errors = {}
+        finished = threading.Event()
+
+        def on_done(job, error):
+            if settle is not None:
+                settle(job, error)
+            errors[job] = error
+            if len(errors) == len(jobs):
+                finished.set()
+
+        for job in jobs:
+            workers.enqueue(job, lambda error, job=job: on_done(job, error))
+        self.assertTrue(finished.wait(5))
+        return errors
+
+    def test_reports_are_triaged_and_reported_back(self):
+        """
+        Test that queued reports are triaged on the loop thread, most urgent first once a backlog has formed, and that
+        every callback gets the error of its report.
+        """
+        workers = TriageWorkers(1)
+        workers.start()
+        try:
+            errors = self.run_jobs(workers, ["1", "2", "3", "4", "5"])
+        finally:
+            workers.stop()
+        self.assertEqual(self.triaged[0], "1")
+        self.assertEqual(self.triaged[1:3], ["3", "4"])
+        self.assertEqual({job for job, error in errors.items() if error is None}, {"1", "2", "3", "4"})
+        self.assertIsInstance(errors["5"], RuntimeError)
+        self.assertLessEqual(self.most_retrieving, 1)
+        self.assertFalse(workers.loop.is_running())
+        self.close_sink.assert_called_once()
+        self.close_session.assert_awaited_once()
+
+    def test_failed_report_is_kept_for_a_retry(self):
+        """
+        Test that a report that fails in the workers ends up on the retry list of the checkpoint.
+        """
+        end_offsets = {"5": 2, "1": 4}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.json")
+            checkpoint = Checkpoint(path, 1, 3600)
+            for end_offset in end_offsets.values():
+                checkpoint.track(0, 7, end_offset)
+            workers = TriageWorkers(2)
+            workers.start()
+            try:
+                self.run_jobs(workers, ["5", "1"], lambda job, error: checkpoint.settle(0, end_offsets[job], job, error))
+            finally:
+                workers.stop()
+            restarted = Checkpoint(path, 1, 3600)
+        self.assertEqual((restarted.offset, restarted.failed), (4, ["5"]))
+
+    def test_failed_retrieval_advances_the_checkpoint(self):
+        """
+        Test that a report whose retrieval raises lets the checkpoint move past it and ends up on the retry list.
+        """
+        end_offsets = {"broken": 2, "1": 4}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.json")
+            checkpoint = Checkpoint(path, 1, 3600)
+            for end_offset in end_offsets.values():
+                checkpoint.track(0, 7, end_offset)
+            workers = TriageWorkers(1)
+            workers.start()
+            try:
+                self.run_jobs(workers, ["broken", "1"], lambda job, error: checkpoint.settle(0, end_offsets[job], job, error))
+            finally:
+                workers.stop()
+            restarted = Checkpoint(path, 1, 3600)
+        self.assertEqual((restarted.offset, restarted.failed), (4, ["broken"]))
+
+    @patch('watch_reports.PREFETCH_PER_WORKER', 1)
+    def test_retrieval_errors_are_reported_back(self):
+        """
+        Test that a report whose retrieval raises is reported back as failed, and frees its retriever and prefetch slot.
+        """
+        workers = TriageWorkers(1)
+        workers.start()
+        try:
+            errors = self.run_jobs(workers, ["broken 1", "broken 2", "1", "2"])
+        finally:
+            workers.stop()
+        self.assertIsInstance(errors["broken 1"], KeyError)
+        self.assertIsInstance(errors["broken 2"], KeyError)
+        self.assertEqual(sorted(self.triaged), ["1", "2"])
+
+    @patch('watch_reports.PREFETCH_PER_WORKER', 2)
+    def test_retrievals_are_bounded_by_the_concurrency(self):
+        """
+        Test that no more reports are retrieved at the same time than there are workers, and that no more than
+        PREFETCH_PER_WORKER retrieved reports per worker wait for a worker.
+        """
+        workers = TriageWorkers(2)
+        workers.start()
+        try:
+            self.run_jobs(workers, [str(number) for number in range(10, 30)])
+        finally:
+            workers.stop()
+        self.assertEqual(self.most_retrieving, 2)
+        self.assertLessEqual(self.most_waiting, 4)
+        self.assertEqual(len(self.triaged), 20)
+
+if __name__ == '__main__':
+    unittest.main()
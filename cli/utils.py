@@ -63,3 +63,18 @@ def parse_json_with_control_chars(json_string):
         print(colored(f"Invalid JSON: {e}"), 'light_red')
         data = None
     return data
+
+def certainty_value(score):
+    """
+    Converts a certainty score returned by Hai, e.g. 95, "95" or "95%", into a number.
+
+    Args:
+        score: The certainty score.
+
+    Returns:
+        float: The certainty score, or 0 when it is not a number.
+    """
+    try:
+        return float(str(score).strip().rstrip("%"))
+    except ValueError:
+        return 0.0
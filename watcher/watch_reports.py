@@ -1,108 +1,447 @@
 # pylint: disable=C0413,E0401
 """
 File to watch the report_ids.txt file for changes and process new lines
+
+The offset up to which every report has been triaged is kept in a checkpoint file, so a restarted watcher resumes
+where it stopped: reports that arrived while it was down are triaged, and reports already triaged are not.
+
+With REPORT_SOURCE=queue the reports are claimed from the report queue instead, and acknowledged once triaged.
 """
 
 import asyncio
+import functools
+import itertools
+import json
+import os
 import sys
-from threading import Lock
+import time
+from threading import Lock, Thread
 
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
 sys.path.append('/hai-on-hackerone/cli/')
-from actions import hai_actions
-from hai import send_to_hai
+import aiohttp
+import metrics
+from actions import replay_journal
+from api import close_session, get_report
+from config import load_settings
+from priority import observe_time_to_triage, priority_key, report_urgency
+from report_queue import get_report_queue
+from reports import triage_report
+from routing import parse_job
+from sink import close_sink
+from termcolor import colored
+
+settings = load_settings()
 
 FILE_TO_WATCH = "/hai-on-hackerone/webserver/data/report_ids.txt"
-line_count_lock = Lock()
+# The number of retrieved reports waiting for a worker, per worker.
+PREFETCH_PER_WORKER = 25
+tailer_lock = Lock()
+
+class FileTailer:
+    """
+    Read the lines appended to a file since the last read
+
+    The tailer keeps the byte offset up to which the file has been read, so every read only costs the new bytes.
+    A last line without a newline is kept until the rest of it is written. When the file shrinks below the offset
+    (truncation) or is replaced by another file (rotation), it is read again from the start and its generation
+    is increased.
+    """
+    def __init__(self, filepath, offset=0, inode=None):
+        self.filepath = filepath
+        self.offset = offset
+        self.partial = b""
+        self.inode = inode
+        self.generation = 0
+
+    def read_new_lines(self):
+        """
+        Return the complete lines appended since the last read, with the offset of the end of every line
+        """
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return []
+        if self.inode is not None and stat.st_ino != self.inode:
+            print(colored(f"{self.filepath} has been replaced, reading it from the start", 'yellow'))
+            self.offset, self.partial, self.generation = 0, b"", self.generation + 1
+        elif stat.st_size < self.offset:
+            print(colored(f"{self.filepath} has been truncated, reading it from the start", 'yellow'))
+            self.offset, self.partial, self.generation = 0, b"", self.generation + 1
+        self.inode = stat.st_ino
+        if stat.st_size == self.offset:
+            return []
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        position = self.offset - len(self.partial)
+        self.offset += len(data)
+        *lines, self.partial = (self.partial + data).split(b"\n")
+        new_lines = []
+        for line in lines:
+            position += len(line) + 1
+            if line.strip():
+                new_lines.append((line.decode('UTF-8').strip(), position))
+        return new_lines
+
+class Checkpoint:
+    """
+    Persist the offset up to which every report in the file has been triaged
+
+    Reports finish out of order, so the checkpoint only moves past a line once every line before it is done. It is
+    written to disk after WATCHER_CHECKPOINT_EVERY reports or WATCHER_CHECKPOINT_SECONDS, whichever comes first, and
+    when the watcher stops, rather than once per line. The seconds are checked whenever a report finishes, and by
+    `save_if_due` while the watcher is idle.
+
+    A report that fails does not hold the checkpoint back forever: it is put on a retry list, which is written
+    together with the offset, and triaged again when the watcher restarts until it succeeds.
+    """
+    def __init__(self, path, every, seconds):
+        self.path = path
+        self.every = max(1, every)
+        self.seconds = seconds
+        self.lock = Lock()
+        self.offset, self.inode, self.failed = self.load()
+        self.generation = 0
+        self.in_flight = {}
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
 
-def get_line_count(filepath):
-    """ 
-    Get the line count of the file
+    def load(self):
+        """
+        Return the offset, inode and retry list of the last checkpoint, or None for both and no retries when there is none
+        """
+        try:
+            with open(self.path, encoding='UTF-8') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None, None, []
+        return checkpoint["offset"], checkpoint["inode"], checkpoint.get("failed", [])
+
+    def track(self, generation, inode, end_offset):
+        """
+        Record that the line ending at an offset has been queued
+        """
+        with self.lock:
+            if generation != self.generation:
+                self.generation, self.offset, self.in_flight = generation, 0, {}
+            self.inode = inode
+            self.in_flight[end_offset] = False
+
+    def mark_done(self, generation, end_offset):
+        """
+        Record that the report on the line ending at an offset has been triaged, and save the checkpoint when due
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.in_flight[end_offset] = True
+            # The dict keeps the order in which the lines were queued, which is the order of their offsets.
+            while self.in_flight:
+                offset = next(iter(self.in_flight))
+                if not self.in_flight[offset]:
+                    break
+                del self.in_flight[offset]
+                self.offset = offset
+                self.unsaved += 1
+            if self.unsaved >= self.every or self._due():
+                self._save()
+
+    def save_if_due(self):
+        """
+        Write the checkpoint to disk when triaged reports have waited WATCHER_CHECKPOINT_SECONDS to be written
+        """
+        with self.lock:
+            if self._due():
+                self._save()
+
+    def _due(self):
+        return self.unsaved and time.monotonic() - self.saved_at >= self.seconds
+
+    def settle(self, generation, end_offset, job, error):
+        """
+        Record the outcome of the report on the line ending at an offset, putting it on the retry list when it failed
+        """
+        if error is not None:
+            with self.lock:
+                if job not in self.failed:
+                    self.failed.append(job)
+        self.mark_done(generation, end_offset)
+
+    def retried(self, job, error):
+        """
+        Record the outcome of a report of the retry list, removing it from the list when it succeeded
+        """
+        if error is None:
+            with self.lock:
+                if job in self.failed:
+                    self.failed.remove(job)
+                    self._save()
+
+    def save(self):
+        """
+        Write the checkpoint to disk
+        """
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.tmp", "w", encoding='UTF-8') as f:
+            json.dump({"offset": self.offset, "inode": self.inode, "failed": self.failed}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{self.path}.tmp", self.path)
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+
+def process_new_lines(tailer, checkpoint, workers):
     """
-    with open(filepath, 'r', encoding='UTF-8') as f:
-        return sum(1 for _ in f)
+    Queue the new lines in the file for the triage workers
+    """
+    for report_number, end_offset in tailer.read_new_lines():
+        checkpoint.track(tailer.generation, tailer.inode, end_offset)
+        workers.enqueue(report_number, functools.partial(checkpoint.settle, tailer.generation, end_offset, report_number))
 
-initial_line_count = get_line_count(FILE_TO_WATCH)
+def retry_failed(checkpoint, workers):
+    """
+    Queue the reports that failed before the watcher was restarted
+    """
+    if checkpoint.failed:
+        print(colored(f"Retrying {len(checkpoint.failed)} report(s) that failed before", 'yellow'))
+    for job in list(checkpoint.failed):
+        workers.enqueue(job, functools.partial(checkpoint.retried, job))
 
-def process_new_lines(filepath, initial_count):
+async def retrieve_report(job):
     """
-    Process new lines in the file
+    Retrieve the report of a job, or return None when it cannot be retrieved
     """
-    with open(filepath, 'r', encoding='UTF-8') as f:
-        lines = f.readlines()
-    new_lines = lines[initial_count:]
-    for line in new_lines:
-        report_number = line.strip()
-        asyncio.run(run_python_tool(report_number))
-    return len(lines)
+    report_number, _ = parse_job(job)
+    try:
+        return await get_report(report_number)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(colored(f"Could not retrieve report {report_number}, triaging it without the cache: {e}", 'yellow'))
+        return None
 
-async def run_python_tool(report_number):
+async def run_python_tool(job, report_data):
     """
     Run the python tool
+
+    A job is a report ID, optionally followed by the evaluations to run again (see routing.py).
     """
+    report_number, evaluations = parse_job(job)
     verbose = True
     comment_hai_flag = False
     custom_field_hai_flag = True
     csv_output_flag = False
-    (
-        predictedValidity,
-        predictedValidityCertaintyScore,
-        predictedValidityReasoning,
-        predictedComplexity,
-        predictedComplexityCertaintyScore,
-        predictedComplexityReasoning,
-        predictedOwnershipCertaintyScore,
-        predictedOwnershipReasoning,
-        productArea,
-        squadOwner
-    ) = await send_to_hai(report_number, verbose)
-
-    hai_actions(
-        predictedValidity,
-        predictedValidityCertaintyScore,
-        predictedValidityReasoning,
-        predictedComplexity,
-        predictedComplexityCertaintyScore,
-        predictedComplexityReasoning,
-        predictedOwnershipCertaintyScore,
-        predictedOwnershipReasoning,
-        productArea,
-        squadOwner,
-        report_number,
-        comment_hai_flag,
-        custom_field_hai_flag,
-        csv_output_flag,
-        verbose
-)
+    await triage_report(report_number, verbose, comment_hai_flag, custom_field_hai_flag, csv_output_flag, hai_options={"evaluations": evaluations}, report_data=report_data)
+
+class TriageWorkers:
+    """
+    Triage queued reports on a long-lived event loop
+
+    The event loop runs in its own thread, so the watchdog callback only has to hand it report IDs. The workers share
+    the HTTP session of the loop and triage up to WATCHER_CONCURRENCY reports at the same time.
+
+    Queued reports are retrieved ahead of their triage, which is cheap next to the triage itself, by as many retrievers
+    as there are workers. Up to PREFETCH_PER_WORKER retrieved reports per worker wait in a priority queue that the
+    workers take the most urgent report from (see priority.py); the other queued report IDs wait in the order they
+    came in. The retrieved report also lets an unchanged report be answered from the result cache.
+    """
+    def __init__(self, concurrency):
+        self.concurrency = max(1, concurrency)
+        self.loop = asyncio.new_event_loop()
+        self.jobs = None
+        self.queue = None
+        self.prefetch = None
+        self.tasks = []
+        self.order = itertools.count()
+        self.thread = Thread(target=self.loop.run_forever, name="triage-workers", daemon=True)
+
+    def start(self):
+        """
+        Start the event loop and the workers, after replaying the unfinished actions of a previous run
+        """
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        self.jobs = asyncio.Queue()
+        self.queue = asyncio.PriorityQueue()
+        self.prefetch = asyncio.Semaphore(self.concurrency * PREFETCH_PER_WORKER)
+        await replay_journal(True)
+        self.tasks = [asyncio.create_task(self.retriever()) for _ in range(self.concurrency)]
+        self.tasks += [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    def enqueue(self, report_number, on_done=None):
+        """
+        Queue a report for triage, from any thread
+
+        on_done is called with the exception of the report, or None when it succeeded, once it has been triaged.
+        """
+        self.loop.call_soon_threadsafe(self.jobs.put_nowait, (report_number, on_done, time.monotonic()))
+
+    async def retriever(self):
+        """
+        Retrieve queued reports and queue them by their priority key until cancelled
+
+        A report that cannot be ranked is reported to its on_done as failed, and the retriever carries on.
+        """
+        while True:
+            report_number, on_done, queued_at = await self.jobs.get()
+            await self.prefetch.acquire()
+            try:
+                report_data = await retrieve_report(report_number)
+                key = priority_key(report_urgency(report_data), queued_at)
+            except Exception as e:  # pylint: disable=W0718
+                # The report never reaches a worker, so its prefetch slot and its outcome are settled here.
+                self.prefetch.release()
+                print(colored(f"Report {report_number} failed: {e}", 'light_red'))
+                if on_done is not None:
+                    on_done(e)
+                continue
+            self.queue.put_nowait((key, next(self.order), report_number, report_data, queued_at, on_done))
+
+    async def worker(self):
+        """
+        Triage the most urgent report of the queue until cancelled
+        """
+        while True:
+            _, _, report_number, report_data, queued_at, on_done = await self.queue.get()
+            self.prefetch.release()
+            error = None
+            try:
+                await run_python_tool(report_number, report_data)
+                observe_time_to_triage(report_data, queued_at)
+            except Exception as e:  # pylint: disable=W0718
+                print(colored(f"Report {report_number} failed: {e}", 'light_red'))
+                error = e
+            if on_done is not None:
+                on_done(error)
+            self.queue.task_done()
+
+    async def consume(self, report_queue):
+        """
+        Claim reports from the report queue whenever a worker is free, until cancelled
+
+        A report is acknowledged once it has been triaged. A failed report is given back to be retried after
+        REPORT_QUEUE_RETRY_DELAY seconds.
+        """
+        in_flight = 0
+
+        def settle(job, error):
+            nonlocal in_flight
+            in_flight -= 1
+            if error is None:
+                report_queue.ack(job)
+            else:
+                report_queue.nack(job, settings.report_queue_retry_delay)
+
+        while True:
+            jobs = report_queue.claim(self.concurrency - in_flight) if in_flight < self.concurrency else []
+            if not jobs:
+                await asyncio.sleep(settings.report_queue_poll_interval)
+                continue
+            for job in jobs:
+                in_flight += 1
+                self.jobs.put_nowait((job.report_id, functools.partial(settle, job), time.monotonic()))
+
+    def stop(self):
+        """
+        Cancel the workers, close the session, print the metrics summary and stop the event loop
+        """
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        close_sink()
+        await close_session()
+        metrics.print_summary()
 
 class FileChangeHandler(FileSystemEventHandler):
     """
     Handle file changes
     """
-    def __init__(self, filepath):
+    def __init__(self, filepath, checkpoint, workers):
         super().__init__()
         self.filepath = filepath
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.tailer = FileTailer(filepath, checkpoint.offset, checkpoint.inode)
 
     def on_modified(self, event):
         if event.src_path == self.filepath:
-            global initial_line_count
-            with line_count_lock:
-                initial_line_count = process_new_lines(self.filepath, initial_line_count)
+            self.process()
+
+    def process(self):
+        """
+        Queue the lines appended since the last event
+        """
+        with tailer_lock:
+            process_new_lines(self.tailer, self.checkpoint, self.workers)
+
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_moved(self, event):
+        if event.dest_path == self.filepath:
+            self.process()
 
 def monitor_file(filepath):
     """
-    Monitor the file for changes and process new lines
+    Monitor the file for changes and queue new lines for the triage workers
     """
-    event_handler = FileChangeHandler(filepath)
+    checkpoint = Checkpoint(settings.watcher_checkpoint_file_path, settings.watcher_checkpoint_every, settings.watcher_checkpoint_seconds)
+    if checkpoint.offset is None:
+        # Without a checkpoint, the reports already in the file are treated as triaged by an earlier version.
+        stat = os.stat(filepath)
+        checkpoint.offset, checkpoint.inode = stat.st_size, stat.st_ino
+        checkpoint.save()
+    workers = TriageWorkers(settings.watcher_concurrency)
+    workers.start()
+    retry_failed(checkpoint, workers)
+    event_handler = FileChangeHandler(filepath, checkpoint, workers)
     observer = Observer()
-    observer.schedule(event_handler, path=filepath, recursive=False)
+    # The directory is watched rather than the file, so a rotated file is still seen.
+    observer.schedule(event_handler, path=os.path.dirname(filepath), recursive=False)
     observer.start()
+    # Queue the reports that arrived while the watcher was not running.
+    event_handler.process()
     try:
-        observer.join()
+        while observer.is_alive():
+            observer.join(max(checkpoint.seconds, 0.1))
+            checkpoint.save_if_due()
     except KeyboardInterrupt:
         observer.stop()
+        observer.join()
+    finally:
+        workers.stop()
+        checkpoint.save()
+
+def consume_queue():
+    """
+    Triage the reports of the report queue
+    """
+    workers = TriageWorkers(settings.watcher_concurrency)
+    workers.start()
+    consumer = asyncio.run_coroutine_threadsafe(workers.consume(get_report_queue()), workers.loop)
+    try:
+        consumer.result()
+    except KeyboardInterrupt:
+        consumer.cancel()
+    finally:
+        workers.stop()
 
 if __name__ == "__main__":
-    monitor_file(FILE_TO_WATCH)
+    if settings.report_source == "queue":
+        consume_queue()
+    else:
+        monitor_file(FILE_TO_WATCH)
@@ -1,44 +1,23 @@
-# pylint: disable=R1705
 """
 This is the main file for the webserver. It contains the Flask app and the webhook endpoint.
+
+The request is validated and answered by the ingestor (see ingest.py); the same ingestor backs the ASGI app in asgi.py.
+With REPORT_SOURCE=queue the report IDs are added to the report queue instead of report_ids.txt.
+
+Repeated deliveries (the same X-H1-Delivery header) are dropped, and a report that has already been queued within
+WEBHOOK_COALESCE_SECONDS is not queued again, so a burst of events for one report leads to a single triage.
 """
 
-import os
-import hmac
 from flask import Flask, request
+from webserver.ingest import create_ingestor
 
 app = Flask(__name__)
-
-def validate_request(data, signature):
-    """
-    Validate the request
-    """
-    [ _, digest ] = signature.split('=')
-    generated_digest = hmac.new(
-        os.environ.get("WEBHOOK_SECRET").encode(),
-        str(data).encode(),
-        "sha256"
-    ).hexdigest()
-
-    return hmac.compare_digest(digest, generated_digest)
+ingestor = create_ingestor()
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
     """
     Webhook endpoint
     """
-    data = request.get_json()
-    body = request.data.decode()
-    if 'X-H1-signature' in request.headers:
-        if validate_request(body, request.headers['X-H1-signature']):
-            report_id = data.get('data', {}).get('report', {}).get('id')
-
-            if report_id:
-                with open('/hai-on-hackerone/webserver/data/report_ids.txt', 'a', encoding='UTF-8') as file:
-                    file.write(f'{report_id}\n')
-
-            return {"success": True}, 200
-        else:
-            return {"success": False, "error": "Incorrect signature"}, 401
-    else:
-        return {"success": False, "error": "Missing 'X-H1-Signature' header"}, 400
+    status, response = ingestor.handle(request.get_data(), request.headers.get('X-H1-Signature'), request.headers.get('X-H1-Delivery'), request.headers.get('X-H1-Event'))
+    return response, status
@@ -0,0 +1,58 @@
+"""
+ASGI app with the webhook endpoint, for async servers such as uvicorn:
+
+    uvicorn webserver.asgi:app --host 0.0.0.0 --port 5000
+
+It validates and answers requests with the same ingestor as the Flask app in app.py.
+"""
+
+import json
+
+from webserver.ingest import create_ingestor
+
+ingestor = create_ingestor()
+
+async def send_json(send, status, response):
+    """
+    Send a JSON response
+    """
+    body = json.dumps(response).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def app(scope, receive, send):
+    """
+    Webhook endpoint
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] != "/webhook":
+        await send_json(send, 404, {"success": False, "error": "Not found"})
+        return
+    if scope["method"] != "POST":
+        await send_json(send, 405, {"success": False, "error": "Method not allowed"})
+        return
+
+    headers = dict(scope["headers"])
+    signature = headers.get(b"x-h1-signature", b"").decode("latin-1")
+    delivery_id = headers.get(b"x-h1-delivery", b"").decode("latin-1")
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    status, response = ingestor.handle(b"".join(chunks), signature, delivery_id, headers.get(b"x-h1-event", b"").decode("latin-1"))
+    await send_json(send, status, response)
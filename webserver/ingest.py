@@ -0,0 +1,113 @@
+# pylint: disable=C0413,E0401
+"""
+Webhook ingestion shared by the Flask app (app.py) and the ASGI app (asgi.py)
+
+A webhook request is checked in order of cost: the signature header, the route of its event type (X-H1-Event, see
+routing.py), the HMAC of the raw body bytes, the delivery ID, and only then the JSON body is parsed. Events that are
+routed to nothing are answered before the body is even hashed. The delivery ID and the job are only remembered once
+the body has been parsed, so a malformed delivery does not hide its redelivery. The job of the report is handed to a
+background writer and the request is answered with 202 right away, without waiting for the job to be written to
+report_ids.txt or the report queue. The writer retries a failed write until it succeeds and saves the jobs it could
+not write when it is closed (see report_queue.py), so an accepted job is never dropped and the delivery and its job
+stay remembered: a redelivery is not written a second time. The job is written with the urgency of the report in the webhook payload, so the report queue
+hands out urgent reports first (see priority.py).
+"""
+
+import atexit
+import hmac
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cli'))
+from config import load_settings
+from dedup import RecentKeys
+from priority import report_urgency
+from report_queue import BatchingEnqueuer, get_enqueuer
+from routing import IGNORE, job_line, load_routes
+from termcolor import colored
+
+settings = load_settings()
+
+REPORT_IDS_FILE = "/hai-on-hackerone/webserver/data/report_ids.txt"
+
+def verify_signature(secret, body, signature):
+    """
+    Verify the X-H1-Signature header ("sha256=<hex digest>") against the HMAC of the raw body bytes
+    """
+    if not secret or not signature:
+        return False
+    _, _, digest = signature.partition('=')
+    generated_digest = hmac.new(secret, body, "sha256").hexdigest()
+    return hmac.compare_digest(digest, generated_digest)
+
+class ReportFile:
+    """
+    Append report IDs to report_ids.txt, one write per batch
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def enqueue(self, report_ids, urgencies=None):  # pylint: disable=W0613
+        """
+        Append report IDs to the file
+
+        The urgencies are not written: the watcher ranks the reports of the file once it has retrieved them.
+        """
+        with open(self.path, 'a', encoding='UTF-8') as file:
+            file.write("".join(f'{report_id}\n' for report_id in report_ids))
+
+class Ingestor:
+    """
+    Validate webhook requests and hand their report IDs to a writer
+    """
+    def __init__(self, secret, writer):
+        self.secret = secret
+        self.writer = writer
+        self.routes, self.default_route = load_routes()
+        self.recent_deliveries = RecentKeys(settings.webhook_delivery_window, settings.webhook_dedup_max_entries)
+        self.recent_reports = RecentKeys(settings.webhook_coalesce_seconds, settings.webhook_dedup_max_entries)
+
+    def handle(self, body, signature, delivery_id=None, event=None):
+        """
+        Handle a webhook request and return the status code and the JSON response
+        """
+        if not signature:
+            return 400, {"success": False, "error": "Missing 'X-H1-Signature' header"}
+        route = self.routes.get(event, self.default_route) if event else self.default_route
+        if route.action == IGNORE:
+            return 202, {"success": True, "ignored": True}
+        if not verify_signature(self.secret, body, signature):
+            return 401, {"success": False, "error": "Incorrect signature"}
+        if delivery_id and delivery_id in self.recent_deliveries:
+            return 202, {"success": True, "duplicate": True}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, {"success": False, "error": "Invalid JSON body"}
+        if delivery_id and not self.recent_deliveries.add(delivery_id):
+            return 202, {"success": True, "duplicate": True}
+        report = data.get('data', {}).get('report', {}) if isinstance(data, dict) else {}
+        report_id = report.get('id') if isinstance(report, dict) else None
+        if not report_id:
+            return 202, {"success": True, "queued": False}
+        # A full triage of the report in the window covers any partial re-evaluation of it.
+        job = job_line(report_id, route.evaluations)
+        if str(report_id) in self.recent_reports or not self.recent_reports.add(job):
+            return 202, {"success": True, "coalesced": True}
+        self.writer.put(job, report_urgency(report))
+        return 202, {"success": True, "queued": True}
+
+def create_ingestor():
+    """
+    Create the ingestor of this process, reading the webhook secret once
+    """
+    secret = os.environ.get("WEBHOOK_SECRET", "").encode()
+    if not secret:
+        print(colored("WEBHOOK_SECRET is not set, every webhook request will be rejected", 'light_red'))
+    if settings.report_source == "queue":
+        writer = get_enqueuer()
+    else:
+        writer = BatchingEnqueuer(ReportFile(REPORT_IDS_FILE), settings.report_queue_batch_size, settings.report_queue_flush_seconds, f"{REPORT_IDS_FILE}.unwritten")
+        atexit.register(writer.close)
+    return Ingestor(secret, writer)
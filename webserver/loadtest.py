@@ -0,0 +1,81 @@
+"""
+Webhook load test
+
+Sends signed webhook requests to a running webhook endpoint from many connections at the same time, and prints the
+sustained requests per second, the latency percentiles and the status codes. Every request is for a different
+report, so coalescing does not hide any of them.
+
+Usage:
+    WEBHOOK_SECRET=secret python webserver/loadtest.py --url http://localhost:5000/webhook --connections 50 --duration 10
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import statistics
+import time
+import uuid
+from collections import Counter
+
+import aiohttp
+
+def signed_request(secret, report_id):
+    """
+    Return the body and headers of a signed webhook request for a report
+    """
+    body = json.dumps({"data": {"report": {"id": str(report_id)}}}).encode()
+    signature = hmac.new(secret, body, "sha256").hexdigest()
+    headers = {
+        "Content-Type": "application/json",
+        "X-H1-Signature": f"sha256={signature}",
+        "X-H1-Delivery": str(uuid.uuid4())
+    }
+    return body, headers
+
+async def run_load(url, secret, connections, duration):
+    """
+    Send requests from every connection until the duration is over
+    """
+    latencies = []
+    statuses = Counter()
+    deadline = time.monotonic() + duration
+    next_report_id = iter(range(10_000_000, 100_000_000))
+
+    async def client(session):
+        while time.monotonic() < deadline:
+            body, headers = signed_request(secret, next(next_report_id))
+            start = time.perf_counter()
+            async with session.post(url, data=body, headers=headers) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] += 1
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.monotonic()
+        await asyncio.gather(*(client(session) for _ in range(connections)))
+        elapsed = time.monotonic() - start
+    return latencies, statuses, elapsed
+
+def main():
+    """
+    Run the load test
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5000/webhook", help="URL of the webhook endpoint")
+    parser.add_argument("--connections", type=int, default=50, help="Number of concurrent connections")
+    parser.add_argument("--duration", type=float, default=10, help="Number of seconds to send requests for")
+    args = parser.parse_args()
+
+    secret = os.environ.get("WEBHOOK_SECRET", "").encode()
+    latencies, statuses, elapsed = asyncio.run(run_load(args.url, secret, args.connections, args.duration))
+    latencies.sort()
+    print(f"Requests:          {len(latencies)} in {elapsed:.1f}s ({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"Latency p50:       {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"Latency p99:       {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    print(f"Status codes:      {dict(statuses)}")
+
+if __name__ == "__main__":
+    main()